@@ -13,4 +13,9 @@ interface ILiquidityGaugeController {
     function vote_user_power(address user) external view returns (uint256);
 
     function gauge_types(address gauge) external view returns (int128);
+
+    function gauge_relative_weight(address gauge, uint256 time)
+        external
+        view
+        returns (uint256);
 }
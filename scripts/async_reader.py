@@ -0,0 +1,170 @@
+import asyncio
+import itertools
+import json
+import aiohttp
+from brownie import web3
+from brownie.network.state import Chain
+
+chain = Chain()
+
+DEFAULT_MAX_IN_FLIGHT = 32
+REQUEST_TIMEOUT = 60
+
+class _HTTPTransport:
+    """JSON-RPC over a keep-alive connection pool sized to the in-flight limit"""
+
+    def __init__(self, url, maxInFlight) -> None:
+        self.url = url
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=maxInFlight),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        )
+
+    async def request(self, payload):
+        async with self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def close(self):
+        await self.session.close()
+
+class _WebSocketTransport:
+    """JSON-RPC over a single websocket, responses are matched to requests by id"""
+
+    def __init__(self, url, maxInFlight) -> None:
+        self.url = url
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        self.socket = None
+        self.pending = {}
+        self._connecting = asyncio.Lock()
+        self._receiver = None
+
+    async def _connect(self):
+        async with self._connecting:
+            if self.socket is None:
+                self.socket = await self.session.ws_connect(self.url, max_msg_size=0)
+                self._receiver = asyncio.ensure_future(self._receive())
+
+    async def _receive(self):
+        async for message in self.socket:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            response = json.loads(message.data)
+            future = self.pending.pop(response.get("id"), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        # The socket closed, fail everything still waiting
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Websocket closed"))
+        self.pending.clear()
+
+    async def request(self, payload):
+        await self._connect()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[payload["id"]] = future
+        try:
+            await self.socket.send_str(json.dumps(payload))
+            return await asyncio.wait_for(future, REQUEST_TIMEOUT)
+        finally:
+            self.pending.pop(payload["id"], None)
+
+    async def close(self):
+        if self.socket is not None:
+            await self.socket.close()
+            await self._receiver
+        await self.session.close()
+
+class AsyncReader:
+    """Runs read only contract calls as concurrent eth_calls, all pinned to the same block.
+
+    Calls are (contract, method name, args) tuples like in BatchReader. Contracts are the
+    brownie objects from the Environment or the registry, they are only used to encode the
+    inputs and decode the outputs so no ABI is loaded twice. At most maxInFlight requests
+    are sent at once over a pooled HTTP connection or a single websocket, results are
+    returned in call order.
+
+        async with AsyncReader(env) as reader:
+            balances = await reader.balanceOf(accounts)
+    """
+
+    def __init__(self, env, url=None, block=None, maxInFlight=DEFAULT_MAX_IN_FLIGHT) -> None:
+        self.env = env
+        self.url = web3.provider.endpoint_uri if url is None else url
+        # Pin every call to the same block so results are a consistent snapshot
+        self.block = chain.height if block is None else block
+        self.maxInFlight = maxInFlight
+        self.transport = None
+        self._ids = itertools.count()
+        self._semaphore = None
+
+    async def __aenter__(self):
+        transport = _WebSocketTransport if self.url.startswith("ws") else _HTTPTransport
+        self.transport = transport(self.url, self.maxInFlight)
+        self._semaphore = asyncio.Semaphore(self.maxInFlight)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transport.close()
+        self.transport = None
+
+    async def _ethCall(self, to, data):
+        payload = {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": "eth_call",
+            "params": [{"to": str(to), "data": data}, hex(self.block)]
+        }
+        async with self._semaphore:
+            response = await self.transport.request(payload)
+        if "error" in response:
+            # Same exception type as web3 for node errors and reverts
+            raise ValueError(response["error"])
+        return response["result"]
+
+    async def call(self, contract, name, args=[]):
+        method = getattr(contract, name)
+        returnData = await self._ethCall(contract.address, method.encode_input(*args))
+        return method.decode_output(returnData)
+
+    async def callMany(self, calls, allowFailure=False):
+        """Executes a list of (contract, method name, args) tuples concurrently. Failed calls
+        return None when allowFailure is set."""
+        return await asyncio.gather(*[
+            self._callOrNone(contract, name, args) if allowFailure else self.call(contract, name, args)
+            for (contract, name, args) in calls
+        ])
+
+    async def _callOrNone(self, contract, name, args):
+        try:
+            return await self.call(contract, name, args)
+        except ValueError:
+            return None
+
+    def _callForAccounts(self, contract, name, accounts):
+        return self.callMany([(contract, name, [account]) for account in accounts])
+
+    async def balanceOf(self, accounts):
+        return await self._callForAccounts(self.env.sNOTE, "balanceOf", accounts)
+
+    async def accountRedeemWindowBegin(self, accounts):
+        return await self._callForAccounts(self.env.sNOTE, "accountRedeemWindowBegin", accounts)
+
+    async def votingPowerWithoutDelegation(self, accounts):
+        return await self._callForAccounts(self.env.sNOTE, "votingPowerWithoutDelegation", accounts)
+
+    async def getVotingPower(self, sNOTEAmounts):
+        return await self.callMany([(self.env.sNOTE, "getVotingPower", [amount]) for amount in sNOTEAmounts])
+
+    async def totalSupply(self):
+        return await self.call(self.env.sNOTE, "totalSupply")
+
+    async def getPoolTokens(self):
+        return await self.call(self.env.balancerVault, "getPoolTokens", [self.env.poolId])
+
+def readAll(env, calls, **kwargs):
+    """Synchronous entry point for scripts, runs callMany on a new event loop"""
+    async def run():
+        async with AsyncReader(env, **kwargs) as reader:
+            return await reader.callMany(calls)
+    return asyncio.run(run())
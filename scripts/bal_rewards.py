@@ -0,0 +1,265 @@
+import json
+import os
+from bisect import bisect_right
+from collections import namedtuple
+from brownie import web3
+from brownie.network.state import Chain
+from scripts.environment import EnvironmentConfig, create_environment
+from scripts.event_indexer import EventIndexer
+from scripts.multicall import BatchReader
+
+chain = Chain()
+
+# GaugeController weights change at week boundaries
+WEEK = 7 * 86400
+WEIGHT_PRECISION = 10**18
+# BalancerTokenAdmin emissions drop by 2 ** (1/4) every year
+RATE_REDUCTION_TIME = 365 * 86400
+RATE_REDUCTION_COEFFICIENT = 1189207115002721024
+
+# kind is "claimed" (sNOTE ClaimedBAL) or "reinvested" (VaultRewardReinvested of BAL)
+LedgerEntry = namedtuple("LedgerEntry", ["timestamp", "blockNumber", "kind", "amount"])
+AccrualSample = namedtuple("AccrualSample", [
+    "timestamp",
+    "blockNumber",
+    "accrued",          # BAL accrued to sNOTE since it joined the gauge, minted or not
+    "claimable",        # the part of accrued that BalancerMinter has not minted yet
+])
+RewardSummary = namedtuple("RewardSummary", ["accrued", "claimed", "reinvested"])
+GaugeState = namedtuple("GaugeState", [
+    "timestamp",
+    "inflationRate",    # BAL per second emitted to all gauges
+    "futureEpochTime",
+    "workingBalance",   # sNOTE working balance in the gauge
+    "workingSupply",
+    "weights",          # week start => gauge_relative_weight, for the current and next week
+])
+RateSegment = namedtuple("RateSegment", ["start", "end", "rate", "amount"])
+ProjectedRewards = namedtuple("ProjectedRewards", ["segments", "total"])
+
+class BALRewardTracker:
+    """Ledger of the BAL that sNOTE accrues in the liquidity gauge, claims through
+    TreasuryManager.claimBAL and that TreasuryManager reinvests.
+
+    update() applies the events the indexer has stored since the last update, so a run only
+    reads the new blocks. Accrual is sampled at every sNOTE gauge checkpoint (UpdateLiquidityLimit,
+    claims), at the head and, on the first update, at the block before the indexer's fromBlock,
+    as the minted plus claimable BAL at that block. Between samples accrual is interpolated
+    linearly.
+
+    Entries and samples are kept sorted by timestamp with running totals, so range queries
+    are a bisect into local state. Projections use the gauge state read at the last update.
+
+        tracker = BALRewardTracker.load(path) if os.path.exists(path) else BALRewardTracker.fromConfig()
+        tracker.update(indexer, env)
+        tracker.summary(start, end)
+        tracker.save(path)
+    """
+
+    def __init__(self, snote, treasuryManager, liquidityGauge, bal) -> None:
+        self.snote = web3.toChecksumAddress(str(snote))
+        self.treasuryManager = web3.toChecksumAddress(str(treasuryManager))
+        self.liquidityGauge = web3.toChecksumAddress(str(liquidityGauge))
+        self.bal = web3.toChecksumAddress(str(bal))
+        self.entries = []
+        self.accruals = []
+        self.gaugeState = None
+        self._entryTimes = []
+        # kind => (timestamps, running totals)
+        self._totals = {"claimed": ([], []), "reinvested": ([], [])}
+        self._accrualTimes = []
+        self._blockTimes = {}
+        # (blockNumber, logIndex) of the last event applied
+        self.lastEvent = (-1, -1)
+
+    @classmethod
+    def fromConfig(cls, config=EnvironmentConfig):
+        return cls(config["sNOTE"], config["TreasuryManager"], config["LiquidityGauge"], config["BAL"])
+
+    def update(self, indexer, env, toBlock=None):
+        """Runs the indexer, applies the events it has not seen yet and samples the gauge at
+        toBlock. Returns the number of ledger entries added."""
+        toBlock = chain.height if toBlock is None else toBlock
+        indexer.run(toBlock)
+        added = 0
+        checkpoints = []
+        if len(self.accruals) == 0 and indexer.fromBlock > 0:
+            # An indexer that starts after sNOTE joined the gauge misses the checkpoints before
+            # fromBlock, accrual from there to the first checkpoint is measured from this sample
+            checkpoints.append(indexer.fromBlock - 1)
+        for event in indexer.events(fromBlock=max(self.lastEvent[0], 0), toBlock=toBlock):
+            position = (event["blockNumber"], event["logIndex"])
+            if position <= self.lastEvent:
+                continue
+            self.lastEvent = position
+
+            (address, name, args) = (event["address"], event["event"], event["args"])
+            if address == self.snote and name == "ClaimedBAL":
+                # Minting checkpoints sNOTE in the gauge
+                self._addEntry(event["blockNumber"], "claimed", args["balAmount"])
+                checkpoints.append(event["blockNumber"])
+                added += 1
+            elif address == self.treasuryManager and name == "VaultRewardReinvested":
+                if web3.toChecksumAddress(args["rewardToken"]) == self.bal:
+                    self._addEntry(event["blockNumber"], "reinvested", args["amountSold"])
+                    added += 1
+            elif address == self.liquidityGauge and name == "UpdateLiquidityLimit":
+                if web3.toChecksumAddress(args["user"]) == self.snote:
+                    checkpoints.append(event["blockNumber"])
+
+        for block in sorted(set(checkpoints)):
+            self._sample(env, block)
+        self._sample(env, toBlock, readGaugeState=True)
+        return added
+
+    def _blockTime(self, block):
+        if block not in self._blockTimes:
+            self._blockTimes[block] = web3.eth.get_block(block)["timestamp"]
+        return self._blockTimes[block]
+
+    def _addEntry(self, block, kind, amount):
+        # Events arrive in chain order, entries and running totals only grow at the end
+        entry = LedgerEntry(self._blockTime(block), block, kind, amount)
+        self.entries.append(entry)
+        self._entryTimes.append(entry.timestamp)
+        (times, totals) = self._totals[kind]
+        times.append(entry.timestamp)
+        totals.append((totals[-1] if len(totals) > 0 else 0) + amount)
+
+    def _sample(self, env, block, readGaugeState=False):
+        calls = [
+            (env.liquidityGauge, "claimable_tokens", [self.snote]),
+            (env.balancerMinter, "minted", [self.snote, self.liquidityGauge]),
+        ]
+        timestamp = self._blockTime(block)
+        if readGaugeState:
+            week = (timestamp // WEEK) * WEEK
+            calls += [
+                (env.liquidityGauge, "inflation_rate", []),
+                (env.liquidityGauge, "future_epoch_time", []),
+                (env.liquidityGauge, "working_balances", [self.snote]),
+                (env.liquidityGauge, "working_supply", []),
+                (env.gaugeController, "gauge_relative_weight", [self.liquidityGauge, week]),
+                (env.gaugeController, "gauge_relative_weight", [self.liquidityGauge, week + WEEK]),
+            ]
+        results = BatchReader(env, block).call(calls)
+
+        (claimable, minted) = results[:2]
+        if len(self.accruals) == 0 or self.accruals[-1].blockNumber < block:
+            self.accruals.append(AccrualSample(timestamp, block, minted + claimable, claimable))
+            self._accrualTimes.append(timestamp)
+        if readGaugeState:
+            (inflationRate, futureEpochTime, workingBalance, workingSupply, weight, nextWeight) = results[2:]
+            self.gaugeState = GaugeState(
+                timestamp, inflationRate, futureEpochTime, workingBalance, workingSupply,
+                {week: weight, week + WEEK: nextWeight}
+            )
+
+    def accruedAt(self, timestamp):
+        """Accrued BAL at timestamp, outside the sampled range the nearest sample is used"""
+        if len(self.accruals) == 0:
+            return 0
+        i = bisect_right(self._accrualTimes, timestamp)
+        if i == 0:
+            return self.accruals[0].accrued
+        if i == len(self.accruals):
+            return self.accruals[-1].accrued
+        (before, after) = (self.accruals[i - 1], self.accruals[i])
+        return before.accrued + (after.accrued - before.accrued) * (timestamp - before.timestamp) // (after.timestamp - before.timestamp)
+
+    def totalAt(self, kind, timestamp):
+        """Claimed or reinvested BAL up to and including timestamp"""
+        (times, totals) = self._totals[kind]
+        i = bisect_right(times, timestamp)
+        return 0 if i == 0 else totals[i - 1]
+
+    def summary(self, start, end):
+        """BAL accrued, claimed and reinvested in the interval (start, end]"""
+        return RewardSummary(
+            self.accruedAt(end) - self.accruedAt(start),
+            self.totalAt("claimed", end) - self.totalAt("claimed", start),
+            self.totalAt("reinvested", end) - self.totalAt("reinvested", start),
+        )
+
+    def ledger(self, start, end):
+        """Claims and reinvestments with start < timestamp <= end in chain order"""
+        lo = bisect_right(self._entryTimes, start)
+        hi = bisect_right(self._entryTimes, end)
+        return self.entries[lo:hi]
+
+    def project(self, start, end):
+        """BAL accruing to sNOTE between start and end at the last read gauge state. The gauge
+        share of emissions comes from its GaugeController weight for each week, weeks after the
+        next one keep the next week's weight. Emissions drop at every yearly epoch, the working
+        balance and supply are held constant."""
+        state = self.gaugeState
+        if state is None or state.workingSupply == 0:
+            return ProjectedRewards([], 0)
+        (inflationRate, epochEnd) = (state.inflationRate, state.futureEpochTime)
+        (firstWeek, lastWeek) = (min(state.weights), max(state.weights))
+
+        segments = []
+        t = start
+        while t < end:
+            while epochEnd <= t:
+                inflationRate = inflationRate * WEIGHT_PRECISION // RATE_REDUCTION_COEFFICIENT
+                epochEnd += RATE_REDUCTION_TIME
+            week = (t // WEEK) * WEEK
+            weight = state.weights[min(max(week, firstWeek), lastWeek)]
+            stop = min(week + WEEK, epochEnd, end)
+            rate = inflationRate * weight // WEIGHT_PRECISION * state.workingBalance // state.workingSupply
+            segments.append(RateSegment(t, stop, rate, rate * (stop - t)))
+            t = stop
+        return ProjectedRewards(segments, sum(s.amount for s in segments))
+
+    def save(self, path):
+        state = None if self.gaugeState is None else self.gaugeState._replace(
+            weights=dict((str(k), str(v)) for (k, v) in self.gaugeState.weights.items())
+        )
+        with open(path, "w") as f:
+            json.dump({
+                "contracts": [self.snote, self.treasuryManager, self.liquidityGauge, self.bal],
+                "lastEvent": list(self.lastEvent),
+                # BAL amounts do not fit in JSON numbers, integers are stored as strings
+                "entries": [[e.timestamp, e.blockNumber, e.kind, str(e.amount)] for e in self.entries],
+                "accruals": [[a.timestamp, a.blockNumber, str(a.accrued), str(a.claimable)] for a in self.accruals],
+                "gaugeState": None if state is None else [str(v) if isinstance(v, int) else v for v in state],
+            }, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        tracker = cls(*data["contracts"])
+        for (timestamp, block, kind, amount) in data["entries"]:
+            tracker._blockTimes[block] = timestamp
+            tracker._addEntry(block, kind, int(amount))
+        for (timestamp, block, accrued, claimable) in data["accruals"]:
+            tracker.accruals.append(AccrualSample(timestamp, block, int(accrued), int(claimable)))
+            tracker._accrualTimes.append(timestamp)
+        if data["gaugeState"] is not None:
+            state = data["gaugeState"]
+            tracker.gaugeState = GaugeState(
+                *[int(v) for v in state[:5]],
+                dict((int(k), int(v)) for (k, v) in state[5].items())
+            )
+        tracker.lastEvent = tuple(data["lastEvent"])
+        return tracker
+
+def main(path="events.db", statePath="bal_rewards.json", days=30):
+    env = create_environment(lazy=True)
+    indexer = EventIndexer.forContracts(path, liquidityGauge=EnvironmentConfig["LiquidityGauge"])
+    tracker = BALRewardTracker.load(statePath) if os.path.exists(statePath) else BALRewardTracker.fromConfig()
+    added = tracker.update(indexer, env)
+    tracker.save(statePath)
+    indexer.close()
+
+    now = chain.time()
+    period = int(days) * 86400
+    summary = tracker.summary(now - period, now)
+    projected = tracker.project(now, now + period)
+    print("Added {} ledger entries".format(added))
+    print("Last {} days: accrued {:.4f} claimed {:.4f} reinvested {:.4f} BAL".format(
+        days, summary.accrued / 1e18, summary.claimed / 1e18, summary.reinvested / 1e18
+    ))
+    print("Next {} days: projected {:.4f} BAL".format(days, projected.total / 1e18))
@@ -0,0 +1,227 @@
+# Ports of the Balancer v2 LogExpMath, FixedPoint and WeightedMath libraries used by
+# WeightedPool2Tokens, integer for integer so results match the contracts to the wei
+
+# LogExpMath constants
+ONE_18 = 10**18
+ONE_20 = 10**20
+ONE_36 = 10**36
+MAX_NATURAL_EXPONENT = 130 * 10**18
+MIN_NATURAL_EXPONENT = -41 * 10**18
+LN_36_LOWER_BOUND = ONE_18 - 10**17
+LN_36_UPPER_BOUND = ONE_18 + 10**17
+MILD_EXPONENT_BOUND = 2**254 // ONE_20
+x0 = 128000000000000000000
+a0 = 38877084059945950922200000000000000000000000000000000000
+x1 = 64000000000000000000
+a1 = 6235149080811616882910000000
+# 20 decimal constants
+EXP_TERMS = [
+    (3200000000000000000000, 7896296018268069516100000000000000),
+    (1600000000000000000000, 888611052050787263676000000),
+    (800000000000000000000, 298095798704172827474000),
+    (400000000000000000000, 5459815003314423907810),
+    (200000000000000000000, 738905609893065022723),
+    (100000000000000000000, 271828182845904523536),
+    (50000000000000000000, 164872127070012814685),
+    (25000000000000000000, 128402541668774148407),
+]
+# _ln also uses x10 and x11
+LN_TERMS = EXP_TERMS + [
+    (12500000000000000000, 113314845306682631683),
+    (6250000000000000000, 106449445891785942956),
+]
+
+# FixedPoint constants
+ONE = ONE_18
+MAX_POW_RELATIVE_ERROR = 10000
+MIN_POW_BASE_FREE_EXPONENT = 7 * 10**17
+
+def _sdiv(a, b):
+    # Solidity signed division truncates towards zero
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+def _smod(a, b):
+    # Solidity signed modulo takes the sign of the dividend
+    return a - _sdiv(a, b) * b
+
+def exp(x):
+    """LogExpMath.exp, natural exponentiation of an 18 decimal fixed point number"""
+    if x < MIN_NATURAL_EXPONENT or x > MAX_NATURAL_EXPONENT:
+        raise Exception("Invalid exponent")
+    if x < 0:
+        return (ONE_18 * ONE_18) // exp(-x)
+
+    if x >= x0:
+        x -= x0
+        firstAN = a0
+    elif x >= x1:
+        x -= x1
+        firstAN = a1
+    else:
+        firstAN = 1
+
+    # Switch to 20 decimal precision for the remaining terms
+    x *= 100
+    product = ONE_20
+    for (xn, an) in EXP_TERMS:
+        if x >= xn:
+            x -= xn
+            product = (product * an) // ONE_20
+
+    # Taylor series for the remainder, up to the 12th term
+    seriesSum = ONE_20
+    term = x
+    seriesSum += term
+    for n in range(2, 13):
+        term = ((term * x) // ONE_20) // n
+        seriesSum += term
+
+    return (((product * seriesSum) // ONE_20) * firstAN) // 100
+
+def _ln(a):
+    if a < ONE_18:
+        return -_ln((ONE_18 * ONE_18) // a)
+
+    total = 0
+    if a >= a0 * ONE_18:
+        a //= a0
+        total += x0
+    if a >= a1 * ONE_18:
+        a //= a1
+        total += x1
+
+    # Switch to 20 decimal precision for the remaining terms
+    total *= 100
+    a *= 100
+    for (xn, an) in LN_TERMS:
+        if a >= an:
+            a = (a * ONE_20) // an
+            total += xn
+
+    # ln(a) = 2 * atanh(z), z = (a - 1) / (a + 1), a is now close to one so z is small
+    z = ((a - ONE_20) * ONE_20) // (a + ONE_20)
+    zSquared = (z * z) // ONE_20
+    num = z
+    seriesSum = num
+    for n in (3, 5, 7, 9, 11):
+        num = (num * zSquared) // ONE_20
+        seriesSum += num // n
+
+    return (total + seriesSum * 2) // 100
+
+def _ln_36(x):
+    # 36 decimal precision for arguments close to one
+    x *= ONE_18
+    z = _sdiv((x - ONE_36) * ONE_36, x + ONE_36)
+    zSquared = _sdiv(z * z, ONE_36)
+    num = z
+    seriesSum = num
+    for n in (3, 5, 7, 9, 11, 13, 15):
+        num = _sdiv(num * zSquared, ONE_36)
+        seriesSum += _sdiv(num, n)
+    return seriesSum * 2
+
+def ln(a):
+    """LogExpMath.ln of an 18 decimal fixed point number"""
+    if a <= 0:
+        raise Exception("Out of bounds")
+    if LN_36_LOWER_BOUND < a < LN_36_UPPER_BOUND:
+        return _sdiv(_ln_36(a), ONE_18)
+    return _ln(a)
+
+def pow(x, y):
+    """LogExpMath.pow, x to the power of y, both 18 decimal fixed point numbers"""
+    if y == 0:
+        return ONE_18
+    if x == 0:
+        return 0
+    if x >> 255 != 0:
+        raise Exception("X out of bounds")
+    if y >= MILD_EXPONENT_BOUND:
+        raise Exception("Y out of bounds")
+
+    if LN_36_LOWER_BOUND < x < LN_36_UPPER_BOUND:
+        ln36X = _ln_36(x)
+        # ln36X has 36 decimals, split it to keep the 18 decimal multiplication exact
+        logXTimesY = _sdiv(ln36X, ONE_18) * y + _sdiv(_smod(ln36X, ONE_18) * y, ONE_18)
+    else:
+        logXTimesY = _ln(x) * y
+    logXTimesY = _sdiv(logXTimesY, ONE_18)
+
+    if logXTimesY < MIN_NATURAL_EXPONENT or logXTimesY > MAX_NATURAL_EXPONENT:
+        raise Exception("Product out of bounds")
+    return exp(logXTimesY)
+
+def mulDown(a, b):
+    return (a * b) // ONE
+
+def mulUp(a, b):
+    product = a * b
+    return 0 if product == 0 else ((product - 1) // ONE) + 1
+
+def divDown(a, b):
+    if b == 0:
+        raise ZeroDivisionError("Zero division")
+    return (a * ONE) // b
+
+def divUp(a, b):
+    if b == 0:
+        raise ZeroDivisionError("Zero division")
+    return 0 if a == 0 else ((a * ONE - 1) // b) + 1
+
+def powDown(x, y):
+    raw = pow(x, y)
+    maxError = mulUp(raw, MAX_POW_RELATIVE_ERROR) + 1
+    return 0 if raw < maxError else raw - maxError
+
+def powUp(x, y):
+    raw = pow(x, y)
+    return raw + mulUp(raw, MAX_POW_RELATIVE_ERROR) + 1
+
+def complement(x):
+    return ONE - x if x < ONE else 0
+
+def calculateInvariant(normalizedWeights, balances):
+    """WeightedMath._calculateInvariant, balances are upscaled to 18 decimals"""
+    invariant = ONE
+    for (weight, balance) in zip(normalizedWeights, balances):
+        invariant = mulDown(invariant, powDown(balance, weight))
+    if invariant == 0:
+        raise Exception("Zero invariant")
+    return invariant
+
+def calcBptOutGivenExactTokensIn(balances, normalizedWeights, amountsIn, bptTotalSupply, swapFee):
+    """WeightedMath._calcBptOutGivenExactTokensIn, the non proportional part of the amounts
+    in pays the swap fee"""
+    balanceRatiosWithFee = []
+    invariantRatioWithFees = 0
+    for (balance, weight, amountIn) in zip(balances, normalizedWeights, amountsIn):
+        ratio = divDown(balance + amountIn, balance)
+        balanceRatiosWithFee.append(ratio)
+        invariantRatioWithFees += mulDown(ratio, weight)
+
+    invariantRatio = ONE
+    for (balance, weight, amountIn, ratioWithFee) in zip(balances, normalizedWeights, amountsIn, balanceRatiosWithFee):
+        if ratioWithFee > invariantRatioWithFees:
+            nonTaxableAmount = mulDown(balance, invariantRatioWithFees - ONE)
+            taxableAmount = amountIn - nonTaxableAmount
+            amountInWithoutFee = nonTaxableAmount + mulDown(taxableAmount, complement(swapFee))
+        else:
+            amountInWithoutFee = amountIn
+        balanceRatio = divDown(balance + amountInWithoutFee, balance)
+        invariantRatio = mulDown(invariantRatio, powDown(balanceRatio, weight))
+
+    if invariantRatio >= ONE:
+        return mulDown(bptTotalSupply, invariantRatio - ONE)
+    return 0
+
+def calcDueTokenProtocolSwapFeeAmount(balance, normalizedWeight, previousInvariant, currentInvariant, protocolSwapFeePercentage):
+    """WeightedMath._calcDueTokenProtocolSwapFeeAmount, charged on the heaviest token when
+    the invariant grew since the last join or exit"""
+    if currentInvariant <= previousInvariant:
+        return 0
+    base = max(divUp(previousInvariant, currentInvariant), MIN_POW_BASE_FREE_EXPONENT)
+    exponent = divDown(ONE, normalizedWeight)
+    tokenAccruedFees = mulDown(balance, complement(powUp(base, exponent)))
+    return mulDown(tokenAccruedFees, protocolSwapFeePercentage)
@@ -0,0 +1,167 @@
+import json
+import numpy as np
+from collections import namedtuple
+from brownie import interface
+from brownie.network.state import Chain
+from scripts.environment import create_environment
+from scripts.multicall import BatchReader
+
+chain = Chain()
+
+# ChainlinkAdapter.rateDecimals
+RATE_DECIMALS = 10**18
+# Chainlink proxy round ids are (phaseId << 64) | aggregatorRoundId
+PHASE_OFFSET = 64
+DEFAULT_ROUND_BATCH = 200
+
+# Every field is an array, one entry per replayed point in time
+AdapterRounds = namedtuple("AdapterRounds", [
+    "timestamp",
+    "roundId",
+    "answer",
+    "startedAt",
+    "updatedAt",
+    "answeredInRound",
+    "valid",        # false where _calculateBaseToQuote reverts with "Chainlink Rate Error"
+])
+
+class FeedHistory:
+    """Round history of a single Chainlink feed ordered by updatedAt. Round ids and answers
+    are object arrays so they keep full int256 / uint80 precision."""
+
+    def __init__(self, rounds, decimals) -> None:
+        """rounds is a list of getRoundData results, decimals is the feed decimals()"""
+        rounds = sorted((r for r in rounds if r is not None and r[3] > 0), key=lambda r: (r[3], r[0]))
+        self.decimals = int(decimals)
+        self.roundId = np.array([int(r[0]) for r in rounds], dtype=object)
+        self.answer = np.array([int(r[1]) for r in rounds], dtype=object)
+        self.startedAt = np.array([int(r[2]) for r in rounds], dtype=np.int64)
+        self.updatedAt = np.array([int(r[3]) for r in rounds], dtype=np.int64)
+        self.answeredInRound = np.array([int(r[4]) for r in rounds], dtype=object)
+
+    def __len__(self):
+        return len(self.updatedAt)
+
+    @classmethod
+    def fetch(cls, env, address, fromTimestamp, block=None, batchSize=DEFAULT_ROUND_BATCH):
+        """Reads rounds backwards from latestRoundData until one is older than fromTimestamp,
+        batched through Multicall3. Only the current phase is walked, rounds from before the
+        last aggregator upgrade are not reachable by decrementing the round id."""
+        feed = interface.AggregatorV2V3Interface(address)
+        reader = BatchReader(env, block)
+        latest = feed.latestRoundData(block_identifier=reader.block)
+        phase = latest[0] >> PHASE_OFFSET
+        rounds = [latest]
+        aggregatorRound = (latest[0] & (2**PHASE_OFFSET - 1)) - 1
+
+        while aggregatorRound > 0 and rounds[-1][3] >= fromTimestamp:
+            ids = range(aggregatorRound, max(aggregatorRound - batchSize, 0), -1)
+            batch = reader.call(
+                [(feed, "getRoundData", [(phase << PHASE_OFFSET) | i]) for i in ids],
+                allowFailure=True
+            )
+            for result in batch:
+                if result is None or result[3] == 0:
+                    # Missing rounds only occur at the start of a phase
+                    aggregatorRound = 0
+                    break
+                rounds.append(result)
+                if result[3] < fromTimestamp:
+                    break
+            aggregatorRound = min(aggregatorRound, ids[-1] - 1)
+
+        return cls(rounds, feed.decimals())
+
+    def latestIndex(self, timestamps):
+        """Index of the round latestRoundData returns at each timestamp, -1 before the first"""
+        return np.searchsorted(self.updatedAt, np.asarray(timestamps, dtype=np.int64), side="right") - 1
+
+    def toJSON(self):
+        return {
+            "decimals": self.decimals,
+            "rounds": [
+                [str(r), str(a), int(s), int(u), str(i)]
+                for (r, a, s, u, i) in zip(self.roundId, self.answer, self.startedAt, self.updatedAt, self.answeredInRound)
+            ]
+        }
+
+    @classmethod
+    def fromJSON(cls, data):
+        return cls([[int(v) for v in r] for r in data["rounds"]], data["decimals"])
+
+class ChainlinkAdapterReplay:
+    """Replays ChainlinkAdapter._calculateBaseToQuote over the round histories of its base and
+    quote feeds. latestRoundData of a feed changes only when a round is written, so the
+    adapter's answer is piecewise constant between the union of both feeds' updatedAt
+    timestamps. Each query is a binary search into both histories and the conversion is done
+    on object arrays with the same truncating integer division as the contract.
+
+    Round metadata (roundId, startedAt, updatedAt, answeredInRound) comes from the base feed
+    like in the adapter.
+    """
+
+    def __init__(self, base, quote) -> None:
+        self.base = base
+        self.quote = quote
+        self.baseDecimals = 10**base.decimals
+        self.quoteDecimals = 10**quote.decimals
+
+    @classmethod
+    def fromEnvironment(cls, env, fromTimestamp, block=None):
+        return cls(
+            FeedHistory.fetch(env, env.config["COMP_USD_Oracle"], fromTimestamp, block),
+            FeedHistory.fetch(env, env.config["ETH_USD_Oracle"], fromTimestamp, block)
+        )
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"base": self.base.toJSON(), "quote": self.quote.toJSON()}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(FeedHistory.fromJSON(data["base"]), FeedHistory.fromJSON(data["quote"]))
+
+    def priceAt(self, timestamps):
+        """Adapter latestRoundData at each timestamp"""
+        timestamps = np.atleast_1d(np.asarray(timestamps, dtype=np.int64))
+        baseIndex = self.base.latestIndex(timestamps)
+        quoteIndex = self.quote.latestIndex(timestamps)
+        # Before either feed has a round the adapter would revert as well
+        valid = (baseIndex >= 0) & (quoteIndex >= 0)
+        b = np.maximum(baseIndex, 0)
+        q = np.maximum(quoteIndex, 0)
+
+        baseToUSD = np.where(valid, self.base.answer[b], 0)
+        quoteToUSD = np.where(valid, self.quote.answer[q], 0)
+        valid &= (baseToUSD > 0) & (quoteToUSD > 0)
+        # Both answers are positive where valid, floor division is the same as truncation
+        answer = np.where(
+            valid,
+            (baseToUSD * self.quoteDecimals * RATE_DECIMALS) // np.where(valid, quoteToUSD * self.baseDecimals, 1),
+            0
+        )
+        return AdapterRounds(
+            timestamps,
+            np.where(valid, self.base.roundId[b], 0),
+            answer,
+            np.where(valid, self.base.startedAt[b], 0),
+            np.where(valid, self.base.updatedAt[b], 0),
+            np.where(valid, self.base.answeredInRound[b], 0),
+            valid
+        )
+
+    def series(self):
+        """Adapter answer after every round of either feed"""
+        timestamps = np.union1d(self.base.updatedAt, self.quote.updatedAt)
+        return self.priceAt(timestamps)
+
+def main(days=30, path="comp_eth_rounds.json"):
+    env = create_environment(lazy=True)
+    replay = ChainlinkAdapterReplay.fromEnvironment(env, chain.time() - int(days) * 86400)
+    replay.save(path)
+    series = replay.series()
+    print("Replayed {} COMP/ETH prices from {} COMP/USD and {} ETH/USD rounds".format(
+        int(np.sum(series.valid)), len(replay.base), len(replay.quote)
+    ))
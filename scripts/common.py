@@ -1,8 +1,7 @@
-import json
 import eth_abi
 import re
-from brownie import Contract
 from brownie.convert.datatypes import HexString
+from scripts.registry import getContract, loadABI
 
 TokenType = {
     "UnderlyingToken": 0,
@@ -45,14 +44,10 @@ TRADE_TYPE = {
 }
     
 def loadContractFromABI(name, address, path):
-    with open(path, "r") as f:
-        abi = json.load(f)
-    return Contract.from_abi(name, address, abi)
+    return getContract(name, address, path)
 
 def loadContractFromArtifact(name, address, path):
-    with open(path, "r") as a:
-        artifact = json.load(a)
-    return Contract.from_abi(name, address, artifact["abi"])
+    return getContract(name, address, loadABI(path)["abi"])
 
 def getDependencies(bytecode):
     deps = set()
@@ -0,0 +1,150 @@
+import heapq
+from collections import namedtuple
+from brownie import web3
+from sortedcontainers import SortedList
+from brownie.network.state import Chain
+from scripts.environment import EnvironmentConfig
+from scripts.event_indexer import EventIndexer
+
+chain = Chain()
+
+# sNOTE.REDEEM_WINDOW_SECONDS
+REDEEM_WINDOW_SECONDS = 3 * 86400
+COOLDOWN_EVENTS = ["CoolDownStarted", "CoolDownEnded", "GlobalCoolDownUpdated"]
+
+RedeemWindow = namedtuple("RedeemWindow", ["account", "begin", "end"])
+# kind is "open" or "close", emitted by CooldownScheduler.due in time order
+WindowTransition = namedtuple("WindowTransition", ["timestamp", "kind", "account"])
+
+class CooldownScheduler:
+    """Rebuilds accountRedeemWindowBegin for every account from sNOTE cooldown events.
+
+    Windows are kept in a SortedList by redeemWindowBegin, so each event is an O(log n) update.
+    Every window is REDEEM_WINDOW_SECONDS long so both opening and closing range queries are a
+    bisect on that list. A heap of pending openings and closings feeds due(), entries replaced by
+    a later CoolDownStarted or removed by CoolDownEnded are dropped lazily when they reach the top.
+    The heap is rebuilt from the current windows once stale entries outnumber the live ones, so
+    it stays bounded when due() is not called.
+
+    The stored window is what the contract stores: redeeming does not clear it and a window that
+    has passed stays until the account starts a new cool down.
+    """
+
+    def __init__(self, coolDownTimeInSeconds=0) -> None:
+        self.coolDownTimeInSeconds = coolDownTimeInSeconds
+        self.windowBegin = {}
+        self._windows = SortedList()
+        self._transitions = []
+        # Transitions at or before this time have been returned by due()
+        self._dueUntil = -1
+        # (blockNumber, logIndex) of the last event applied
+        self.lastEvent = (-1, -1)
+
+    @classmethod
+    def fromIndexer(cls, indexer, snote, coolDownTimeInSeconds=0):
+        scheduler = cls(coolDownTimeInSeconds)
+        scheduler.update(indexer, snote)
+        return scheduler
+
+    def update(self, indexer, snote, toBlock=None):
+        """Runs the indexer and applies the cooldown events it has not seen yet, returns the
+        number of events applied"""
+        indexer.run(toBlock)
+        applied = 0
+        for event in indexer.events(contract=snote, fromBlock=self.lastEvent[0], toBlock=toBlock):
+            if event["event"] in COOLDOWN_EVENTS and self.apply(event):
+                applied += 1
+        return applied
+
+    def apply(self, event):
+        """Applies a single decoded event, events at or before the last one applied are ignored"""
+        position = (event["blockNumber"], event["logIndex"])
+        if position <= self.lastEvent:
+            return False
+        self.lastEvent = position
+
+        args = event["args"]
+        if event["event"] == "GlobalCoolDownUpdated":
+            self.coolDownTimeInSeconds = args["newCoolDownTimeSeconds"]
+        elif event["event"] == "CoolDownStarted":
+            self._setWindow(args["account"], args["redeemWindowBegin"])
+        elif event["event"] == "CoolDownEnded":
+            self._setWindow(args["account"], 0)
+        return True
+
+    def _setWindow(self, account, begin):
+        account = web3.toChecksumAddress(account)
+        previous = self.windowBegin.pop(account, 0)
+        if previous != 0:
+            self._windows.remove((previous, account))
+        if begin != 0:
+            self.windowBegin[account] = begin
+            self._windows.add((begin, account))
+            heapq.heappush(self._transitions, (begin, 0, account, begin))
+            heapq.heappush(self._transitions, (begin + REDEEM_WINDOW_SECONDS, 1, account, begin))
+
+        # At most two entries per current window are live
+        if len(self._transitions) > 4 * len(self.windowBegin) + 64:
+            self._rebuildTransitions()
+
+    def _rebuildTransitions(self):
+        self._transitions = [
+            (time, kind, account, begin)
+            for (account, begin) in self.windowBegin.items()
+            for (time, kind) in ((begin, 0), (begin + REDEEM_WINDOW_SECONDS, 1))
+            if time > self._dueUntil
+        ]
+        heapq.heapify(self._transitions)
+
+    def window(self, account):
+        begin = self.windowBegin.get(web3.toChecksumAddress(account), 0)
+        if begin == 0:
+            return None
+        return RedeemWindow(web3.toChecksumAddress(account), begin, begin + REDEEM_WINDOW_SECONDS)
+
+    def canRedeem(self, account, timestamp):
+        window = self.window(account)
+        return window is not None and window.begin <= timestamp <= window.end
+
+    def inCoolDown(self, account, timestamp):
+        """Mirrors _requireAccountNotInCoolDown, transfers and startCoolDown revert while true"""
+        window = self.window(account)
+        return window is not None and timestamp <= window.end
+
+    def nextWindowIfStarted(self, timestamp):
+        """Window an account gets if it calls startCoolDown at timestamp"""
+        begin = timestamp + self.coolDownTimeInSeconds
+        return (begin, begin + REDEEM_WINDOW_SECONDS)
+
+    def windowsOpening(self, start, end):
+        """Windows with start <= redeemWindowBegin <= end, ordered by opening time"""
+        return [
+            RedeemWindow(a, b, b + REDEEM_WINDOW_SECONDS)
+            for (b, a) in self._windows.irange((start,), (end, chr(0x7f)))
+        ]
+
+    def windowsClosing(self, start, end):
+        """Windows with start <= redeemWindowEnd <= end, ordered by closing time"""
+        return self.windowsOpening(start - REDEEM_WINDOW_SECONDS, end - REDEEM_WINDOW_SECONDS)
+
+    def due(self, timestamp):
+        """Pops every opening and closing at or before timestamp that is still current"""
+        transitions = []
+        self._dueUntil = max(self._dueUntil, timestamp)
+        while len(self._transitions) > 0 and self._transitions[0][0] <= timestamp:
+            (time, kind, account, begin) = heapq.heappop(self._transitions)
+            if self.windowBegin.get(account) != begin:
+                continue
+            transitions.append(WindowTransition(time, "open" if kind == 0 else "close", account))
+        return transitions
+
+def main(path="events.db", hours=24):
+    indexer = EventIndexer.forContracts(path)
+    scheduler = CooldownScheduler.fromIndexer(indexer, EnvironmentConfig["sNOTE"])
+    now = chain.time()
+    end = now + int(hours) * 3600
+    for window in scheduler.windowsOpening(now, end):
+        print("opens  {} {}".format(window.begin, window.account))
+    for window in scheduler.windowsClosing(now, end):
+        print("closes {} {}".format(window.end, window.account))
+    indexer.close()
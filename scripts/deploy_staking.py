@@ -1,28 +1,30 @@
 from brownie import accounts, network
 
+from scripts.deployers.deployment_state import DeploymentState
 from scripts.deployers.snote_deployer import SNoteDeployer
 from scripts.deployers.treasury_manager_deployer import TreasuryManagerDeployer
 from scripts.deployers.balancer_deployer import BalancerDeployer
 from scripts.initializers.balancer_initializer import BalancerInitializer
+from scripts.profiling import span
 
-def initBalancer(deployer):
-    init = BalancerInitializer(network.show_active(), deployer)
+def initBalancer(deployer, state=None):
+    init = BalancerInitializer(network.show_active(), deployer, state=state)
     init.initPool()
 
-def deployEmptyProxy(deployer):
-    snote = SNoteDeployer(network.show_active(), deployer)
+def deployEmptyProxy(deployer, state=None):
+    snote = SNoteDeployer(network.show_active(), deployer, state=state)
     snote.deployEmptyProxy()
 
-def deployBalancerPool(deployer):
-    balancer = BalancerDeployer(network.show_active(), deployer)
+def deployBalancerPool(deployer, state=None):
+    balancer = BalancerDeployer(network.show_active(), deployer, state=state)
     balancer.deployNotePool()
 
-def upgradeSNote(deployer):
-    snote = SNoteDeployer(network.show_active(), deployer)
+def upgradeSNote(deployer, state=None):
+    snote = SNoteDeployer(network.show_active(), deployer, state=state)
     snote.upgradeSNote()
 
-def deployTreasuryManager(deployer):
-    manager = TreasuryManagerDeployer(network.show_active(), deployer)
+def deployTreasuryManager(deployer, state=None):
+    manager = TreasuryManagerDeployer(network.show_active(), deployer, state=state)
     manager.deploy()
 
 def main():
@@ -30,8 +32,8 @@ def main():
     if networkName == "hardhat-fork":
         networkName = "mainnet"
     deployer = accounts.load(networkName.upper() + "_DEPLOYER")
-    deployEmptyProxy(deployer)
-    deployBalancerPool(deployer)
-    upgradeSNote(deployer)
-    initBalancer(deployer)
-    deployTreasuryManager(deployer)
+    # Config is read once and shared, each step writes it at most once when it finishes
+    state = DeploymentState(network.show_active())
+    for step in [deployEmptyProxy, deployBalancerPool, upgradeSNote, initBalancer, deployTreasuryManager]:
+        with state.batch(), span(step.__name__):
+            step(deployer, state)
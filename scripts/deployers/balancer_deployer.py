@@ -1,5 +1,5 @@
-import json
-from brownie import Contract
+from scripts.deployers.deployment_state import DeploymentState
+from scripts.registry import LazyContract
 
 BalancerConfig = {
     "goerli": {
@@ -32,40 +32,28 @@ BalancerConfig = {
 }
 
 class BalancerDeployer:
-    def __init__(self, network, deployer, config=None, persist=True) -> None:
-        self.config = config
-        self.persist = persist
-        self.network = network
-        if self.network == "hardhat-fork":
-            self.network = "mainnet"
-            self.persist = False
+    def __init__(self, network, deployer, config=None, persist=True, state=None) -> None:
+        if state is None:
+            state = DeploymentState(network, config, persist)
+        self.state = state
+        self.network = state.network
+        self.persist = state.persist
         self.deployer = deployer
-        self.staking = {}
         self._load()
         self.pool2TokensFactory = self._loadPool2TokensFactory()
 
     def _load(self):
-        print("Loading balancer config")
-        if self.config == None:
-            with open("v2.{}.json".format(self.network), "r") as f:
-                self.config = json.load(f)
-        if "staking" in self.config:
-            self.staking = self.config["staking"]
+        self.config = self.state.config
+        self.staking = self.state.staking
 
     def _save(self):
-        print("Saving balancer config")
-        self.config["staking"] = self.staking
-        if self.persist:
-            with open("v2.{}.json".format(self.network), "w") as f:
-                json.dump(self.config, f, sort_keys=True, indent=4)
+        self.state.save()
 
     def _loadPool2TokensFactory(self):
-        with open("./abi/balancer/poolFactory.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi(
+        return LazyContract(
             'Weighted Pool 2 Token Factory',
-            BalancerConfig[self.network]["factory"], 
-            abi
+            BalancerConfig[self.network]["factory"],
+            "./abi/balancer/poolFactory.json"
         )
 
     def deployNotePool(self):
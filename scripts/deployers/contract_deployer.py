@@ -1,7 +1,51 @@
+import hashlib
 import json
 import os
-from brownie import Contract, network, project, convert
+from brownie import network, project, convert
 from scripts.common import getDependencies
+from scripts.profiling import profiled
+from scripts.registry import getContract
+
+# Library dependency graphs and deployment plans keyed by the hash of the contract bytecode,
+# the placeholder scan over the bytecode only runs once per contract version
+_plans = {}
+
+def getDependencyGraph(projectContracts, contract):
+    """Maps the contract and every library it links, directly or through other libraries,
+    to the sorted list of libraries each one links"""
+    graph = {}
+    pending = [(contract._name, contract)]
+    while len(pending) > 0:
+        (name, c) = pending.pop()
+        if name in graph:
+            continue
+        graph[name] = getDependencies(c.bytecode)
+        pending.extend((dep, projectContracts[dep]) for dep in graph[name])
+    return graph
+
+def planLibraries(graph, root):
+    """Groups the libraries in the graph into layers, each layer only links libraries
+    from earlier layers so they can be deployed in order in a single pass"""
+    remaining = dict((name, set(deps)) for (name, deps) in graph.items() if name != root)
+    done = set()
+    layers = []
+    while len(remaining) > 0:
+        layer = sorted(name for (name, deps) in remaining.items() if deps <= done)
+        if len(layer) == 0:
+            raise Exception("Circular library dependency between {}".format(sorted(remaining.keys())))
+        for name in layer:
+            del remaining[name]
+        done.update(layer)
+        layers.append(layer)
+    return layers
+
+def getDeploymentPlan(projectContracts, contract):
+    """Returns (direct dependencies, library layers) for a contract, cached by bytecode hash"""
+    key = hashlib.sha256(contract.bytecode.encode()).hexdigest()
+    if key not in _plans:
+        graph = getDependencyGraph(projectContracts, contract)
+        _plans[key] = (graph[contract._name], planLibraries(graph, contract._name))
+    return _plans[key]
 
 class ContractDeployer:
     def __init__(self, deployer, context=None, libs=None) -> None:
@@ -14,6 +58,7 @@ class ContractDeployer:
         if self.libs == None:
             self.libs = {}
 
+    @profiled()
     def deploy(self, contract, args=[], name="", verify=False, isLib=False):
         c = None
         if name == "":
@@ -28,18 +73,20 @@ class ContractDeployer:
 
         if name in context:
             print("{} deployed at {}".format(name, context[name]))
-            c = Contract.from_abi(name, context[name], abi=contract.abi)
+            c = getContract(name, context[name], contract.abi)
         else:
-            # Deploy libraries
-            deps = getDependencies(contract.bytecode)
-            libs = []
-            for dep in deps:
-                libs.append(self.deploy(self.project.dict()[dep], [], "", False, True))
+            # Deploy libraries, dependencies first
+            projectContracts = self.project.dict()
+            (deps, layers) = getDeploymentPlan(projectContracts, contract)
+            (deployedLibs, newLibs) = self._deployLibraries(projectContracts, layers)
+            libs = [deployedLibs[dep] for dep in deps]
 
             # Deploy contract
             print("Deploying {}".format(name))
             c = contract.deploy(*args, {"from": self.deployer}, publish_source=False)
-            self.context[name] = c.address
+            context[name] = c.address
+            if isLib:
+                newLibs.append(name)
 
             # Verify libs
             if not isLib and len(libs) > 0:
@@ -63,20 +110,46 @@ class ContractDeployer:
                             addr[i]
                         ))
 
-        # Make sure there is only 1 copy in map.json (for libraries)
-        if isLib:
-            map = None
-            with open("build/deployments/map.json", "r") as f:
-                map = json.load(f)
-            contracts = map[str(network.chain.id)]
+            self._cleanupDeploymentMap(newLibs)
+
+        return c
+
+    def _deployLibraries(self, projectContracts, layers):
+        deployed = {}
+        newLibs = []
+        for layer in layers:
+            for lib in layer:
+                container = projectContracts[lib]
+                if lib in self.libs:
+                    print("{} deployed at {}".format(lib, self.libs[lib]))
+                    deployed[lib] = getContract(lib, self.libs[lib], container.abi)
+                    continue
+
+                # Brownie links the most recent deployment of each library, earlier layers
+                # are already deployed at this point
+                print("Deploying {}".format(lib))
+                deployed[lib] = container.deploy({"from": self.deployer}, publish_source=False)
+                self.libs[lib] = deployed[lib].address
+                newLibs.append(lib)
+        return (deployed, newLibs)
+
+    def _cleanupDeploymentMap(self, libs):
+        # Make sure there is only 1 copy in map.json for each library, map.json is rewritten
+        # once for all libraries deployed in this call
+        if len(libs) == 0:
+            return
+
+        map = None
+        with open("build/deployments/map.json", "r") as f:
+            map = json.load(f)
+        contracts = map[str(network.chain.id)]
+        for name in libs:
             if name in contracts:
                 deployments = contracts[name]
                 for d in deployments:
                     f = "build/deployments/{}/{}.json".format(network.chain.id, d)
-                    if d != c.address and os.path.exists(f):
+                    if d != self.libs[name] and os.path.exists(f):
                         os.remove(f)
-                contracts[name] = [c.address]
-            with open("build/deployments/map.json", "w") as f:
-                json.dump(map, f, sort_keys=True, indent=4)        
-
-        return c
+                contracts[name] = [self.libs[name]]
+        with open("build/deployments/map.json", "w") as f:
+            json.dump(map, f, sort_keys=True, indent=4)
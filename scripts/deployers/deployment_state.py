@@ -0,0 +1,88 @@
+import json
+import os
+import stat
+import tempfile
+from contextlib import contextmanager
+
+class DeploymentState:
+    """The v2.{network}.json deployment config, loaded once and shared by every deployer in a run.
+
+    Deployers call save after each step. The file is only rewritten when its contents changed
+    and never while a batch is open, so a multi step run does a single write per batch. Writes
+    go to a temporary file that is renamed over the config so a crash mid write leaves the
+    previous version intact.
+    """
+
+    def __init__(self, network, config=None, persist=True) -> None:
+        self.network = network
+        self.persist = persist
+        if self.network == "hardhat-fork":
+            self.network = "mainnet"
+            self.persist = False
+        self.path = "v2.{}.json".format(self.network)
+        self._batchDepth = 0
+        self._dirty = False
+
+        # The last contents written, saves that change nothing skip the write
+        self._written = None
+        self.config = config
+        if self.config is None:
+            print("Loading deployment config {}".format(self.path))
+            with open(self.path, "r") as f:
+                self.config = json.load(f)
+            self._written = self._serialize()
+
+    @property
+    def staking(self):
+        return self.config.setdefault("staking", {})
+
+    def _serialize(self):
+        return json.dumps(self.config, sort_keys=True, indent=4)
+
+    def save(self):
+        self._dirty = True
+        if self._batchDepth == 0:
+            self.flush()
+
+    def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        contents = self._serialize()
+        if not self.persist or contents == self._written:
+            return
+
+        print("Saving deployment config {}".format(self.path))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        (fd, tmpPath) = tempfile.mkstemp(dir=directory, prefix=".{}.".format(os.path.basename(self.path)))
+        try:
+            # mkstemp creates the file as 0600, keep the mode the config had or would get from open
+            os.chmod(tmpPath, self._fileMode())
+            with os.fdopen(fd, "w") as f:
+                f.write(contents)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmpPath, self.path)
+        except BaseException:
+            os.remove(tmpPath)
+            raise
+        self._written = contents
+
+    def _fileMode(self):
+        if os.path.exists(self.path):
+            return stat.S_IMODE(os.stat(self.path).st_mode)
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+    @contextmanager
+    def batch(self):
+        """Defers writes until the outermost batch exits, state is flushed even if a step fails
+        so addresses of contracts that were already deployed are not lost"""
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self.flush()
@@ -1,6 +1,7 @@
-import json
-from brownie import Contract, EmptyProxy, nProxy, sNOTE, interface
+from brownie import EmptyProxy, nProxy, sNOTE, interface
 from scripts.deployers.contract_deployer import ContractDeployer
+from scripts.deployers.deployment_state import DeploymentState
+from scripts.registry import getContract
 
 SNoteConfig = {
     "goerli": {
@@ -30,31 +31,21 @@ SNoteConfig = {
 }
 
 class SNoteDeployer:
-    def __init__(self, network, deployer, config=None, persist=True) -> None:
-        self.config = config
-        self.persist = persist
-        self.network = network
-        if self.network == "hardhat-fork":
-            self.network = "mainnet"
-            self.persist = False
+    def __init__(self, network, deployer, config=None, persist=True, state=None) -> None:
+        if state is None:
+            state = DeploymentState(network, config, persist)
+        self.state = state
+        self.network = state.network
+        self.persist = state.persist
         self.deployer = deployer
-        self.staking = {}
         self._load()
 
     def _load(self):
-        print("Loading sNOTE config")
-        if self.config == None:
-            with open("v2.{}.json".format(self.network), "r") as f:
-                self.config = json.load(f)
-        if "staking" in self.config:
-            self.staking = self.config["staking"]
+        self.config = self.state.config
+        self.staking = self.state.staking
 
     def _save(self):
-        print("Saving sNOTE config")
-        self.config["staking"] = self.staking
-        if self.persist:
-            with open("v2.{}.json".format(self.network), "w") as f:
-                json.dump(self.config, f, sort_keys=True, indent=4)
+        self.state.save()
 
     def _deployEmptyImpl(self):
         if "sNoteEmptyImpl" in self.staking:
@@ -82,7 +73,7 @@ class SNoteDeployer:
     def _deployImpl(self):
         if "sNoteImpl" in self.staking:
             print("sNoteImpl deployed at {}".format(self.staking["sNoteImpl"]))
-            return Contract.from_abi("sNoteImpl", self.staking["sNoteImpl"], sNOTE.abi)
+            return getContract("sNoteImpl", self.staking["sNoteImpl"], sNOTE.abi)
 
         deployer = ContractDeployer(self.deployer)
         impl = deployer.deploy(sNOTE, [
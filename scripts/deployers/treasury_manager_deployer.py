@@ -1,6 +1,7 @@
-import json
-from brownie import Contract, TreasuryManager, nProxy, interface
+from brownie import TreasuryManager, nProxy, interface
 from scripts.deployers.contract_deployer import ContractDeployer
+from scripts.deployers.deployment_state import DeploymentState
+from scripts.registry import getContract
 
 TreasuryManagerConfig = {
     "goerli": {
@@ -39,34 +40,25 @@ TreasuryManagerConfig = {
 SECONDS_IN_DAY = 86400
 
 class TreasuryManagerDeployer:
-    def __init__(self, network, deployer, config=None, persist=True) -> None:
-        self.config = config
-        self.persist = persist
-        self.network = network
-        if self.network == "hardhat-fork":
-            self.network = "mainnet"
-            self.persist = False
+    def __init__(self, network, deployer, config=None, persist=True, state=None) -> None:
+        if state is None:
+            state = DeploymentState(network, config, persist)
+        self.state = state
+        self.network = state.network
+        self.persist = state.persist
         self.deployer = deployer
-        self.staking = {}
         self._load()
 
     def _load(self):
-        print("Loading TreasuryManager config")
-        if self.config == None:
-            with open("v2.{}.json".format(self.network), "r") as f:
-                self.config = json.load(f)
-        self.staking = self.config["staking"]
+        self.config = self.state.config
+        self.staking = self.state.staking
 
     def _save(self):
-        print("Saving TreasuryManager config")
-        self.config["staking"] = self.staking
-        if self.persist:
-            with open("v2.{}.json".format(self.network), "w") as f:
-                json.dump(self.config, f, sort_keys=True, indent=4)
+        self.state.save()
 
     def _deployTreasuryManagerImpl(self):
         if "treasuryManagerImpl" in self.staking:
-            return Contract.from_abi("TreasuryManagerImpl", self.staking["treasuryManagerImpl"], TreasuryManager.abi)
+            return getContract("TreasuryManagerImpl", self.staking["treasuryManagerImpl"], TreasuryManager.abi)
 
         deployer = ContractDeployer(self.deployer)
         impl = deployer.deploy(TreasuryManager, [
@@ -1,11 +1,9 @@
-import json
+import copy
 import eth_abi
-import eth_keys
 import time
 from brownie import (
     ZERO_ADDRESS, 
     accounts, 
-    Contract, 
     interface, 
     sNOTE, 
     sNOTEInitializer,
@@ -16,10 +14,9 @@ from brownie import (
 )
 from brownie.network.state import Chain
 from brownie.convert.datatypes import Wei
-from eth_account._utils.signing import sign_message_hash
-from eth_account.datastructures import SignedMessage
-from eth_account.messages import defunct_hash_message
-from hexbytes import HexBytes
+from scripts.order_signing import getDomainHash, hashOrder, signOrderHash, sign_defunct_message_raw
+from scripts.profiling import profiled, span
+from scripts.registry import LazyContract, getContract
 
 ETH_ADDRESS = "0x0000000000000000000000000000000000000000"
 SECONDS_IN_DAY = 86400
@@ -45,6 +42,7 @@ EnvironmentConfig = {
     "GaugeController": "0xC128468b7Ce63eA702C1f104D55A2566b13D3ABD",
     "BalancerMinter": "0x239e55F427D44C3cc793f49bFB507ebe76638a2b",
     "ExchangeV3": "0x61935cbdd02287b511119ddb11aeb42f1593b7ef",
+    "Multicall3": "0xcA11bde05977b3631167028862bE2a173976CA11",
     "balancerPoolConfig": {
         "name": "Staked NOTE Weighted Pool",
         "symbol": "sNOTE-BPT",
@@ -60,6 +58,9 @@ EnvironmentConfig = {
     'sNOTEPoolAddress': "0x5122e01d819e58bb2e22528c0d68d310f0aa6fd7",
     'sNOTEPoolId': '0x5122e01d819e58bb2e22528c0d68d310f0aa6fd7000200000000000000000163',
     'sNOTE': '0x38DE42F4BA8a35056b33A746A6b45bE9B1c3B9d2',
+    # sNOTE has no logs before this block, ledgers of the mainnet sNOTE start here. It is the
+    # Notional V2 startBlock from v2.mainnet.json, sNOTE was deployed after it.
+    'sNOTEStartBlock': 13094883,
     'sNOTEConfig': {
         'owner': '0x22341fB5D92D3d801144aA5A925F401A91418A05',
         'coolDownSeconds': 100
@@ -68,33 +69,15 @@ EnvironmentConfig = {
     'TradingModule': '0x594734c7e06C3D483466ADBCe401C6Bd269746C8'
 }
 
-def sign_defunct_message_raw(account, message: bytes) -> SignedMessage:
-    """Signs an `EIP-191` using this account's private key.
-
-    Args:
-        message: An text
-
-    Returns:
-        An eth_account `SignedMessage` instance.
-    """
-    msg_hash_bytes = defunct_hash_message(message)
-    eth_private_key = eth_keys.keys.PrivateKey(HexBytes(account.private_key))
-    (v, r, s, eth_signature_bytes) = sign_message_hash(eth_private_key, msg_hash_bytes)
-    return SignedMessage(
-        messageHash=msg_hash_bytes,
-        r=r,
-        s=s,
-        v=v,
-        signature=HexBytes(eth_signature_bytes),
-    )
-    
 class Order:
+    # Shared by all orders, building an encoder per order is expensive
+    packedEncoder = eth_abi.codec.ABIEncoder(eth_abi.registry.registry_packed)
+
     def __init__(self, assetProxy, makerAddr, makerToken, makerAmt, takerToken, takerAmt, now=None) -> None:
         if now == None:
             ts = time.time()
         else:
             ts = now
-        self.packedEncoder = eth_abi.codec.ABIEncoder(eth_abi.registry.registry_packed)
         self.makerAddress = makerAddr
         self.takerAddress = ZERO_ADDRESS
         self.feeRecipientAddress = ZERO_ADDRESS
@@ -113,33 +96,43 @@ class Order:
     def encodeAssetData(self, assetProxy, token):
         return assetProxy.ERC20Token.encode_input(token)
 
+    def __setattr__(self, name, value):
+        # Any change to the order invalidates the cached params
+        self.__dict__[name] = value
+        self.__dict__["_params"] = None
+
     def hash(self, exchange):
+        return hashOrder(self.getParams(), getDomainHash(exchange))
+
+    def onChainHash(self, exchange):
         info = exchange.getOrderInfo(self.getParams())
         return info[1]
 
     def sign(self, exchange, account):
-        return self.rawSign(exchange, account) + "07" # 07 = EIP1271
+        return signOrderHash(account, self.hash(exchange)) # 07 = EIP1271
 
     def rawSign(self, exchange, account):
         return sign_defunct_message_raw(account, self.hash(exchange)).signature.hex()
 
     def getParams(self):
-        return [
-            self.makerAddress,
-            self.takerAddress,
-            self.feeRecipientAddress,
-            self.senderAddress,
-            int(self.makerAssetAmount),
-            int(self.takerAssetAmount),
-            int(self.makerFee),
-            int(self.takerFee),
-            self.expirationTimeSeconds,
-            self.salt,
-            self.makerAssetData,
-            self.takerAssetData,
-            self.makerFeeAssetData,
-            self.takerFeeAssetData
-        ]
+        if self._params is None:
+            self.__dict__["_params"] = [
+                self.makerAddress,
+                self.takerAddress,
+                self.feeRecipientAddress,
+                self.senderAddress,
+                int(self.makerAssetAmount),
+                int(self.takerAssetAmount),
+                int(self.makerFee),
+                int(self.takerFee),
+                int(self.expirationTimeSeconds),
+                int(self.salt),
+                self.makerAssetData,
+                self.takerAssetData,
+                self.makerFeeAssetData,
+                self.takerFeeAssetData
+            ]
+        return self._params
 
 
 class TestAccounts:
@@ -156,14 +149,26 @@ class TestAccounts:
         self.BALWhale = accounts.at("0xcdcebf1f28678eb4a1478403ba7f34c94f7ddbc5", force=True)
         self.testManager = accounts.add('43a6634021d4b1ff7fd350843eebaa7cf547aefbf9503c33af0ec27c83f76827')
 
+# Components that deploy contracts or send transactions when they are built. In lazy
+# mode these are built on first access, in eager mode they are built in this order.
+LazyComponents = [
+    "treasuryManagerProxy",
+    "sNOTEProxy",
+    "sNOTE",
+    "treasuryManager",
+    "COMPOracle",
+    "tradingModule",
+]
+
 class Environment:
-    def __init__(self, config, deployer, useFresh) -> None:
+    def __init__(self, config, deployer, useFresh, lazy=False) -> None:
         self.config = config
         self.deployer = deployer
+        self.useFresh = useFresh
+        self._building = set()
         self.notional = self.loadNotional(self.config["Notional"])
         self.balancerVault = self.loadBalancerVault(self.config["BalancerVault"])
         self.pool2TokensFactory = self.loadPool2TokensFactory(self.config["WeightedPool2TokensFactory"])
-        self.gaugeController = interface.ILiquidityGaugeController(self.config["GaugeController"])
         self.note = self.loadNOTE(self.config["NOTE"])
         self.dai = self.loadERC20Token("DAI")
         self.weth = self.load_WETH(self.config["WETH"])
@@ -172,114 +177,127 @@ class Environment:
         self.comp = self.loadERC20Token("COMP")
         self.bal = self.loadERC20Token("BAL")
         self.wstETH = self.loadERC20Token("wstETH")
-        self.treasuryManager = self.deployEmptyProxy()
-        if useFresh:
+        self.balancerPool = self.loadBalancerPool(self.config['sNOTEPoolAddress'])
+        self.poolId = self.config['sNOTEPoolId']
+        self.balancerMinter = self.loadBalancerMinter(self.config["BalancerMinter"])
+        self.liquidityGauge = self.loadLiquidityGauge(self.config["LiquidityGauge"])
+        self.DAIToken = self.loadERC20Token("DAI")
+        self.exchangeV3 = self.loadExchangeV3(self.config['ExchangeV3'])
+        self.gaugeController = interface.ILiquidityGaugeController(self.config["GaugeController"])
+        self.assetProxy = interface.ERC20Proxy(self.config["ERC20AssetProxy"])
+
+        if not lazy:
+            for component in LazyComponents:
+                getattr(self, component)
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not set yet. Builders access the components
+        # they depend on through self, which builds those first.
+        if name not in LazyComponents:
+            raise AttributeError(name)
+        if name in self._building:
+            raise Exception("Circular dependency building {}".format(name))
+
+        self._building.add(name)
+        try:
+            with span("Environment._build_" + name):
+                component = getattr(self, "_build_" + name)()
+        finally:
+            self._building.remove(name)
+        setattr(self, name, component)
+        return component
+
+    def _build_treasuryManagerProxy(self):
+        if self.useFresh:
+            return self.deployEmptyProxy()
+        return self.load_treasuryManager(self.config['TreasuryManager'])
+
+    def _build_sNOTEProxy(self):
+        if self.useFresh:
             # This is a fresh deployment of sNOTE
-            self.sNOTEProxy = self.deployEmptyProxy()
-            self.balancerPool = self.loadBalancerPool(self.config['sNOTEPoolAddress'])
-            self.poolId = self.config['sNOTEPoolId']
-            self.sNOTE = self.upgrade_sNOTE(self.treasuryManager, True)
-            self.sNOTE.approveAndStakeAll({'from': self.deployer})
+            return self.deployEmptyProxy()
+        return self.load_sNOTE(self.config['sNOTE'])
+
+    def _build_sNOTE(self):
+        if self.useFresh:
+            snote = self.upgrade_sNOTE(self.treasuryManagerProxy, True)
+            snote.approveAndStakeAll({'from': self.deployer})
         else:
-            self.balancerPool = self.loadBalancerPool(self.config['sNOTEPoolAddress'])
-            self.poolId = self.config['sNOTEPoolId']
-            self.sNOTE = self.load_sNOTE(self.config['sNOTE'])
-            self.sNOTEProxy = self.load_sNOTE(self.config['sNOTE'])
-            # Upgrade sNOTE for staking
-            self.upgrade_sNOTE(self.treasuryManager, False)
-        self.sNOTE.setVotingOracleWindow(3600, {"from": self.sNOTE.owner()})
-        if useFresh:
-            self.treasuryManager = self.upgradeTreasuryManager()
+            snote = self.load_sNOTE(self.config['sNOTE'])
+        snote.setVotingOracleWindow(3600, {"from": snote.owner()})
+        return snote
+
+    def _build_treasuryManager(self):
+        if self.useFresh:
+            manager = self.upgradeTreasuryManager()
         else:
-            self.treasuryManager = self.load_treasuryManager(self.config['TreasuryManager'])
+            manager = self.load_treasuryManager(self.config['TreasuryManager'])
             impl = self.deployTreasuryManager()
-            self.treasuryManager.upgradeTo(
+            manager.upgradeTo(
                 impl.address, 
-                {"from": self.treasuryManager.owner()}
+                {"from": manager.owner()}
             )
-        self.treasuryManager.setPriceOracleWindow(3600, {"from": self.treasuryManager.owner()})
-        self.DAIToken = self.loadERC20Token("DAI")
-        self.exchangeV3 = self.loadExchangeV3(self.config['ExchangeV3'])
-        self.assetProxy = interface.ERC20Proxy(self.config["ERC20AssetProxy"])
-        self.COMPOracle = self.deployCOMPOracle()
-        self.tradingModule = self.loadTradingModule(self.config["TradingModule"])
-        self.tradingModule.setPriceOracle(
+        manager.setPriceOracleWindow(3600, {"from": manager.owner()})
+        return manager
+
+    def _build_COMPOracle(self):
+        return self.deployCOMPOracle()
+
+    def _build_tradingModule(self):
+        tradingModule = self.loadTradingModule(self.config["TradingModule"])
+        tradingModule.setPriceOracle(
             self.comp.address, 
             self.config["COMP_USD_Oracle"], 
             {"from": self.notional.owner()}
         )
+        return tradingModule
 
     def loadExchangeV3(self, address):
-        with open("./abi/0x/ExchangeV3.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi("ExchangeV3", address, abi)
+        return LazyContract("ExchangeV3", address, "./abi/0x/ExchangeV3.json")
 
     def loadNotional(self, address):
-        with open("./abi/notional/Notional.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('Notional', address, abi)
+        return LazyContract('Notional', address, "./abi/notional/Notional.json")
 
     def loadNOTE(self, address):
-        with open("./abi/notional/note.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('NOTE', address, abi)
+        return LazyContract('NOTE', address, "./abi/notional/note.json")
 
     def load_sNOTE(self, address):
-        return Contract.from_abi('sNOTE', address, sNOTE.abi)
+        return getContract('sNOTE', address, sNOTE.abi)
 
     def load_treasuryManager(self, address):
-        return Contract.from_abi('TreasuryManager', address, TreasuryManager.abi)
+        return getContract('TreasuryManager', address, TreasuryManager.abi)
 
     def load_WETH(self, address):
-        with open("./abi/ERC20.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('WETH', address, abi)
+        return LazyContract('WETH', address, "./abi/ERC20.json")
 
     def loadBalancerPool(self, address):
-        with open("./abi/balancer/pool.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('BalancerPool', address, abi)
+        return LazyContract('BalancerPool', address, "./abi/balancer/pool.json")
 
     def loadBalancerVault(self, address):
-        with open("./abi/balancer/vault.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('BalancerVault', address, abi)
+        return LazyContract('BalancerVault', address, "./abi/balancer/vault.json")
 
     def loadPool2TokensFactory(self, address):
-        with open("./abi/balancer/poolFactory.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('Weighted Pool 2 Token Factory', address, abi)
+        return LazyContract('Weighted Pool 2 Token Factory', address, "./abi/balancer/poolFactory.json")
 
     def loadBalancerMinter(self, address):
-        with open("./abi/balancer/BalMinter.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('BalancerMinter', address, abi)
+        return LazyContract('BalancerMinter', address, "./abi/balancer/BalMinter.json")
 
     def loadLiquidityGauge(self, address):
-        with open("./abi/balancer/LiquidityGauge.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('LiquidityGauge', address, abi)
+        return LazyContract('LiquidityGauge', address, "./abi/balancer/LiquidityGauge.json")
 
     def loadTradingModule(self, address):
-        with open("./abi/TradingModule.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('TradidngModule', address, abi)
+        return LazyContract('TradidngModule', address, "./abi/TradingModule.json")
 
     def loadERC20Token(self, token):
-        with open("./abi/ERC20.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi(token, EnvironmentConfig[token], abi)
+        return LazyContract(token, EnvironmentConfig[token], "./abi/ERC20.json")
 
     def deployEmptyProxy(self):
         # Deploys an empty proxy to get the sNOTE address
         emptyProxyImpl = EmptyProxy.deploy({"from": self.deployer})
         proxy = nProxy.deploy(emptyProxyImpl.address, bytes(), {"from": self.deployer})
-        return Contract.from_abi("Proxy", proxy.address, EmptyProxy.abi)
+        return getContract("Proxy", proxy.address, EmptyProxy.abi)
 
     def upgrade_sNOTE(self, treasuryManager, shouldInitialize = True):
-        self.balancerMinter = self.loadBalancerMinter(EnvironmentConfig["BalancerMinter"])
-        self.liquidityGauge = self.loadLiquidityGauge(EnvironmentConfig["LiquidityGauge"])
-
         sNOTEImpl = sNOTE.deploy(
             self.balancerVault.address,
             self.poolId,
@@ -368,8 +386,8 @@ class Environment:
     def upgradeTreasuryManager(self):
         impl = self.deployTreasuryManager()
         initData = impl.initialize.encode_input(self.deployer, self.deployer, SECONDS_IN_DAY)
-        self.treasuryManager.upgradeToAndCall(impl, initData, {'from': self.deployer})
-        return Contract.from_abi("TreasuryManagerProxy", self.treasuryManager.address, TreasuryManager.abi)
+        self.treasuryManagerProxy.upgradeToAndCall(impl, initData, {'from': self.deployer})
+        return getContract("TreasuryManagerProxy", self.treasuryManagerProxy.address, TreasuryManager.abi)
 
     def deployCOMPOracle(self):
         return ChainlinkAdapter.deploy(
@@ -409,10 +427,38 @@ class Environment:
             False
         ], 0, chain.time() + 20000, { "from": account })
 
-def create_environment(useFresh = False):
+@profiled()
+def create_environment(useFresh = False, lazy = False):
     testAccounts = TestAccounts()
     testAccounts.ETHWhale.transfer(testAccounts.NOTEWhale, 100e18)
-    return Environment(EnvironmentConfig, testAccounts.NOTEWhale, useFresh)
-    
+    return Environment(EnvironmentConfig, testAccounts.NOTEWhale, useFresh, lazy)
+
+class EnvironmentSnapshot:
+    """Builds an environment variant on first use and snapshots the chain right after. Tests
+    revert to the snapshot and get a copy of the prebuilt environment, so no setup
+    transactions are sent again.
+
+    Only one variant is live at a time: brownie keeps a single snapshot, and evm_revert drops
+    every node snapshot taken after the one reverted to, so two branches cannot be kept.
+    Asking for the other variant resets the chain to the fork and builds it there, each
+    variant runs on the state left by its own build only. Tests on the fresh variant are
+    grouped in tests/test_fresh_snote.py so each variant is built once per session."""
+
+    def __init__(self) -> None:
+        self.useFresh = None
+        self.environment = None
+
+    def get(self, useFresh = False):
+        if self.useFresh != useFresh:
+            chain.reset()
+            self.environment = create_environment(useFresh)
+            self.useFresh = useFresh
+            chain.snapshot()
+        # Copy so that attributes set during a test, including lazily built components,
+        # do not leak into the next test
+        env = copy.copy(self.environment)
+        env._building = set()
+        return env
+
 def main():
     pass
\ No newline at end of file
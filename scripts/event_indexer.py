@@ -0,0 +1,277 @@
+import json
+import re
+import sqlite3
+from brownie import web3
+from brownie.network.state import Chain
+from eth_abi import decode_abi, decode_single
+from hexbytes import HexBytes
+from requests.exceptions import RequestException
+from scripts.environment import EnvironmentConfig
+from scripts.registry import loadABI
+
+chain = Chain()
+
+SNOTE_EVENTS = ["SNoteMinted", "SNoteRedeemed", "CoolDownStarted", "CoolDownEnded", "GlobalCoolDownUpdated", "ClaimedBAL"]
+TREASURY_MANAGER_EVENTS = ["AssetsInvested", "TradeExecuted", "NoteBurned", "VaultRewardReinvested"]
+LIQUIDITY_GAUGE_EVENTS = ["UpdateLiquidityLimit"]
+
+DEFAULT_BLOCK_CHUNK = 10000
+MAX_BLOCK_CHUNK = 1000000
+# Chunks returning fewer logs than this are doubled for the next request
+TARGET_LOGS_PER_CHUNK = 2000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    blockNumber INTEGER NOT NULL,
+    logIndex INTEGER NOT NULL,
+    transactionHash TEXT NOT NULL,
+    contract TEXT NOT NULL,
+    event TEXT NOT NULL,
+    args TEXT NOT NULL,
+    PRIMARY KEY (blockNumber, logIndex)
+);
+CREATE INDEX IF NOT EXISTS events_by_name ON events (contract, event, blockNumber);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    contract TEXT NOT NULL,
+    event TEXT NOT NULL,
+    lastBlock INTEGER NOT NULL,
+    PRIMARY KEY (contract, event)
+);
+"""
+
+def _canonicalType(param):
+    if param["type"].startswith("tuple"):
+        components = ",".join(_canonicalType(c) for c in param["components"])
+        return "({}){}".format(components, param["type"][len("tuple"):])
+    return param["type"]
+
+def _isDynamic(abiType):
+    return abiType in ("string", "bytes") or abiType.endswith("[]") or abiType.startswith("(")
+
+def _arrayElement(abiType):
+    # Strips the outermost array dimension, "uint256[][3]" => "uint256[]"
+    match = re.match(r"^(.*)\[\d*\]$", abiType)
+    return match.group(1) if match else None
+
+def _toJSON(abiType, value):
+    """uint256 values do not fit in SQLite or JSON numbers, integers are stored as strings"""
+    element = _arrayElement(abiType)
+    if element is not None:
+        return [_toJSON(element, v) for v in value]
+    if abiType == "address":
+        return web3.toChecksumAddress(value)
+    if abiType.startswith("uint") or abiType.startswith("int"):
+        return str(value)
+    if abiType.startswith("bytes"):
+        return HexBytes(value).hex()
+    if abiType.startswith("("):
+        return [_toJSON(t, v) for (t, v) in zip(_tupleTypes(abiType), value)]
+    return value
+
+def _fromJSON(abiType, value):
+    element = _arrayElement(abiType)
+    if element is not None:
+        return [_fromJSON(element, v) for v in value]
+    if abiType.startswith("uint") or abiType.startswith("int"):
+        return int(value)
+    if abiType.startswith("("):
+        return tuple(_fromJSON(t, v) for (t, v) in zip(_tupleTypes(abiType), value))
+    return value
+
+def _tupleTypes(abiType):
+    # Splits "(a,(b,c),d)" into its top level component types
+    types, depth, current = [], 0, ""
+    for c in abiType[1:-1]:
+        if c == "," and depth == 0:
+            types.append(current)
+            current = ""
+            continue
+        depth += (c == "(") - (c == ")")
+        current += c
+    return types + [current] if current else types
+
+class EventDecoder:
+    """Decodes the logs of a single contract for a subset of the events in its ABI. Topic
+    hashes and type lists are computed once so decoding a batch is a dictionary lookup and
+    an ABI decode per log."""
+
+    def __init__(self, name, abi, events) -> None:
+        self.name = name
+        self.events = {}
+        for entry in abi:
+            if entry["type"] != "event" or entry["name"] not in events:
+                continue
+            types = [_canonicalType(i) for i in entry["inputs"]]
+            signature = "{}({})".format(entry["name"], ",".join(types))
+            topic = web3.keccak(text=signature).hex()
+            self.events[topic] = {
+                "name": entry["name"],
+                "indexed": [(i["name"], t) for (i, t) in zip(entry["inputs"], types) if i["indexed"]],
+                "data": [(i["name"], t) for (i, t) in zip(entry["inputs"], types) if not i["indexed"]],
+                "types": dict((i["name"], t) for (i, t) in zip(entry["inputs"], types)),
+            }
+
+        missing = set(events) - set(e["name"] for e in self.events.values())
+        if len(missing) > 0:
+            raise Exception("Events {} not found in the {} ABI".format(sorted(missing), name))
+        self.byName = dict((e["name"], e) for e in self.events.values())
+
+    @property
+    def topics(self):
+        return list(self.events.keys())
+
+    def decode(self, logs):
+        """Returns (blockNumber, logIndex, transactionHash, event, args) rows, args are JSON encoded"""
+        rows = []
+        for log in logs:
+            event = self.events.get(HexBytes(log["topics"][0]).hex())
+            if event is None:
+                continue
+            args = {}
+            for ((name, abiType), topic) in zip(event["indexed"], log["topics"][1:]):
+                if _isDynamic(abiType):
+                    # Indexed dynamic values are only stored as their keccak hash
+                    args[name] = HexBytes(topic).hex()
+                else:
+                    args[name] = _toJSON(abiType, decode_single(abiType, HexBytes(topic)))
+            values = decode_abi([t for (_, t) in event["data"]], HexBytes(log["data"]))
+            for ((name, abiType), value) in zip(event["data"], values):
+                args[name] = _toJSON(abiType, value)
+            rows.append((
+                log["blockNumber"],
+                log["logIndex"],
+                HexBytes(log["transactionHash"]).hex(),
+                event["name"],
+                json.dumps(args, sort_keys=True)
+            ))
+        return rows
+
+    def parseArgs(self, event, args):
+        types = self.byName[event]["types"]
+        return dict((k, _fromJSON(types[k], v)) for (k, v) in json.loads(args).items())
+
+class EventIndexer:
+    """Indexes sNOTE and TreasuryManager events into a SQLite database. Every chunk of logs is
+    committed together with the per event checkpoint so an interrupted run resumes where it
+    stopped, and each run only fetches blocks after the last checkpoint. Events added to a
+    contract later are backfilled from fromBlock on their own checkpoint.
+
+    The block range of each eth_getLogs request adapts to the node, it is halved when the node
+    rejects the request (too many results or a timeout) and doubled while responses are small.
+    """
+
+    def __init__(self, path, contracts, fromBlock=0, blockChunk=DEFAULT_BLOCK_CHUNK, confirmations=0) -> None:
+        """contracts is a list of (name, address, abi path, event names)"""
+        self.path = path
+        self.fromBlock = fromBlock
+        self.blockChunk = blockChunk
+        self.confirmations = confirmations
+        self.sources = [
+            (web3.toChecksumAddress(address), EventDecoder(name, loadABI(abi), events))
+            for (name, address, abi, events) in contracts
+        ]
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    @classmethod
+    def forContracts(cls, path, snote=None, treasuryManager=None, liquidityGauge=None, **kwargs):
+        """Gauge checkpoints are emitted for every gauge depositor, they are only indexed when
+        a liquidityGauge is given"""
+        snote = EnvironmentConfig["sNOTE"] if snote is None else snote
+        treasuryManager = EnvironmentConfig["TreasuryManager"] if treasuryManager is None else treasuryManager
+        contracts = [
+            ("sNOTE", snote, "./abi/sNOTE.json", SNOTE_EVENTS),
+            ("TreasuryManager", treasuryManager, "./abi/TreasuryManager.json", TREASURY_MANAGER_EVENTS),
+        ]
+        if liquidityGauge is not None:
+            contracts.append(("LiquidityGauge", liquidityGauge, "./abi/balancer/LiquidityGauge.json", LIQUIDITY_GAUGE_EVENTS))
+        return cls(path, contracts, **kwargs)
+
+    def close(self):
+        self.db.close()
+
+    def checkpoint(self, address, event):
+        row = self.db.execute(
+            "SELECT lastBlock FROM checkpoints WHERE contract = ? AND event = ?", (address, event)
+        ).fetchone()
+        return self.fromBlock - 1 if row is None else row[0]
+
+    def run(self, toBlock=None):
+        """Fetches and stores all events up to toBlock, returns the number of new events"""
+        toBlock = chain.height - self.confirmations if toBlock is None else toBlock
+        inserted = 0
+        for (address, decoder) in self.sources:
+            checkpoints = dict((e, self.checkpoint(address, e)) for e in decoder.byName.keys())
+            start = min(checkpoints.values()) + 1
+            for (end, logs) in self._getLogs(address, decoder.topics, start, toBlock):
+                rows = [
+                    (blockNumber, logIndex, txHash, address, event, args)
+                    for (blockNumber, logIndex, txHash, event, args) in decoder.decode(logs)
+                    if blockNumber > checkpoints[event]
+                ]
+                with self.db:
+                    self.db.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)", rows)
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+                        [(address, e, max(end, checkpoints[e])) for e in checkpoints.keys()]
+                    )
+                inserted += len(rows)
+        return inserted
+
+    def _getLogs(self, address, topics, start, end):
+        while start <= end:
+            stop = min(start + self.blockChunk - 1, end)
+            try:
+                logs = web3.eth.get_logs({
+                    "address": address,
+                    "fromBlock": start,
+                    "toBlock": stop,
+                    # A list in the first position matches any of the event topics
+                    "topics": [topics]
+                })
+            except (ValueError, RequestException):
+                if stop == start:
+                    raise
+                self.blockChunk = max(self.blockChunk // 2, 1)
+                continue
+
+            yield (stop, logs)
+            if len(logs) < TARGET_LOGS_PER_CHUNK:
+                self.blockChunk = min(self.blockChunk * 2, MAX_BLOCK_CHUNK)
+            start = stop + 1
+
+    def events(self, event=None, contract=None, fromBlock=0, toBlock=None):
+        """Returns stored events in chain order with their args decoded back to Python values"""
+        decoders = dict((address, decoder) for (address, decoder) in self.sources)
+        query = "SELECT blockNumber, logIndex, transactionHash, contract, event, args FROM events WHERE blockNumber >= ?"
+        params = [fromBlock]
+        if toBlock is not None:
+            query += " AND blockNumber <= ?"
+            params.append(toBlock)
+        if event is not None:
+            query += " AND event = ?"
+            params.append(event)
+        if contract is not None:
+            query += " AND contract = ?"
+            params.append(web3.toChecksumAddress(contract))
+        query += " ORDER BY blockNumber, logIndex"
+
+        return [
+            {
+                "blockNumber": blockNumber,
+                "logIndex": logIndex,
+                "transactionHash": txHash,
+                "address": address,
+                "event": name,
+                "args": decoders[address].parseArgs(name, args)
+            }
+            for (blockNumber, logIndex, txHash, address, name, args) in self.db.execute(query, params)
+            # Skip events stored by an indexer configured with other contracts or events
+            if address in decoders and name in decoders[address].byName
+        ]
+
+def main(path="events.db", toBlock=None):
+    indexer = EventIndexer.forContracts(path)
+    inserted = indexer.run(None if toBlock is None else int(toBlock))
+    print("Indexed {} new events".format(inserted))
+    indexer.close()
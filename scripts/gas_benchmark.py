@@ -0,0 +1,171 @@
+import eth_abi
+import json
+import os
+import time
+from collections import namedtuple
+from brownie import Wei
+from brownie.network.state import Chain
+from scripts.common import DEX_ID, TRADE_TYPE, set_dex_flags, set_trade_type_flags, get_univ3_single_data
+from scripts.environment import TestAccounts, ETH_ADDRESS, create_environment
+
+chain = Chain()
+
+DEFAULT_BASELINE_PATH = "tests/gas_baseline.json"
+# Relative gas increase over the baseline that counts as a regression
+GAS_REGRESSION_THRESHOLD = 0.02
+SIZES = [1, 10, 100]
+
+# setup prepares the chain for one call and returns a function that sends the measured
+# transaction, only that function is timed
+BenchmarkCase = namedtuple("BenchmarkCase", ["name", "sizes", "setup"])
+
+def _mintFromETH(env, testAccounts, size):
+    account = testAccounts.ETHWhale
+    env.note.transfer(account, size * 1e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": account})
+    return lambda: env.sNOTE.mintFromETH(size * 1e8, 0, {"from": account, "value": size * 0.01e18})
+
+def _mintFromWETH(env, testAccounts, size):
+    account = testAccounts.WETHWhale
+    env.note.transfer(account, size * 1e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": account})
+    env.weth.approve(env.sNOTE.address, 2**255-1, {"from": account})
+    return lambda: env.sNOTE.mintFromWETH(size * 1e8, size * 0.01e18, 0, {"from": account})
+
+def _mintFromBPT(env, testAccounts, size):
+    account = testAccounts.ETHWhale
+    env.note.transfer(account, size * 1e8, {"from": env.deployer})
+    env.note.approve(env.balancerVault.address, 2**256-1, {"from": account})
+    # [EXACT_TOKENS_IN_FOR_BPT_OUT, [ETH, NOTE], minBPTOut]
+    userData = eth_abi.encode_abi(['uint256', 'uint256[]', 'uint256'], [1, [0, Wei(size * 1e8)], 0])
+    env.balancerVault.joinPool(
+        env.poolId,
+        account,
+        account,
+        ([ETH_ADDRESS, env.note.address], [0, size * 1e8], userData, False),
+        {"from": account}
+    )
+    env.balancerPool.approve(env.sNOTE.address, 2**255-1, {"from": account})
+    bptBalance = env.balancerPool.balanceOf(account)
+    return lambda: env.sNOTE.mintFromBPT(bptBalance, {"from": account})
+
+def _startCoolDown(env, testAccounts, size):
+    _mintFromETH(env, testAccounts, size)()
+    return lambda: env.sNOTE.startCoolDown({"from": testAccounts.ETHWhale})
+
+def _redeem(redeemToETH):
+    def setup(env, testAccounts, size):
+        account = testAccounts.ETHWhale
+        _mintFromETH(env, testAccounts, size)()
+        env.sNOTE.startCoolDown({"from": account})
+        chain.mine(timestamp=(chain.time() + env.sNOTE.coolDownTimeInSeconds() + 5))
+        balance = env.sNOTE.balanceOf(account)
+        return lambda: env.sNOTE.redeem(balance, 0, 0, redeemToETH, {"from": account})
+    return setup
+
+def _extractTokensForCollateralShortfall(env, testAccounts, size):
+    # size is the percentage of the staked BPT requested, the contract caps it at 50%
+    bptAmount = env.liquidityGauge.balanceOf(env.sNOTE.address) * size // 100
+    return lambda: env.sNOTE.extractTokensForCollateralShortfall(bptAmount, {"from": env.deployer})
+
+def _investWETHAndNOTE(env, testAccounts, size):
+    env.treasuryManager.setManager(testAccounts.testManager, {"from": env.deployer})
+    env.treasuryManager.setNOTEPurchaseLimit(0.01e8, {"from": env.deployer})
+    env.weth.transfer(env.treasuryManager.address, 1e18, {"from": testAccounts.WETHWhale})
+    env.weth.approve(env.balancerVault.address, 2**255, {"from": testAccounts.WETHWhale})
+    env.note.approve(env.balancerVault.address, 2**255, {"from": testAccounts.WETHWhale})
+    # Initialize the price oracle
+    env.buyNOTE(1e8, testAccounts.WETHWhale)
+    env.sellNOTE(1e8, testAccounts.WETHWhale)
+    chain.sleep(3600)
+    chain.mine()
+    # Unused burn trade, noteBurnPercent is zero
+    trade = [TRADE_TYPE["EXACT_IN_SINGLE"], env.weth.address, env.note.address, 0, 0, chain.time() + 20000, bytes()]
+    return lambda: env.treasuryManager.investWETHAndNOTE(size * 0.01e18, 0, 0, trade, {"from": testAccounts.testManager})
+
+def _executeTrade(env, testAccounts, size):
+    # size is the percentage of the COMP balance sold
+    env.treasuryManager.setManager(testAccounts.testManager, {"from": env.deployer})
+    env.tradingModule.setTokenPermissions(
+        env.treasuryManager.address,
+        env.comp.address,
+        [
+            True,
+            set_dex_flags(0, UNISWAP_V3=True),
+            set_trade_type_flags(0, EXACT_IN_SINGLE=True)
+        ],
+        {"from": env.notional.owner()}
+    )
+    trade = [
+        TRADE_TYPE["EXACT_IN_SINGLE"],
+        env.comp.address,
+        env.weth.address,
+        env.comp.balanceOf(env.treasuryManager.address) * size // 100,
+        0,
+        chain.time() + 20000,
+        get_univ3_single_data(3000)
+    ]
+    return lambda: env.treasuryManager.executeTrade(trade, DEX_ID["UNISWAP_V3"], {"from": testAccounts.testManager})
+
+BENCHMARKS = [
+    BenchmarkCase("mintFromETH", SIZES, _mintFromETH),
+    BenchmarkCase("mintFromWETH", SIZES, _mintFromWETH),
+    BenchmarkCase("mintFromBPT", SIZES, _mintFromBPT),
+    BenchmarkCase("startCoolDown", [1], _startCoolDown),
+    BenchmarkCase("redeem(ETH)", SIZES, _redeem(True)),
+    BenchmarkCase("redeem(WETH)", SIZES, _redeem(False)),
+    BenchmarkCase("extractTokensForCollateralShortfall", [1, 10, 50], _extractTokensForCollateralShortfall),
+    BenchmarkCase("investWETHAndNOTE", SIZES, _investWETHAndNOTE),
+    BenchmarkCase("executeTrade", [1, 10, 100], _executeTrade),
+]
+
+def runBenchmarks(env, benchmarks=BENCHMARKS):
+    """Runs every case from the same chain state and returns
+    {name: {size: {"gasUsed", "wallTime"}}}, sizes are string keys as in the baseline file.
+
+    Takes the chain snapshot itself and reverts to it after every case, callers must not
+    hold a snapshot of their own across the call since brownie keeps only one."""
+    testAccounts = TestAccounts()
+    results = {}
+    chain.snapshot()
+    for case in benchmarks:
+        results[case.name] = {}
+        for size in case.sizes:
+            send = case.setup(env, testAccounts, size)
+            start = time.perf_counter()
+            txn = send()
+            wallTime = time.perf_counter() - start
+            results[case.name][str(size)] = {"gasUsed": txn.gas_used, "wallTime": wallTime}
+            chain.revert()
+    return results
+
+def loadBaseline(path=DEFAULT_BASELINE_PATH):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def writeBaseline(results, path=DEFAULT_BASELINE_PATH):
+    with open(path, "w") as f:
+        json.dump(results, f, sort_keys=True, indent=4)
+
+def findRegressions(results, baseline, threshold=GAS_REGRESSION_THRESHOLD):
+    """Returns (name, size, baseline gas, gas) for every call that uses more gas than the
+    baseline allows. Wall time is recorded for reference only, it is too noisy to gate on."""
+    regressions = []
+    for (name, sizes) in results.items():
+        for (size, result) in sizes.items():
+            expected = baseline.get(name, {}).get(size)
+            if expected is None:
+                continue
+            if result["gasUsed"] > expected["gasUsed"] * (1 + threshold):
+                regressions.append((name, size, expected["gasUsed"], result["gasUsed"]))
+    return regressions
+
+def main(path=DEFAULT_BASELINE_PATH):
+    env = create_environment()
+    results = runBenchmarks(env)
+    for (name, sizes) in results.items():
+        for (size, result) in sizes.items():
+            print("{}[{}] gas={} time={:.3f}s".format(name, size, result["gasUsed"], result["wallTime"]))
+    writeBaseline(results, path)
@@ -0,0 +1,157 @@
+from collections import namedtuple
+from brownie import web3
+from scripts.common import CurrencyId
+from scripts.environment import create_environment
+from scripts.multicall import BatchReader
+
+# Notional Constants
+ASSET_RATE_DECIMAL_DIFFERENCE = 10**10
+ETH_INTERNAL_TO_WEI = 10**10
+
+# Gas used by harvestAssetsFromNotional outside of the per currency loop and by each currency
+# in it, used when no estimates are taken from the node
+DEFAULT_BASE_GAS = 60000
+DEFAULT_CURRENCY_GAS = 150000
+# Block gas limit is far above any batch, this only bounds what a single transaction carries
+DEFAULT_MAX_GAS_PER_TX = 3000000
+# TreasuryManager methods a batch is sent to
+HARVEST_RESERVES = "harvestAssetsFromNotional"
+HARVEST_INTEREST = "harvestAssetInterestFromNotional"
+
+HarvestCandidate = namedtuple("HarvestCandidate", [
+    "currencyId",
+    "assetCash",        # excess reserve in asset cash internal precision
+    "underlying",       # the same amount in underlying internal precision
+    "valueETH",         # in wei, at the Notional ETH rate without haircut
+    "gas",              # marginal gas of including the currency
+])
+
+HarvestBatch = namedtuple("HarvestBatch", [
+    "method",           # HARVEST_RESERVES or HARVEST_INTEREST
+    "currencies",       # sorted, transferReserveToTreasury requires increasing ids
+    "valueETH",
+    "gas",
+    "costETH",
+    "netETH",
+])
+
+def convertToUnderlying(assetRate, assetCash):
+    """AssetRate.convertToUnderlying, internal precision in and out"""
+    (_, rate, underlyingDecimals) = assetRate
+    return (rate * assetCash) // ASSET_RATE_DECIMAL_DIFFERENCE // underlyingDecimals
+
+def convertToETH(ethRate, underlying):
+    """ExchangeRate.convertToETH for a positive balance without the haircut, in wei"""
+    (rateDecimals, rate, _, _, _) = ethRate
+    return (underlying * rate // rateDecimals) * ETH_INTERNAL_TO_WEI
+
+class HarvestPlanner:
+    """Chooses which currencies TreasuryManager.harvestAssetsFromNotional should harvest.
+
+    Excess reserves (reserve balance above the reserve buffer, what transferReserveToTreasury
+    sends) and the rates needed to value them are read for every currency in one batched
+    read. A currency is only worth including when its value is above the gas it adds, the
+    costs are additive so the best single transaction holds every such currency. Batches
+    are only split when they would exceed maxGasPerTx, and a batch is dropped when its net
+    value does not cover the base transaction cost.
+
+    Interest harvested by harvestAssetInterestFromNotional is not exposed by a Notional
+    view, estimates can be passed to plan as interest candidates. They are planned into their
+    own batches for that method, each batch is tagged with the method to call.
+    """
+
+    def __init__(self, candidates, gasPrice, baseGas=DEFAULT_BASE_GAS, maxGasPerTx=DEFAULT_MAX_GAS_PER_TX) -> None:
+        self.candidates = candidates
+        self.gasPrice = int(gasPrice)
+        self.baseGas = baseGas
+        self.maxGasPerTx = maxGasPerTx
+
+    @classmethod
+    def fromEnvironment(cls, env, currencies=None, gasPrice=None, block=None, currencyGas=None, **kwargs):
+        """currencyGas maps currency ids to their marginal gas, see estimateCurrencyGas"""
+        currencies = sorted(CurrencyId.values()) if currencies is None else sorted(currencies)
+        reader = BatchReader(env, block)
+        results = reader.call(
+            [(env.notional, "getReserveBalance", [c]) for c in currencies] +
+            [(env.notional, "getReserveBuffer", [c]) for c in currencies] +
+            [(env.notional, "getCurrencyAndRates", [c]) for c in currencies]
+        )
+        n = len(currencies)
+        (balances, buffers, rates) = (results[:n], results[n:2 * n], results[2 * n:])
+        currencyGas = {} if currencyGas is None else currencyGas
+
+        candidates = []
+        for (currencyId, balance, buffer, (_, _, ethRate, assetRate)) in zip(currencies, balances, buffers, rates):
+            excess = balance - buffer
+            if excess <= 0:
+                continue
+            underlying = convertToUnderlying(assetRate, excess)
+            candidates.append(HarvestCandidate(
+                currencyId,
+                excess,
+                underlying,
+                convertToETH(ethRate, underlying),
+                currencyGas.get(currencyId, DEFAULT_CURRENCY_GAS)
+            ))
+        gasPrice = web3.eth.gas_price if gasPrice is None else gasPrice
+        return cls(candidates, gasPrice, **kwargs)
+
+    @staticmethod
+    def estimateCurrencyGas(env, currencies, baseGas=DEFAULT_BASE_GAS):
+        """Marginal gas per currency from eth_estimateGas of a single currency harvest sent
+        by the manager, one request per currency"""
+        manager = env.treasuryManager.manager()
+        return dict(
+            (c, max(env.treasuryManager.harvestAssetsFromNotional.estimate_gas([c], {"from": manager}) - baseGas, 0))
+            for c in currencies
+        )
+
+    def cost(self, gas):
+        return gas * self.gasPrice
+
+    def _batch(self, method, candidates):
+        gas = self.baseGas + sum(c.gas for c in candidates)
+        value = sum(c.valueETH for c in candidates)
+        return HarvestBatch(
+            method,
+            sorted(c.currencyId for c in candidates),
+            value,
+            gas,
+            self.cost(gas),
+            value - self.cost(gas)
+        )
+
+    def plan(self, interestCandidates=[]):
+        """Returns the batches to send for both harvest methods, most valuable first. Currencies
+        whose value does not cover their marginal gas are left for a later harvest."""
+        batches = self._planMethod(HARVEST_RESERVES, self.candidates) + self._planMethod(HARVEST_INTEREST, interestCandidates)
+        return sorted(batches, key=lambda b: b.netETH, reverse=True)
+
+    def _planMethod(self, method, candidates):
+        currencies = [c.currencyId for c in candidates]
+        if len(set(currencies)) != len(currencies):
+            raise Exception("Duplicate currency in {} candidates".format(method))
+        worthwhile = [c for c in candidates if c.valueETH > self.cost(c.gas)]
+        # First fit by decreasing net value, each batch stays under maxGasPerTx
+        worthwhile.sort(key=lambda c: c.valueETH - self.cost(c.gas), reverse=True)
+        groups = []
+        for candidate in worthwhile:
+            group = next((
+                g for g in groups
+                if self.baseGas + sum(c.gas for c in g) + candidate.gas <= self.maxGasPerTx
+            ), None)
+            if group is None:
+                groups.append([candidate])
+            else:
+                group.append(candidate)
+
+        batches = [self._batch(method, g) for g in groups]
+        return [b for b in batches if b.netETH > 0]
+
+def main(gasPrice=None):
+    env = create_environment(lazy=True)
+    planner = HarvestPlanner.fromEnvironment(env, gasPrice=None if gasPrice is None else int(gasPrice))
+    for c in planner.candidates:
+        print("currency {} excess {} value {:.6f} ETH".format(c.currencyId, c.assetCash, c.valueETH / 1e18))
+    for batch in planner.plan():
+        print("{}({}) net {:.6f} ETH gas {}".format(batch.method, batch.currencies, batch.netETH / 1e18, batch.gas))
@@ -1,6 +1,7 @@
-import json
 import eth_abi
-from brownie import Contract, Wei, sNOTE
+from brownie import Wei, sNOTE
+from scripts.deployers.deployment_state import DeploymentState
+from scripts.registry import LazyContract, getContract
 
 from scripts.deployers.snote_deployer import SNoteConfig
 
@@ -30,20 +31,17 @@ BalancerConfig = {
 }
 
 class BalancerInitializer:
-    def __init__(self, network, deployer, config=None, persist=True) -> None:
-        self.config = config
-        self.persist = persist
-        self.network = network
-        if self.network == "hardhat-fork":
-            self.network = "mainnet"
-            self.persist = False
+    def __init__(self, network, deployer, config=None, persist=True, state=None) -> None:
+        if state is None:
+            state = DeploymentState(network, config, persist)
+        self.state = state
+        self.network = state.network
+        self.persist = state.persist
         self.deployer = deployer
         self._load()
 
     def _load(self):
-        if self.config == None:
-            with open("v2.{}.json".format(self.network), "r") as f:
-                self.config = json.load(f)
+        self.config = self.state.config
         self.vault = self._loadVault(BalancerConfig[self.network]["vault"])
         self.pool = self._loadPool(self.config["staking"]["pool"]["address"])
         self.note = self._loadNote(self.config["note"])
@@ -51,27 +49,19 @@ class BalancerInitializer:
         self.weth = self._loadWETH()
 
     def _loadPool(self, address):
-        with open("./abi/balancer/pool.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('BalancerPool', address, abi)
+        return LazyContract('BalancerPool', address, "./abi/balancer/pool.json")
 
     def _loadSNote(self, address):
-        return Contract.from_abi('sNOTE', address, sNOTE.abi)
+        return getContract('sNOTE', address, sNOTE.abi)
         
     def _loadWETH(self):
-        with open("./abi/ERC20.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi("WETH", SNoteConfig[self.network]["weth"], abi)
+        return LazyContract("WETH", SNoteConfig[self.network]["weth"], "./abi/ERC20.json")
 
     def _loadNote(self, address):
-        with open("./abi/notional/note.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('NOTE', address, abi)
+        return LazyContract('NOTE', address, "./abi/notional/note.json")
 
     def _loadVault(self, address):
-        with open("./abi/balancer/vault.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi('BalancerVault', address, abi)
+        return LazyContract('BalancerVault', address, "./abi/balancer/vault.json")
 
     def initPool(self):
         bptBalance = self.pool.balanceOf(self.sNote)
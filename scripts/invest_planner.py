@@ -0,0 +1,171 @@
+import numpy as np
+from collections import namedtuple
+from scripts.balancer_math import calculateInvariant, calcBptOutGivenExactTokensIn, calcDueTokenProtocolSwapFeeAmount
+from scripts.oracle_replay import PAIR_PRICE
+from scripts.pool_math import WETH_INDEX, NOTE_INDEX, NOTE_PRECISION_SCALE, getNOTESpotPrice, toUint256
+from scripts.registry import getContract
+
+# TreasuryManager.NOTE_PURCHASE_LIMIT_PRECISION
+NOTE_PURCHASE_LIMIT_PRECISION = 10**8
+DEFAULT_NOTE_CANDIDATES = 33
+
+InvestmentPlan = namedtuple("InvestmentPlan", [
+    "wethAmount",       # investWETHAndNOTE wethAmount, including the NOTE burn portion
+    "noteAmount",
+    "minBPT",
+    "wethForNOTEBurn",  # trade.amount of the buy and burn trade
+    "bptOut",           # expected BPT received by sNOTE
+    "spotPrice",        # _getNOTESpotPrice after the join
+    "maxPrice"          # spot price limit from the oracle price and notePurchaseLimit
+])
+
+class InvestPlanner:
+    """Models TreasuryManager.investWETHAndNOTE against a snapshot of the pool: the
+    EXACT_TOKENS_IN_FOR_BPT_OUT join into the WeightedPool2Tokens (including the protocol
+    swap fees charged before it), the post join _getNOTESpotPrice and the "price impact is
+    too high" check against the time weighted oracle price.
+
+    The spot price only depends on the post join balances so the largest WETH amount that
+    passes the check is solved exactly in closed form, vectorized over candidate NOTE amounts.
+    The pool math is only evaluated for the chosen candidate to get minBPT.
+
+    The buy and burn trade is not modelled, if it fills against this pool it moves the
+    spot price before the join.
+    """
+
+    def __init__(self, balances, bptSupply, normalizedWeights, swapFee, lastInvariant, protocolSwapFee,
+        noteOraclePrice, notePurchaseLimit, noteBurnPercent=0, wethIndex=WETH_INDEX, noteIndex=NOTE_INDEX) -> None:
+        self.wethIndex = wethIndex
+        self.noteIndex = noteIndex
+        self.scalingFactors = [1, 1]
+        self.scalingFactors[noteIndex] = NOTE_PRECISION_SCALE
+        self.normalizedWeights = [int(w) for w in normalizedWeights]
+        self.bptSupply = int(bptSupply)
+        self.swapFee = int(swapFee)
+        self.noteOraclePrice = int(noteOraclePrice)
+        self.notePurchaseLimit = int(notePurchaseLimit)
+        self.noteBurnPercent = int(noteBurnPercent)
+        self.maxPrice = self.noteOraclePrice + (self.noteOraclePrice * self.notePurchaseLimit) // NOTE_PURCHASE_LIMIT_PRECISION
+
+        # Protocol swap fees accrued since the last join or exit are paid in the heaviest
+        # token at the start of the join, they do not depend on the amounts joined
+        upscaled = [int(b) * s for (b, s) in zip(balances, self.scalingFactors)]
+        dueProtocolFees = [0, 0]
+        if protocolSwapFee > 0:
+            heaviest = 0 if self.normalizedWeights[0] > self.normalizedWeights[1] else 1
+            dueProtocolFees[heaviest] = calcDueTokenProtocolSwapFeeAmount(
+                upscaled[heaviest],
+                self.normalizedWeights[heaviest],
+                int(lastInvariant),
+                calculateInvariant(self.normalizedWeights, upscaled),
+                int(protocolSwapFee)
+            )
+        self.joinBalances = [b - f for (b, f) in zip(upscaled, dueProtocolFees)]
+        # Vault balances once the fees are paid, fees are downscaled rounding down
+        self.balances = [int(b) - f // s for (b, f, s) in zip(balances, dueProtocolFees, self.scalingFactors)]
+
+    @classmethod
+    def fromEnvironment(cls, env, block=None):
+        pool = env.balancerPool
+        manager = env.treasuryManager
+        (_, balances, _) = env.balancerVault.getPoolTokens(env.poolId, block_identifier=block)
+        feesCollector = getContract(
+            "ProtocolFeesCollector",
+            env.balancerVault.getProtocolFeesCollector(block_identifier=block),
+            "./abi/balancer/protocolFeesCollector.json"
+        )
+        oracle = getContract("BalancerPriceOracle", pool.address, "./abi/balancer/priceOracle.json")
+        window = manager.priceOracleWindowInSeconds(block_identifier=block)
+        return cls(
+            balances,
+            pool.totalSupply(block_identifier=block),
+            pool.getNormalizedWeights(block_identifier=block),
+            pool.getSwapFeePercentage(block_identifier=block),
+            pool.getLastInvariant(block_identifier=block),
+            feesCollector.getSwapFeePercentage(block_identifier=block),
+            oracle.getTimeWeightedAverage([(PAIR_PRICE, window, 0)], block_identifier=block)[0],
+            manager.notePurchaseLimit(block_identifier=block),
+            manager.noteBurnPercent(block_identifier=block),
+            manager.WETH_INDEX(),
+            manager.NOTE_INDEX()
+        )
+
+    def spotPriceAfterJoin(self, wethForInvest, noteAmount):
+        balances = [None, None]
+        balances[self.wethIndex] = toUint256(wethForInvest) + self.balances[self.wethIndex]
+        balances[self.noteIndex] = toUint256(noteAmount) + self.balances[self.noteIndex]
+        return getNOTESpotPrice(balances, self.wethIndex, self.noteIndex)
+
+    def maxWethForInvest(self, noteAmounts):
+        """Largest WETH joined alongside each NOTE amount that keeps the spot price at or
+        below maxPrice, -1 where even a NOTE only join fails the check"""
+        noteAmounts = np.asarray(toUint256(noteAmounts), dtype=object)
+        noteBal = (noteAmounts + self.balances[self.noteIndex]) * NOTE_PRECISION_SCALE
+        denominator = (noteBal * 125) // 100
+        # floor(weth * 5e18 / denominator) <= maxPrice  <=>  weth * 5e18 <= (maxPrice + 1) * denominator - 1
+        maxWethBalance = ((self.maxPrice + 1) * denominator - 1) // (5 * 10**18)
+        maxWeth = maxWethBalance - self.balances[self.wethIndex]
+        return np.where(maxWeth < 0, -1, maxWeth)
+
+    def wethAmountFor(self, wethForInvest):
+        """Largest investWETHAndNOTE wethAmount whose invested part, after noteBurnPercent is
+        taken out for the burn trade, does not exceed wethForInvest"""
+        wethForInvest = np.asarray(wethForInvest, dtype=object)
+        if self.noteBurnPercent == 100:
+            raise Exception("All WETH is used to burn NOTE")
+        keep = 100 - self.noteBurnPercent
+        wethAmount = (wethForInvest * 100) // keep + 1
+        # The burn portion rounds down, step back until the invested part fits
+        for _ in range(3):
+            invested = wethAmount - (wethAmount * self.noteBurnPercent) // 100
+            wethAmount = np.where(invested > wethForInvest, wethAmount - 1, wethAmount)
+        return wethAmount
+
+    def bptOut(self, wethForInvest, noteAmount):
+        amountsIn = [0, 0]
+        amountsIn[self.wethIndex] = int(wethForInvest)
+        amountsIn[self.noteIndex] = int(noteAmount) * NOTE_PRECISION_SCALE
+        return calcBptOutGivenExactTokensIn(
+            self.joinBalances,
+            self.normalizedWeights,
+            amountsIn,
+            self.bptSupply,
+            self.swapFee
+        )
+
+    def plan(self, maxWeth, maxNote, noteCandidates=None, slippage=0):
+        """Returns the InvestmentPlan with the largest ETH value, bounded by the available
+        maxWeth and maxNote, or None if no candidate passes the price check. minBPT is the
+        exact expected BPT when slippage is zero."""
+        maxWeth = int(maxWeth)
+        maxNote = int(maxNote)
+        if noteCandidates is None:
+            n = DEFAULT_NOTE_CANDIDATES - 1
+            noteCandidates = [(maxNote * i) // n for i in range(n + 1)]
+        noteAmounts = np.minimum(np.asarray(toUint256(noteCandidates), dtype=object), maxNote)
+
+        wethForInvest = self.maxWethForInvest(noteAmounts)
+        valid = wethForInvest >= 0
+        if not np.any(valid):
+            return None
+        wethAmounts = np.minimum(self.wethAmountFor(np.where(valid, wethForInvest, 0)), maxWeth)
+
+        # Value everything in ETH at the oracle price, NOTE has 8 decimals
+        values = wethAmounts + (noteAmounts * NOTE_PRECISION_SCALE * self.noteOraclePrice) // 10**18
+        values = np.where(valid, values, -1)
+        best = int(np.argmax(values))
+
+        wethAmount = int(wethAmounts[best])
+        noteAmount = int(noteAmounts[best])
+        wethForNOTEBurn = (wethAmount * self.noteBurnPercent) // 100
+        invested = wethAmount - wethForNOTEBurn
+        bptOut = self.bptOut(invested, noteAmount)
+        return InvestmentPlan(
+            wethAmount,
+            noteAmount,
+            (bptOut * (10**18 - int(slippage * 1e18))) // 10**18,
+            wethForNOTEBurn,
+            bptOut,
+            self.spotPriceAfterJoin(invested, noteAmount),
+            self.maxPrice
+        )
@@ -0,0 +1,75 @@
+from brownie.exceptions import VirtualMachineError
+from brownie.network.state import Chain
+from requests.exceptions import RequestException
+from scripts.common import loadContractFromABI
+from scripts.environment import EnvironmentConfig
+
+chain = Chain()
+
+DEFAULT_CHUNK_SIZE = 500
+
+class BatchReader:
+    """Packs many view calls into aggregated Multicall3 eth_calls, all pinned to the same block.
+
+    Chunks that fail as a whole (response too large, out of gas, node timeouts) are split in
+    half and retried until a single call fails on its own.
+    """
+
+    def __init__(self, env, block=None, chunkSize=DEFAULT_CHUNK_SIZE, aggregator=None) -> None:
+        self.env = env
+        self.chunkSize = chunkSize
+        # Pin every chunk to the same block so results are a consistent snapshot
+        self.block = chain.height if block is None else block
+        if aggregator is None:
+            aggregator = env.config.get("Multicall3", EnvironmentConfig["Multicall3"])
+        self.multicall = loadContractFromABI("Multicall3", aggregator, "./abi/Multicall3.json")
+
+    def call(self, calls, allowFailure=False):
+        """Executes a list of (contract, method name, args) tuples and returns the decoded
+        results in the same order. Failed calls return None when allowFailure is set."""
+        methods = []
+        encoded = []
+        for (contract, name, args) in calls:
+            method = getattr(contract, name)
+            methods.append(method)
+            encoded.append((contract.address, allowFailure, method.encode_input(*args)))
+
+        results = []
+        for start in range(0, len(encoded), self.chunkSize):
+            results.extend(self._aggregate(encoded[start:start + self.chunkSize]))
+
+        decoded = []
+        for (method, (success, returnData)) in zip(methods, results):
+            if not success:
+                decoded.append(None)
+            else:
+                decoded.append(method.decode_output(returnData))
+        return decoded
+
+    def _aggregate(self, encoded):
+        try:
+            return self.multicall.aggregate3.call(encoded, block_identifier=self.block)
+        except (ValueError, VirtualMachineError, RequestException):
+            if len(encoded) == 1:
+                raise
+            # Oversized responses or gas limits, split the chunk and retry each half
+            mid = len(encoded) // 2
+            return self._aggregate(encoded[:mid]) + self._aggregate(encoded[mid:])
+
+    def _callForAccounts(self, contract, name, accounts):
+        return self.call([(contract, name, [account]) for account in accounts])
+
+    def balanceOf(self, accounts):
+        return self._callForAccounts(self.env.sNOTE, "balanceOf", accounts)
+
+    def tokenClaimOf(self, accounts):
+        return self._callForAccounts(self.env.sNOTE, "tokenClaimOf", accounts)
+
+    def poolTokenShareOf(self, accounts):
+        return self._callForAccounts(self.env.sNOTE, "poolTokenShareOf", accounts)
+
+    def votingPowerWithoutDelegation(self, accounts):
+        return self._callForAccounts(self.env.sNOTE, "votingPowerWithoutDelegation", accounts)
+
+    def accountRedeemWindowBegin(self, accounts):
+        return self._callForAccounts(self.env.sNOTE, "accountRedeemWindowBegin", accounts)
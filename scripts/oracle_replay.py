@@ -0,0 +1,159 @@
+import bisect
+import numpy as np
+from scripts.balancer_math import _sdiv, exp
+from scripts.multicall import BatchReader
+from scripts.registry import getContract
+
+# IPriceOracle.Variable
+PAIR_PRICE = 0
+BPT_PRICE = 1
+INVARIANT = 2
+
+# LogCompression.fromLowResLog, oracle samples store logs with 4 decimals
+LOG_COMPRESSION_FACTOR = 10**14
+
+def fromLowResLog(value):
+    return exp(value * LOG_COMPRESSION_FACTOR)
+
+class OracleReplay:
+    """Replays the Balancer WeightedPool2Tokens price oracle from its samples so that
+    getTimeWeightedAverage queries can be answered for any point in time without an
+    archive node call. Samples are ingested once, each query is a binary search.
+
+    The oracle only keeps the last 1024 samples, calling update periodically extends
+    the history. The newest sample of a pool snapshot may still be accumulating, it
+    is replaced by the final version on the next update. Queries made at a time inside
+    a sample's accumulation window (at most two minutes) extrapolate from the sample
+    before it instead.
+    """
+
+    def __init__(self) -> None:
+        self.timestamps = []
+        # Per variable instant values and accumulators, indexed by IPriceOracle.Variable
+        self.instants = [[], [], []]
+        self.accumulators = [[], [], []]
+        self._provisional = None
+        self._timestampArray = None
+
+    @classmethod
+    def fromEnvironment(cls, env, block=None):
+        replay = cls()
+        replay.update(env, block)
+        return replay
+
+    def update(self, env, block=None):
+        """Reads every oracle sample of the sNOTE pool in one batched read and merges it"""
+        oracle = getContract("BalancerPriceOracle", env.balancerPool.address, "./abi/balancer/priceOracle.json")
+        reader = BatchReader(env, block)
+        totalSamples = oracle.getTotalSamples(block_identifier=reader.block)
+        latestIndex = oracle.getMiscData(block_identifier=reader.block)["oracleIndex"]
+        samples = reader.call([(oracle, "getSample", [i]) for i in range(totalSamples)])
+        self.ingest(samples, latestIndex)
+
+    def ingest(self, samples, latestIndex=None):
+        """Merges getSample results into the history, uninitialized samples are skipped"""
+        # The provisional sample from the last ingest has been superseded by whatever is
+        # now at its index
+        if self._provisional is not None:
+            self._remove(self._provisional)
+            self._provisional = None
+
+        for (index, sample) in enumerate(samples):
+            (logPairPrice, accLogPairPrice, logBptPrice, accLogBptPrice, logInvariant, accLogInvariant, timestamp) = sample
+            if timestamp == 0:
+                continue
+            self._insert(
+                timestamp,
+                (logPairPrice, logBptPrice, logInvariant),
+                (accLogPairPrice, accLogBptPrice, accLogInvariant)
+            )
+            if index == latestIndex:
+                self._provisional = timestamp
+        self._timestampArray = np.array(self.timestamps, dtype=np.int64)
+
+    def _insert(self, timestamp, instants, accumulators):
+        i = bisect.bisect_left(self.timestamps, timestamp)
+        if i < len(self.timestamps) and self.timestamps[i] == timestamp:
+            return
+        self.timestamps.insert(i, timestamp)
+        for v in range(3):
+            self.instants[v].insert(i, instants[v])
+            self.accumulators[v].insert(i, accumulators[v])
+
+    def _remove(self, timestamp):
+        i = bisect.bisect_left(self.timestamps, timestamp)
+        if i < len(self.timestamps) and self.timestamps[i] == timestamp:
+            del self.timestamps[i]
+            for v in range(3):
+                del self.instants[v][i]
+                del self.accumulators[v][i]
+
+    def pastAccumulator(self, variable, now, ago):
+        """PoolPriceOracle._getPastAccumulator as seen at block timestamp now"""
+        lookUpTime = now - ago
+        # Samples written after now do not exist yet at that block
+        latest = bisect.bisect_right(self.timestamps, now) - 1
+        if latest < 0:
+            raise Exception("Oracle not initialized")
+
+        accumulators = self.accumulators[variable]
+        if self.timestamps[latest] <= lookUpTime:
+            # Extrapolate from the latest sample using its instant value
+            elapsed = lookUpTime - self.timestamps[latest]
+            return accumulators[latest] + self.instants[variable][latest] * elapsed
+
+        prev = bisect.bisect_right(self.timestamps, lookUpTime) - 1
+        if prev < 0:
+            raise Exception("Oracle query too old")
+        next = prev + 1
+
+        samplesTimeDiff = self.timestamps[next] - self.timestamps[prev]
+        if samplesTimeDiff == 0:
+            return accumulators[prev]
+        accumulatorDiff = accumulators[next] - accumulators[prev]
+        elapsed = lookUpTime - self.timestamps[prev]
+        return accumulators[prev] + _sdiv(accumulatorDiff * elapsed, samplesTimeDiff)
+
+    def timeWeightedAverage(self, variable, secs, now, ago=0):
+        """IPriceOracle.getTimeWeightedAverage for a single query at block timestamp now"""
+        if secs == 0:
+            raise Exception("Oracle bad secs")
+        beginAccumulator = self.pastAccumulator(variable, now, ago + secs)
+        endAccumulator = self.pastAccumulator(variable, now, ago)
+        return fromLowResLog(_sdiv(endAccumulator - beginAccumulator, secs))
+
+    def timeWeightedAverages(self, variable, secs, nows, ago=0):
+        """Vectorized timeWeightedAverage over an array of block timestamps, returns an object array"""
+        nows = np.asarray(nows, dtype=np.int64)
+        timestamps = self._timestampArray
+        accumulators = np.array(self.accumulators[variable], dtype=object)
+        instants = np.array(self.instants[variable], dtype=object)
+
+        def accumulatorsAt(lookUpTimes):
+            latest = np.searchsorted(timestamps, nows, side="right") - 1
+            if np.any(latest < 0):
+                raise Exception("Oracle not initialized")
+            prev = np.searchsorted(timestamps, lookUpTimes, side="right") - 1
+            extrapolate = timestamps[latest] <= lookUpTimes
+            if np.any(prev[~extrapolate] < 0):
+                raise Exception("Oracle query too old")
+
+            # Clip the indexes so both branches can be evaluated on every element
+            prev = np.maximum(prev, 0)
+            next = np.minimum(prev + 1, len(timestamps) - 1)
+            extrapolated = accumulators[latest] + instants[latest] * (lookUpTimes - timestamps[latest]).astype(object)
+
+            samplesTimeDiff = (timestamps[next] - timestamps[prev]).astype(object)
+            accumulatorDiff = accumulators[next] - accumulators[prev]
+            elapsed = (lookUpTimes - timestamps[prev]).astype(object)
+            safeDiff = np.where(samplesTimeDiff == 0, 1, samplesTimeDiff)
+            interpolated = accumulators[prev] + np.frompyfunc(_sdiv, 2, 1)(accumulatorDiff * elapsed, safeDiff)
+            interpolated = np.where(samplesTimeDiff == 0, accumulators[prev], interpolated)
+            return np.where(extrapolate, extrapolated, interpolated)
+
+        if secs == 0:
+            raise Exception("Oracle bad secs")
+        beginAccumulators = accumulatorsAt(nows - ago - secs)
+        endAccumulators = accumulatorsAt(nows - ago)
+        averages = np.frompyfunc(lambda d: fromLowResLog(_sdiv(d, secs)), 1, 1)(endAccumulators - beginAccumulators)
+        return np.asarray(averages, dtype=object)
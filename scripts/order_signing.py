@@ -0,0 +1,101 @@
+import eth_abi
+import eth_keys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from eth_account._utils.signing import sign_message_hash
+from eth_account.datastructures import SignedMessage
+from eth_account.messages import defunct_hash_message
+from eth_utils import keccak
+from hexbytes import HexBytes
+
+# keccak256 of the 0x v3 LibOrder EIP712 Order type
+EIP712_ORDER_SCHEMA_HASH = keccak(text=(
+    "Order("
+    "address makerAddress,"
+    "address takerAddress,"
+    "address feeRecipientAddress,"
+    "address senderAddress,"
+    "uint256 makerAssetAmount,"
+    "uint256 takerAssetAmount,"
+    "uint256 makerFee,"
+    "uint256 takerFee,"
+    "uint256 expirationTimeSeconds,"
+    "uint256 salt,"
+    "bytes makerAssetData,"
+    "bytes takerAssetData,"
+    "bytes makerFeeAssetData,"
+    "bytes takerFeeAssetData"
+    ")"
+))
+ORDER_STRUCT_TYPES = ["bytes32"] + ["address"] * 4 + ["uint256"] * 6 + ["bytes32"] * 4
+EIP1271_SIGNATURE_TYPE = "07"
+DEFAULT_SIGN_CHUNK = 500
+
+# Only the private key is needed to sign, this is what gets sent to pool workers
+SigningKey = namedtuple("SigningKey", ["private_key"])
+
+# The exchange domain hash is immutable, it is fetched once per exchange address
+_domainHashes = {}
+
+def sign_defunct_message_raw(account, message: bytes) -> SignedMessage:
+    """Signs an `EIP-191` using this account's private key.
+
+    Args:
+        message: An text
+
+    Returns:
+        An eth_account `SignedMessage` instance.
+    """
+    msg_hash_bytes = defunct_hash_message(message)
+    eth_private_key = eth_keys.keys.PrivateKey(HexBytes(account.private_key))
+    (v, r, s, eth_signature_bytes) = sign_message_hash(eth_private_key, msg_hash_bytes)
+    return SignedMessage(
+        messageHash=msg_hash_bytes,
+        r=r,
+        s=s,
+        v=v,
+        signature=HexBytes(eth_signature_bytes),
+    )
+
+def getDomainHash(exchange):
+    if exchange.address not in _domainHashes:
+        _domainHashes[exchange.address] = HexBytes(exchange.EIP712_EXCHANGE_DOMAIN_HASH())
+    return _domainHashes[exchange.address]
+
+def hashOrder(params, domainHash):
+    """LibOrder.getTypedDataHash computed locally, params are in Order.getParams order"""
+    structHash = keccak(eth_abi.encode_abi(ORDER_STRUCT_TYPES, [
+        EIP712_ORDER_SCHEMA_HASH,
+        *params[0:4],
+        *[int(p) for p in params[4:10]],
+        *[keccak(HexBytes(data)) for data in params[10:14]]
+    ]))
+    return HexBytes(keccak(b"\x19\x01" + bytes(domainHash) + structHash))
+
+def signOrderHash(account, orderHash):
+    return sign_defunct_message_raw(account, orderHash).signature.hex() + EIP1271_SIGNATURE_TYPE
+
+def _hashAndSign(args):
+    (paramsList, domainHash, privateKey) = args
+    key = SigningKey(privateKey)
+    results = []
+    for params in paramsList:
+        orderHash = hashOrder(params, domainHash)
+        results.append((orderHash, signOrderHash(key, orderHash)))
+    return results
+
+def hashAndSignOrders(orders, exchange, account, processes=None, chunkSize=DEFAULT_SIGN_CHUNK):
+    """Returns (order hash, EIP1271 signature) for each order. Hashing and ECDSA signing are
+    CPU bound so chunks of orders are spread over a process pool, batches that fit in a single
+    chunk are signed in this process."""
+    domainHash = getDomainHash(exchange)
+    paramsList = [order.getParams() for order in orders]
+    chunks = [
+        (paramsList[start:start + chunkSize], domainHash, account.private_key)
+        for start in range(0, len(paramsList), chunkSize)
+    ]
+    if len(chunks) <= 1:
+        return _hashAndSign(chunks[0]) if len(chunks) == 1 else []
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return [result for chunk in executor.map(_hashAndSign, chunks) for result in chunk]
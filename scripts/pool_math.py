@@ -0,0 +1,144 @@
+import numpy as np
+
+MAX_UINT256 = 2**256 - 1
+
+# Pool token indexes on mainnet, Balancer requires token addresses to be sorted BAL#102
+WETH_INDEX = 0
+NOTE_INDEX = 1
+
+# NOTE is in 8 decimal precision, the views scale it up to 1e18
+NOTE_PRECISION_SCALE = 10**10
+
+_toInt = np.frompyfunc(int, 1, 1)
+
+def toUint256(values):
+    """Converts a scalar or array of amounts (int, Wei, float) into exact python
+    integers. Arrays are returned as object arrays so that uint256 math never
+    overflows or loses precision, scalars are returned as ints."""
+    result = _toInt(np.asarray(values, dtype=object))
+    _checkUint256(result)
+    return result
+
+def _checkUint256(values):
+    # Mirrors the solidity 0.8 checked arithmetic panic on overflow / underflow
+    if np.any(np.asarray(values, dtype=object) > MAX_UINT256):
+        raise OverflowError("uint256 overflow")
+    if np.any(np.asarray(values, dtype=object) < 0):
+        raise OverflowError("uint256 underflow")
+    return values
+
+def _mul(*values):
+    result = values[0]
+    for v in values[1:]:
+        result = _checkUint256(result * v)
+    return result
+
+def _unwrap(values):
+    if isinstance(values, np.ndarray) and values.ndim == 0:
+        return values.item()
+    return values
+
+def getTokenClaimForBPT(bptAmount, balances, bptSupply, wethIndex=WETH_INDEX, noteIndex=NOTE_INDEX):
+    """sNOTE.getTokenClaimForBPT, returns (wethBalance, noteBalance)"""
+    bptAmount = toUint256(bptAmount)
+    bptSupply = toUint256(bptSupply)
+    wethBal = toUint256(balances[wethIndex])
+    # increase NOTE precision to 1e18
+    noteBal = _mul(toUint256(balances[noteIndex]), NOTE_PRECISION_SCALE)
+
+    wethBalance = _mul(wethBal, bptAmount) // bptSupply
+    noteBalance = _mul(noteBal, bptAmount) // bptSupply // NOTE_PRECISION_SCALE
+    return (_unwrap(wethBalance), _unwrap(noteBalance))
+
+def getPoolTokenShare(sNOTEAmount, bptHeld, totalSupply):
+    """sNOTE.getPoolTokenShare, bptHeld is the BPT balance of sNOTE across the gauge and the contract"""
+    sNOTEAmount = toUint256(sNOTEAmount)
+    bptHeld = toUint256(bptHeld)
+    totalSupply = np.asarray(toUint256(totalSupply), dtype=object)
+
+    # Total supply of zero returns zero instead of reverting
+    safeSupply = np.where(totalSupply == 0, 1, totalSupply)
+    share = np.where(totalSupply == 0, 0, _mul(bptHeld, sNOTEAmount) // safeSupply)
+    return _unwrap(np.asarray(share, dtype=object))
+
+def getTokenClaim(sNOTEAmount, bptHeld, totalSupply, balances, bptSupply, wethIndex=WETH_INDEX, noteIndex=NOTE_INDEX):
+    """sNOTE.getTokenClaim, returns (wethBalance, noteBalance)"""
+    return getTokenClaimForBPT(
+        getPoolTokenShare(sNOTEAmount, bptHeld, totalSupply),
+        balances,
+        bptSupply,
+        wethIndex,
+        noteIndex
+    )
+
+def getNOTESpotPrice(balances, wethIndex=WETH_INDEX, noteIndex=NOTE_INDEX):
+    """TreasuryManager._getNOTESpotPrice, the NOTE price in ETH (1e18) of an 80/20 NOTE/ETH pool"""
+    wethBal = toUint256(balances[wethIndex])
+    # increase NOTE precision to 1e18
+    noteBal = _mul(toUint256(balances[noteIndex]), NOTE_PRECISION_SCALE)
+
+    # SpotPrice = (ETHBalance / 0.2 * 1e18) / (NOTEBalance / 0.8)
+    # SpotPrice = (ETHBalance * 5 * 1e18) / (NOTEBalance * 125 / 100)
+    return _unwrap(_mul(wethBal, 5, 10**18) // (_mul(noteBal, 125) // 100))
+
+def getVotingPower(sNOTEAmount, bptPrice, notePrice, bptHeld, totalSupply):
+    """sNOTE.getVotingPower given the time weighted BPT_PRICE and PAIR_PRICE oracle values"""
+    sNOTEAmount = toUint256(sNOTEAmount)
+    totalSupply = np.asarray(toUint256(totalSupply), dtype=object)
+    notePrice = np.asarray(toUint256(notePrice), dtype=object)
+
+    # The view reverts while the oracle has no NOTE price, voting power is zero instead
+    safePrice = np.where(notePrice == 0, 1, notePrice)
+    # (1e18 * 1e18 * 1e2) / (1e18 * 1e2 * 1e10) == 1e8
+    noteAmount = _mul(toUint256(bptPrice), toUint256(bptHeld), 80) // _mul(safePrice, 100, NOTE_PRECISION_SCALE)
+    safeSupply = np.where(totalSupply == 0, 1, totalSupply)
+    votingPower = np.where(
+        (totalSupply == 0) | (notePrice == 0),
+        0,
+        np.asarray(_mul(noteAmount, sNOTEAmount) // safeSupply, dtype=object)
+    )
+    return _unwrap(np.asarray(votingPower, dtype=object))
+
+class PoolState:
+    """Snapshot of the pool and sNOTE state that the sNOTE views read, used to evaluate
+    the views for any number of holders without an eth_call per holder."""
+
+    def __init__(self, balances, bptSupply, bptHeld, totalSupply, wethIndex=WETH_INDEX, noteIndex=NOTE_INDEX) -> None:
+        self.balances = [toUint256(b) for b in balances]
+        self.bptSupply = toUint256(bptSupply)
+        self.bptHeld = toUint256(bptHeld)
+        self.totalSupply = toUint256(totalSupply)
+        self.wethIndex = wethIndex
+        self.noteIndex = noteIndex
+
+    @classmethod
+    def fromEnvironment(cls, env, block=None):
+        # All reads are pinned to the same block so the snapshot is consistent
+        (_, balances, _) = env.balancerVault.getPoolTokens(env.poolId, block_identifier=block)
+        bptHeld = (
+            env.liquidityGauge.balanceOf(env.sNOTE.address, block_identifier=block) +
+            env.balancerPool.balanceOf(env.sNOTE.address, block_identifier=block)
+        )
+        return cls(
+            balances,
+            env.balancerPool.totalSupply(block_identifier=block),
+            bptHeld,
+            env.sNOTE.totalSupply(block_identifier=block),
+            env.sNOTE.WETH_INDEX(),
+            env.sNOTE.NOTE_INDEX()
+        )
+
+    def poolTokenShare(self, sNOTEAmount):
+        return getPoolTokenShare(sNOTEAmount, self.bptHeld, self.totalSupply)
+
+    def tokenClaimForBPT(self, bptAmount):
+        return getTokenClaimForBPT(bptAmount, self.balances, self.bptSupply, self.wethIndex, self.noteIndex)
+
+    def tokenClaim(self, sNOTEAmount):
+        return self.tokenClaimForBPT(self.poolTokenShare(sNOTEAmount))
+
+    def votingPower(self, sNOTEAmount, bptPrice, notePrice):
+        return getVotingPower(sNOTEAmount, bptPrice, notePrice, self.bptHeld, self.totalSupply)
+
+    def noteSpotPrice(self):
+        return getNOTESpotPrice(self.balances, self.wethIndex, self.noteIndex)
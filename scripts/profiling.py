@@ -0,0 +1,228 @@
+import functools
+import time
+from collections import defaultdict
+from brownie.network.contract import ContractCall, ContractConstructor, ContractTx
+from brownie.network.web3 import web3
+
+# Latency histogram bucket upper bounds in milliseconds, the last bucket is unbounded
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+PROFILER_MIDDLEWARE = "profiler"
+
+# The active Profiler, spans and profiled functions do nothing while this is None
+_profiler = None
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, profiler, name, kind) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.kind = kind
+        self.gasUsed = 0
+
+    def __enter__(self):
+        self.profiler._push(self)
+        return self
+
+    def __exit__(self, *args):
+        self.profiler._pop(self)
+        return False
+
+def span(name, kind="span"):
+    """Times the enclosed block as a frame in the active profile"""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _Span(_profiler, name, kind)
+
+def profiled(name=None):
+    """Decorator version of span, the frame defaults to the function's qualified name"""
+    def decorator(fn):
+        frame = fn.__qualname__ if name is None else name
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return fn(*args, **kwargs)
+            with _Span(_profiler, frame, "span"):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class MethodStats:
+    def __init__(self, kind) -> None:
+        self.kind = kind
+        self.count = 0
+        self.totalTime = 0.0
+        self.latencies = []
+        self.gasUsed = 0
+        self.rpcCalls = 0
+
+    def histogram(self):
+        """Counts per HISTOGRAM_BUCKETS_MS bucket, plus one for latencies above the last bound"""
+        counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        for latency in self.latencies:
+            ms = latency * 1000
+            index = next((i for (i, bound) in enumerate(HISTOGRAM_BUCKETS_MS) if ms <= bound), len(HISTOGRAM_BUCKETS_MS))
+            counts[index] += 1
+        return counts
+
+    def percentile(self, p):
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+class Profiler:
+    """Opt in instrumentation of contract calls, transactions, deployments and JSON-RPC
+    requests. While enabled the brownie ContractCall, ContractTx and ContractConstructor
+    entry points are wrapped and a web3 middleware counts requests, nothing is patched
+    otherwise.
+
+    Every instrumented call and span is a frame on a stack, so nested work (a deployer
+    deploying libraries, an Environment component building the ones it depends on) is
+    attributed to its callers in the folded stack export.
+
+        with Profiler() as profiler:
+            env = create_environment()
+        profiler.printSummary()
+        profiler.writeFolded("environment.folded")
+    """
+
+    def __init__(self) -> None:
+        self.stats = {}
+        self.rpcMethods = defaultdict(int)
+        # Folded stack => self time in seconds
+        self.folded = defaultdict(float)
+        self.rpcCalls = 0
+        self._stack = []
+        self._patched = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+        return False
+
+    def enable(self):
+        global _profiler
+        if _profiler is not None:
+            raise Exception("A profiler is already enabled")
+        _profiler = self
+        self._patch(ContractCall, "__call__", "call")
+        self._patch(ContractTx, "__call__", "transaction")
+        self._patch(ContractConstructor, "__call__", "deploy")
+        # web3 caches the request function built from the provider and its middlewares,
+        # changing the middlewares rebuilds it while patching the provider would not
+        web3.middleware_onion.add(self._middleware, name=PROFILER_MIDDLEWARE)
+
+    def disable(self):
+        global _profiler
+        if PROFILER_MIDDLEWARE in web3.middleware_onion:
+            web3.middleware_onion.remove(PROFILER_MIDDLEWARE)
+        for (target, attr, original) in reversed(self._patched):
+            setattr(target, attr, original)
+        self._patched = []
+        if _profiler is self:
+            _profiler = None
+
+    def _patch(self, cls, attr, kind):
+        original = getattr(cls, attr)
+        profiler = self
+
+        @functools.wraps(original)
+        def wrapper(method, *args, **kwargs):
+            with _Span(profiler, method._name, kind) as s:
+                result = original(method, *args, **kwargs)
+                # Transaction receipts and deployed contracts carry the gas used
+                tx = getattr(result, "tx", result)
+                s.gasUsed = getattr(tx, "gas_used", 0) or 0
+                return result
+
+        self._patched.append((cls, attr, original))
+        setattr(cls, attr, wrapper)
+
+    def _middleware(self, make_request, w3):
+        profiler = self
+
+        def middleware(method, params):
+            profiler.rpcCalls += 1
+            profiler.rpcMethods[method] += 1
+            return make_request(method, params)
+        return middleware
+
+    def _push(self, s):
+        s.start = time.perf_counter()
+        s.childTime = 0.0
+        s.rpcStart = self.rpcCalls
+        self._stack.append(s)
+
+    def _pop(self, s):
+        elapsed = time.perf_counter() - s.start
+        self._stack.pop()
+        if len(self._stack) > 0:
+            self._stack[-1].childTime += elapsed
+
+        stats = self.stats.get(s.name)
+        if stats is None:
+            stats = self.stats[s.name] = MethodStats(s.kind)
+        stats.count += 1
+        stats.totalTime += elapsed
+        stats.latencies.append(elapsed)
+        stats.gasUsed += s.gasUsed
+        stats.rpcCalls += self.rpcCalls - s.rpcStart
+
+        frames = [f.name for f in self._stack] + [s.name]
+        self.folded[";".join(frames)] += elapsed - s.childTime
+
+    def summary(self):
+        """One row per instrumented method or span, ordered by total time"""
+        rows = []
+        for (name, stats) in self.stats.items():
+            rows.append({
+                "name": name,
+                "kind": stats.kind,
+                "count": stats.count,
+                "totalMs": stats.totalTime * 1000,
+                "meanMs": stats.totalTime * 1000 / stats.count,
+                "p50Ms": stats.percentile(50) * 1000,
+                "p95Ms": stats.percentile(95) * 1000,
+                "maxMs": max(stats.latencies) * 1000,
+                "gasUsed": stats.gasUsed,
+                "rpcCalls": stats.rpcCalls,
+                "histogram": stats.histogram(),
+            })
+        return sorted(rows, key=lambda r: r["totalMs"], reverse=True)
+
+    def printSummary(self, limit=None):
+        rows = self.summary()[:limit]
+        print("{:<60} {:>11} {:>7} {:>11} {:>9} {:>9} {:>12} {:>6}".format(
+            "name", "kind", "count", "total ms", "p50 ms", "p95 ms", "gas", "rpc"
+        ))
+        for r in rows:
+            print("{:<60} {:>11} {:>7} {:>11.1f} {:>9.1f} {:>9.1f} {:>12} {:>6}".format(
+                r["name"][:60], r["kind"], r["count"], r["totalMs"], r["p50Ms"], r["p95Ms"], r["gasUsed"], r["rpcCalls"]
+            ))
+        print("{} JSON-RPC requests: {}".format(self.rpcCalls, dict(self.rpcMethods)))
+
+    def writeFolded(self, path):
+        """Folded stacks with self time in microseconds, the input format of flamegraph.pl,
+        speedscope and inferno"""
+        with open(path, "w") as f:
+            for (stack, selfTime) in sorted(self.folded.items()):
+                f.write("{} {}\n".format(stack, max(int(selfTime * 1e6), 0)))
+
+def main(path="environment.folded", useFresh=False):
+    # Imported here, environment imports this module for its spans
+    from scripts.environment import create_environment
+
+    with Profiler() as profiler:
+        create_environment(useFresh)
+    profiler.printSummary(limit=40)
+    profiler.writeFolded(path)
@@ -0,0 +1,66 @@
+import json
+import os
+from brownie import Contract
+from brownie.convert import to_address
+
+# Process wide caches, ABI files are parsed once and contract objects are
+# created once per (name, address)
+_abis = {}
+_contracts = {}
+
+def loadABI(path):
+    key = os.path.abspath(path)
+    if key not in _abis:
+        with open(key, "r") as f:
+            _abis[key] = json.load(f)
+    return _abis[key]
+
+def getContract(name, address, abi):
+    """Returns a cached Contract.from_abi instance, abi is either a parsed ABI or a path to an ABI file"""
+    key = (name, to_address(address))
+    if key not in _contracts:
+        if isinstance(abi, str):
+            abi = loadABI(abi)
+        _contracts[key] = Contract.from_abi(name, key[1], abi)
+    return _contracts[key]
+
+def clear():
+    _abis.clear()
+    _contracts.clear()
+
+class LazyContract:
+    """Stands in for a Contract until one of its attributes is first accessed. The address is
+    known up front so a LazyContract can be passed as an address argument without loading it."""
+
+    def __init__(self, name, address, abi) -> None:
+        self._lazyName = name
+        self._lazyABI = abi
+        self._contract = None
+        self.address = to_address(address)
+
+    def _load(self):
+        if self._contract is None:
+            self._contract = getContract(self._lazyName, self.address, self._lazyABI)
+        return self._contract
+
+    def __getattr__(self, attr):
+        # Only called for attributes not set in __init__
+        if attr in ("_lazyName", "_lazyABI", "_contract"):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __str__(self):
+        return self.address
+
+    def __repr__(self):
+        return "<{} Lazy '{}'>".format(self._lazyName, self.address)
+
+    def __eq__(self, other):
+        if isinstance(other, str):
+            return other.lower() == self.address.lower()
+        if hasattr(other, "address"):
+            return str(other.address).lower() == self.address.lower()
+        return False
+
+    def __hash__(self):
+        return hash(self.address)
@@ -0,0 +1,205 @@
+# Record/replay JSON-RPC cache for the mainnet fork used by the tests.
+#
+# The forking node only reads chain state at the pinned fork block, so every upstream response
+# is a pure function of the request. In record mode requests are forwarded to the upstream node
+# and the responses stored in a SQLite file, in replay mode they are served from that file
+# without any network access.
+#
+#     python -m scripts.rpc_cache record --upstream <mainnet rpc url>
+#     brownie networks modify mainnet-fork fork=http://127.0.0.1:8547
+#     brownie test
+#
+# Run the suite once against a recording cache, later runs can use replay mode. Setting
+# RPC_CACHE_PATH instead makes tests/conftest.py start a cache for each test worker and point
+# the worker's node at it (see startInBackground).
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CACHE_PATH = "fork_cache.db"
+DEFAULT_PORT = 8547
+UPSTREAM_TIMEOUT = 60
+
+# Methods whose response only depends on their params once the fork block is pinned.
+# eth_blockNumber is recorded once so replayed runs see the same chain head.
+CACHEABLE_METHODS = set([
+    "eth_chainId",
+    "net_version",
+    "eth_blockNumber",
+    "eth_getBalance",
+    "eth_getCode",
+    "eth_getStorageAt",
+    "eth_getTransactionCount",
+    "eth_getBlockByNumber",
+    "eth_getBlockByHash",
+    "eth_getTransactionByHash",
+    "eth_getTransactionReceipt",
+    "eth_getLogs",
+    "eth_call",
+])
+# Requests at a moving block tag are never cached
+MOVING_BLOCK_TAGS = set(["latest", "pending", "safe", "finalized"])
+# Fields of object params that hold a block tag
+BLOCK_FIELDS = ["fromBlock", "toBlock", "blockNumber"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    method TEXT NOT NULL,
+    params TEXT NOT NULL,
+    response TEXT NOT NULL,
+    PRIMARY KEY (method, params)
+);
+"""
+
+class RPCCache:
+    """Stores upstream responses keyed by method and params. Only the result or error of a
+    response is stored, the id is rewritten to match each request."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, upstream=None, record=True) -> None:
+        if record and upstream is None:
+            raise Exception("Recording requires an upstream node")
+        self.path = path
+        self.upstream = upstream
+        self.record = record
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        # Handler threads share the connection, access is serialized by the lock
+        # Parallel test workers each run a cache on the same file, writers wait for the lock
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def isCacheable(request):
+        method = request.get("method")
+        if method not in CACHEABLE_METHODS:
+            return False
+        for param in request.get("params", []):
+            if isinstance(param, str) and param in MOVING_BLOCK_TAGS:
+                return False
+            if isinstance(param, dict):
+                # Log filters and EIP-1898 block params carry the block inside an object
+                if any(param.get(k) in MOVING_BLOCK_TAGS for k in BLOCK_FIELDS):
+                    return False
+                # A log filter without a block hash defaults a missing range end to "latest"
+                if method == "eth_getLogs" and "blockHash" not in param and ("fromBlock" not in param or "toBlock" not in param):
+                    return False
+        return True
+
+    def _key(self, request):
+        return (request["method"], json.dumps(request.get("params", []), sort_keys=True))
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self.db.execute(
+                "SELECT response FROM responses WHERE method = ? AND params = ?", key
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _store(self, key, response):
+        stored = dict((k, v) for (k, v) in response.items() if k in ("result", "error"))
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", key + (json.dumps(stored),))
+
+    def _forward(self, batch):
+        response = self._session.post(self.upstream, json=batch, timeout=UPSTREAM_TIMEOUT)
+        response.raise_for_status()
+        results = dict((r["id"], r) for r in response.json())
+        return [results[r["id"]] for r in batch]
+
+    def handle(self, batch):
+        """Answers a JSON-RPC batch. Misses are forwarded upstream in a single batch when
+        there is an upstream node and only stored when recording."""
+        responses = [None] * len(batch)
+        pending = []
+        for (i, request) in enumerate(batch):
+            cached = self._lookup(self._key(request)) if self.isCacheable(request) else None
+            if cached is not None:
+                self.hits += 1
+                responses[i] = dict(cached, jsonrpc="2.0", id=request.get("id"))
+            else:
+                self.misses += 1
+                pending.append(i)
+
+        if len(pending) == 0:
+            return responses
+        if self.upstream is None:
+            for i in pending:
+                responses[i] = {
+                    "jsonrpc": "2.0",
+                    "id": batch[i].get("id"),
+                    "error": {"code": -32000, "message": "{} not in fork cache".format(batch[i]["method"])}
+                }
+            return responses
+
+        # Upstream ids must be unique within the batch
+        upstreamBatch = [dict(batch[i], id=n) for (n, i) in enumerate(pending)]
+        for (request, i, response) in zip(upstreamBatch, pending, self._forward(upstreamBatch)):
+            # Errors may be transient (rate limits), only results are recorded
+            if self.record and "result" in response and self.isCacheable(request):
+                self._store(self._key(request), response)
+            responses[i] = dict(response, id=batch[i].get("id"))
+        return responses
+
+class _Handler(BaseHTTPRequestHandler):
+    cache = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        isBatch = isinstance(body, list)
+        responses = self.cache.handle(body if isBatch else [body])
+        payload = json.dumps(responses if isBatch else responses[0]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(cache, port=DEFAULT_PORT):
+    handler = type("RPCCacheHandler", (_Handler,), {"cache": cache})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.cache = cache
+    return server
+
+def startInBackground(path=None, upstream=None, record=None, port=DEFAULT_PORT):
+    """Starts the cache on a daemon thread, settings default to the RPC_CACHE_PATH,
+    RPC_CACHE_UPSTREAM and RPC_CACHE_MODE (record or replay) environment variables"""
+    path = os.environ.get("RPC_CACHE_PATH", DEFAULT_CACHE_PATH) if path is None else path
+    upstream = os.environ.get("RPC_CACHE_UPSTREAM") if upstream is None else upstream
+    if record is None:
+        record = os.environ.get("RPC_CACHE_MODE", "replay") == "record"
+    server = serve(RPCCache(path, upstream, record), port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(mode="replay", path=DEFAULT_CACHE_PATH, upstream=None, port=DEFAULT_PORT):
+    cache = RPCCache(path, upstream, mode == "record")
+    server = serve(cache, int(port))
+    print("Serving {} fork cache {} on port {}".format(mode, path, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Cache hits {}, misses {}".format(cache.hits, cache.misses))
+        cache.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record/replay JSON-RPC cache for the mainnet fork")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--upstream", default=None, help="upstream node, if set replay mode forwards misses")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    main(args.mode, args.path, args.upstream, args.port)
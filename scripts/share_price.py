@@ -0,0 +1,215 @@
+import numpy as np
+from collections import namedtuple
+from brownie import web3
+from brownie.network.state import Chain
+from eth_abi import decode_abi
+from hexbytes import HexBytes
+from scripts.environment import create_environment
+from scripts.multicall import BatchReader
+from scripts.pool_math import getPoolTokenShare, getTokenClaim
+from scripts.voting_power import TRANSFER_TOPIC, ZERO_ADDRESS, DEFAULT_BLOCK_CHUNK, _topicToAddress
+
+chain = Chain()
+
+POOL_BALANCE_CHANGED_TOPIC = web3.keccak(text="PoolBalanceChanged(bytes32,address,address[],int256[],uint256[])").hex()
+POOL_BALANCE_MANAGED_TOPIC = web3.keccak(text="PoolBalanceManaged(bytes32,address,address,int256,int256)").hex()
+SWAP_TOPIC = web3.keccak(text="Swap(bytes32,address,address,uint256,uint256)").hex()
+# Share prices are quoted per 1e18 sNOTE
+SHARE_UNIT = 10**18
+
+# Every field is an array with one entry per block
+SharePricePoints = namedtuple("SharePricePoints", [
+    "block",
+    "changeIndex",      # index into the exact change point values, see changePoints
+    "bptPerShare",
+    "wethPerShare",
+    "notePerShare",
+])
+# Every field is an array with one entry per block where the state changed, integers are exact
+ChangePoints = namedtuple("ChangePoints", [
+    "block",
+    "wethBalance",      # pool balances
+    "noteBalance",
+    "bptSupply",
+    "bptHeld",          # _bptHeld, sNOTE BPT in the gauge and the contract
+    "totalSupply",      # sNOTE total supply
+    "bptPerShare",      # getPoolTokenShare(SHARE_UNIT)
+    "wethPerShare",     # getTokenClaim(SHARE_UNIT)
+    "notePerShare",
+])
+
+def _int(data, offset=0):
+    return int.from_bytes(HexBytes(data)[offset:offset + 32], "big", signed=True)
+
+class SharePriceSeries:
+    """Rebuilds the state behind sNOTE.getPoolTokenShare and getTokenClaim at every block from
+    logs, starting from one snapshot of the views.
+
+    Every change goes through one of these logs:
+      - sNOTE Transfer from or to the zero address, minting and redeeming sNOTE
+      - BPT Transfer from or to sNOTE or the zero address, joins (mints, investWETHAndNOTE
+        donations), exits (redeems, extractTokensForCollateralShortfall) and stakeAll
+      - LiquidityGauge Transfer from or to sNOTE, staking and unstaking
+      - Vault PoolBalanceChanged, Swap and PoolBalanceManaged for the pool, the pool balances
+        net of protocol fees
+
+    update() fetches only the blocks after the last one applied, four eth_getLogs requests per
+    chunk. The state is stored once per block where it changed, the dense per block series is
+    an index into those change points.
+    """
+
+    def __init__(self, snote, liquidityGauge, balancerPool, balancerVault, poolId, tokens,
+        balances, bptSupply, bptInPool, bptInGauge, totalSupply, block, wethIndex, noteIndex) -> None:
+        self.snote = web3.toChecksumAddress(str(snote))
+        self.liquidityGauge = web3.toChecksumAddress(str(liquidityGauge))
+        self.balancerPool = web3.toChecksumAddress(str(balancerPool))
+        self.balancerVault = web3.toChecksumAddress(str(balancerVault))
+        self.poolId = HexBytes(poolId)
+        self.tokens = [web3.toChecksumAddress(str(t)) for t in tokens]
+        self.wethIndex = wethIndex
+        self.noteIndex = noteIndex
+
+        self.balances = [int(b) for b in balances]
+        self.bptSupply = int(bptSupply)
+        self.bptInPool = int(bptInPool)
+        self.bptInGauge = int(bptInGauge)
+        self.totalSupply = int(totalSupply)
+        self.lastBlock = block
+
+        self._blocks = []
+        self._states = []
+        self._changePoints = None
+        self._record(block)
+
+    @classmethod
+    def fromEnvironment(cls, env, block=None):
+        block = chain.height if block is None else block
+        reader = BatchReader(env, block)
+        ((tokens, balances, _), bptSupply, bptInPool, bptInGauge, totalSupply, wethIndex, noteIndex) = reader.call([
+            (env.balancerVault, "getPoolTokens", [env.poolId]),
+            (env.balancerPool, "totalSupply", []),
+            (env.balancerPool, "balanceOf", [env.sNOTE.address]),
+            (env.liquidityGauge, "balanceOf", [env.sNOTE.address]),
+            (env.sNOTE, "totalSupply", []),
+            (env.sNOTE, "WETH_INDEX", []),
+            (env.sNOTE, "NOTE_INDEX", []),
+        ])
+        return cls(
+            env.sNOTE.address, env.liquidityGauge.address, env.balancerPool.address, env.balancerVault.address,
+            env.poolId, tokens, balances, bptSupply, bptInPool, bptInGauge, totalSupply, block, wethIndex, noteIndex
+        )
+
+    def _record(self, block):
+        state = (self.balances[self.wethIndex], self.balances[self.noteIndex], self.bptSupply,
+            self.bptInPool + self.bptInGauge, self.totalSupply)
+        if len(self._states) > 0 and self._states[-1] == state:
+            return
+        self._blocks.append(block)
+        self._states.append(state)
+        self._changePoints = None
+
+    def update(self, toBlock=None, blockChunk=DEFAULT_BLOCK_CHUNK):
+        """Applies the logs of every block after lastBlock up to toBlock, returns the number
+        of logs applied"""
+        toBlock = chain.height if toBlock is None else toBlock
+        applied = 0
+        start = self.lastBlock + 1
+        while start <= toBlock:
+            end = min(start + blockChunk - 1, toBlock)
+            logs = self._getLogs(start, end)
+            block = None
+            for log in logs:
+                if block is not None and log["blockNumber"] != block:
+                    self._record(block)
+                block = log["blockNumber"]
+                self._apply(log)
+                applied += 1
+            if block is not None:
+                self._record(block)
+            self.lastBlock = end
+            start = end + 1
+        return applied
+
+    def _getLogs(self, start, end):
+        filters = [
+            (self.snote, [TRANSFER_TOPIC]),
+            (self.balancerPool, [TRANSFER_TOPIC]),
+            (self.liquidityGauge, [TRANSFER_TOPIC]),
+            # A list in the first position matches any of the event topics
+            (self.balancerVault, [[POOL_BALANCE_CHANGED_TOPIC, SWAP_TOPIC, POOL_BALANCE_MANAGED_TOPIC], self.poolId.hex()]),
+        ]
+        logs = []
+        for (address, topics) in filters:
+            logs.extend(web3.eth.get_logs({"address": address, "fromBlock": start, "toBlock": end, "topics": topics}))
+        return sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"]))
+
+    def _apply(self, log):
+        address = web3.toChecksumAddress(log["address"])
+        topic = HexBytes(log["topics"][0]).hex()
+        if topic == TRANSFER_TOPIC:
+            (sender, receiver) = (_topicToAddress(log["topics"][1]), _topicToAddress(log["topics"][2]))
+            amount = _int(log["data"])
+            if address == self.snote:
+                self.totalSupply += amount * ((sender == ZERO_ADDRESS) - (receiver == ZERO_ADDRESS))
+            elif address == self.balancerPool:
+                self.bptSupply += amount * ((sender == ZERO_ADDRESS) - (receiver == ZERO_ADDRESS))
+                self.bptInPool += amount * ((receiver == self.snote) - (sender == self.snote))
+            elif address == self.liquidityGauge:
+                self.bptInGauge += amount * ((receiver == self.snote) - (sender == self.snote))
+        elif topic == SWAP_TOPIC:
+            self.balances[self.tokens.index(_topicToAddress(log["topics"][2]))] += _int(log["data"], 0)
+            self.balances[self.tokens.index(_topicToAddress(log["topics"][3]))] -= _int(log["data"], 32)
+        elif topic == POOL_BALANCE_CHANGED_TOPIC:
+            # Deltas are signed, protocol fees are taken from the pool balance on both joins and exits
+            (tokens, deltas, protocolFees) = decode_abi(["address[]", "int256[]", "uint256[]"], HexBytes(log["data"]))
+            for (token, delta, fee) in zip(tokens, deltas, protocolFees):
+                self.balances[self.tokens.index(web3.toChecksumAddress(token))] += delta - fee
+        elif topic == POOL_BALANCE_MANAGED_TOPIC:
+            token = _topicToAddress(log["topics"][3])
+            self.balances[self.tokens.index(token)] += _int(log["data"], 0) + _int(log["data"], 32)
+
+    def changePoints(self):
+        """Exact state and share prices at every block where the state changed"""
+        if self._changePoints is None:
+            (wethBalance, noteBalance, bptSupply, bptHeld, totalSupply) = [
+                np.array(column, dtype=object) for column in zip(*self._states)
+            ]
+            bptPerShare = np.atleast_1d(getPoolTokenShare(SHARE_UNIT, bptHeld, totalSupply))
+            # getTokenClaimForBPT divides by the BPT supply, which is zero before the pool is seeded
+            safeSupply = np.where(bptSupply == 0, 1, bptSupply)
+            (wethPerShare, notePerShare) = getTokenClaim(SHARE_UNIT, bptHeld, totalSupply, [wethBalance, noteBalance], safeSupply, 0, 1)
+            self._changePoints = ChangePoints(
+                np.array(self._blocks, dtype=np.int64),
+                wethBalance, noteBalance, bptSupply, bptHeld, totalSupply,
+                bptPerShare, np.atleast_1d(wethPerShare), np.atleast_1d(notePerShare)
+            )
+        return self._changePoints
+
+    def series(self, fromBlock=None, toBlock=None):
+        """Dense per block share prices between fromBlock and toBlock inclusive. Prices are
+        float64 in token units, exact values are changePoints()[changeIndex]."""
+        points = self.changePoints()
+        fromBlock = points.block[0] if fromBlock is None else fromBlock
+        toBlock = self.lastBlock if toBlock is None else toBlock
+        if fromBlock < points.block[0] or toBlock > self.lastBlock:
+            raise Exception("Blocks {} to {} are outside of the series".format(fromBlock, toBlock))
+
+        blocks = np.arange(fromBlock, toBlock + 1, dtype=np.int64)
+        changeIndex = (np.searchsorted(points.block, blocks, side="right") - 1).astype(np.int32)
+        return SharePricePoints(
+            blocks,
+            changeIndex,
+            points.bptPerShare.astype(np.float64)[changeIndex] / 1e18,
+            points.wethPerShare.astype(np.float64)[changeIndex] / 1e18,
+            points.notePerShare.astype(np.float64)[changeIndex] / 1e8,
+        )
+
+def main(blocks=10000):
+    env = create_environment(lazy=True)
+    toBlock = chain.height
+    series = SharePriceSeries.fromEnvironment(env, toBlock - int(blocks))
+    applied = series.update(toBlock)
+    points = series.series()
+    print("Applied {} logs, {} change points over {} blocks".format(applied, len(series.changePoints().block), len(points.block)))
+    print("BPT per sNOTE {:.6f} => {:.6f}".format(points.bptPerShare[0], points.bptPerShare[-1]))
+    print("Claim per sNOTE {:.6f} ETH {:.4f} NOTE".format(points.wethPerShare[-1], points.notePerShare[-1]))
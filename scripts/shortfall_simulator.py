@@ -0,0 +1,201 @@
+import numpy as np
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from scripts.environment import create_environment
+from scripts.pool_math import NOTE_PRECISION_SCALE, PoolState, getTokenClaim, toUint256
+
+# sNOTE constants
+MAX_SHORTFALL_WITHDRAW = 50
+SHORTFALL_WITHDRAW_COOLDOWN_DAYS = 7
+NOTE_WEIGHT = 0.8
+WETH_WEIGHT = 0.2
+
+DEFAULT_PATHS_PER_WORKER = 2500
+LOSS_PERCENTILES = [5, 25, 50, 75, 95, 99]
+
+# Daily NOTE/ETH log returns are normal with drift and volatility plus jumps (price crashes)
+# arriving at jumpRate per year. Shortfall events arrive at shortfallRate per year with a
+# size in ETH drawn from a lognormal with the given median and log stdev.
+Scenario = namedtuple("Scenario", [
+    "days",
+    "drift",
+    "volatility",
+    "jumpRate",
+    "jumpSize",
+    "shortfallRate",
+    "shortfallMedian",
+    "shortfallSigma",
+], defaults=[365, 0.0, 1.0, 2.0, -0.3, 4.0, 50.0, 1.0])
+
+SimulationResult = namedtuple("SimulationResult", [
+    "shortfallLoss",    # per path fraction of the holder claim lost to extractions
+    "totalLoss",        # per path fraction of the starting claim value (ETH) lost
+    "extracted",        # per path ETH value sent to the owner
+    "unmetShortfall",   # per path ETH value of shortfalls left uncovered at the end
+    "extractions",      # per path number of extractTokensForCollateralShortfall calls
+])
+
+class ShortfallModel:
+    """Float model of sNOTE under shortfall extractions, vectorized over price paths.
+
+    Every day the NOTE/ETH price moves, arbitrage brings the 80/20 pool to the new price
+    keeping its invariant (swap fees are ignored) and new shortfalls are added to the amount
+    owed. When the shortfall cooldown has passed the owner calls
+    extractTokensForCollateralShortfall for the BPT covering the amount owed, capped at 50%
+    of the BPT held by sNOTE, and exits the pool proportionally (EXACT_BPT_IN_FOR_TOKENS_OUT).
+    Amounts not covered stay owed for the next extraction.
+
+    The pool is simulated in float, holder claims are pool_math.getTokenClaim of the whole
+    sNOTE supply on the simulated state converted back to raw amounts.
+    """
+
+    def __init__(self, wethBalance, noteBalance, bptSupply, bptHeld, notePrice, totalSupply=1.0) -> None:
+        """Balances, BPT and sNOTE in token units, notePrice in ETH"""
+        self.wethBalance = float(wethBalance)
+        self.noteBalance = float(noteBalance)
+        self.bptSupply = float(bptSupply)
+        self.bptHeld = float(bptHeld)
+        self.notePrice = float(notePrice)
+        self.totalSupply = float(totalSupply)
+        self.invariant = self.noteBalance ** NOTE_WEIGHT * self.wethBalance ** WETH_WEIGHT
+
+    @classmethod
+    def fromPoolState(cls, poolState, notePrice):
+        """Converts a pool_math.PoolState (raw uint256 amounts) and an 18 decimal NOTE/ETH price"""
+        return cls(
+            poolState.balances[poolState.wethIndex] / 1e18,
+            poolState.balances[poolState.noteIndex] / (1e18 / NOTE_PRECISION_SCALE),
+            poolState.bptSupply / 1e18,
+            poolState.bptHeld / 1e18,
+            notePrice / 1e18,
+            poolState.totalSupply / 1e18
+        )
+
+    def balancesAtPrice(self, invariant, price):
+        # Spot price of an 80/20 pool is (weth / 0.2) / (note / 0.8) = 4 * weth / note
+        ratio = WETH_WEIGHT / NOTE_WEIGHT * price
+        note = invariant / ratio ** WETH_WEIGHT
+        return (note * ratio, note)
+
+    def tokenClaim(self, weth, note, bptSupply, bptHeld):
+        """getTokenClaim of the whole sNOTE supply for a state in token units, returns raw
+        (wethBalance, noteBalance) object arrays with one entry per state"""
+        (weth, note, bptSupply, bptHeld) = np.broadcast_arrays(*[np.atleast_1d(v) for v in (weth, note, bptSupply, bptHeld)])
+        totalSupply = toUint256(np.full(len(weth), self.totalSupply * 1e18))
+        balances = [toUint256(weth * 1e18), toUint256(note * (1e18 / NOTE_PRECISION_SCALE))]
+        return getTokenClaim(totalSupply, toUint256(bptHeld * 1e18), totalSupply, balances, toUint256(bptSupply * 1e18), 0, 1)
+
+    def claimValue(self, weth, note, bptSupply, bptHeld, price):
+        """Value in ETH of the tokenClaim at a NOTE price in ETH"""
+        (wethClaim, noteClaim) = self.tokenClaim(weth, note, bptSupply, bptHeld)
+        return np.asarray(wethClaim, dtype=float) / 1e18 + np.asarray(noteClaim, dtype=float) / (1e18 / NOTE_PRECISION_SCALE) * price
+
+    def startClaim(self):
+        """Raw (wethBalance, noteBalance) claim of the whole sNOTE supply at the starting state"""
+        (wethClaim, noteClaim) = self.tokenClaim(self.wethBalance, self.noteBalance, self.bptSupply, self.bptHeld)
+        return (wethClaim[0], noteClaim[0])
+
+    def simulate(self, scenario, paths, seed=None):
+        rng = np.random.default_rng(seed)
+        dt = 1 / 365
+        logPrice = np.full(paths, np.log(self.notePrice))
+        invariant = np.full(paths, self.invariant)
+        bptSupply = np.full(paths, self.bptSupply)
+        bptHeld = np.full(paths, self.bptHeld)
+        owed = np.zeros(paths)
+        extracted = np.zeros(paths)
+        extractions = np.zeros(paths, dtype=np.int64)
+        # Days since the last extraction, the first one is always allowed
+        sinceLast = np.full(paths, SHORTFALL_WITHDRAW_COOLDOWN_DAYS + 1)
+
+        for _ in range(scenario.days):
+            jumps = rng.random(paths) < scenario.jumpRate * dt
+            logPrice += (
+                (scenario.drift - scenario.volatility ** 2 / 2) * dt +
+                scenario.volatility * np.sqrt(dt) * rng.standard_normal(paths) +
+                np.where(jumps, scenario.jumpSize, 0.0)
+            )
+            price = np.exp(logPrice)
+            (weth, note) = self.balancesAtPrice(invariant, price)
+
+            shortfalls = rng.random(paths) < scenario.shortfallRate * dt
+            sizes = scenario.shortfallMedian * np.exp(scenario.shortfallSigma * rng.standard_normal(paths))
+            owed += np.where(shortfalls, sizes, 0.0)
+
+            sinceLast += 1
+            # lastShortfallWithdrawTime + SHORTFALL_WITHDRAW_COOLDOWN < blockTime
+            extract = (owed > 0) & (sinceLast > SHORTFALL_WITHDRAW_COOLDOWN_DAYS)
+            bptValue = (weth + note * price) / bptSupply
+            requested = owed / bptValue
+            bptExit = np.where(extract, np.minimum(requested, bptHeld * MAX_SHORTFALL_WITHDRAW / 100), 0.0)
+
+            # Proportional exit, the invariant shrinks with the balances
+            exitFraction = bptExit / bptSupply
+            value = exitFraction * (weth + note * price)
+            invariant *= 1 - exitFraction
+            bptSupply -= bptExit
+            bptHeld -= bptExit
+            owed = np.maximum(owed - value, 0.0)
+            extracted += value
+            extractions += extract
+            sinceLast = np.where(extract, 0, sinceLast)
+
+        price = np.exp(logPrice)
+        (weth, note) = self.balancesAtPrice(invariant, price)
+        # Claims of the whole sNOTE supply, per holder claims scale with their balance
+        claimValue = self.claimValue(weth, note, bptSupply, bptHeld, price)
+        startClaim = self.claimValue(self.wethBalance, self.noteBalance, self.bptSupply, self.bptHeld, self.notePrice)
+        # Same price path without extractions, the share of the pool never changes
+        (baseWeth, baseNote) = self.balancesAtPrice(np.full(paths, self.invariant), price)
+        baseClaim = self.claimValue(baseWeth, baseNote, self.bptSupply, self.bptHeld, price)
+
+        return SimulationResult(
+            1 - claimValue / baseClaim,
+            1 - claimValue / startClaim,
+            extracted,
+            owed,
+            extractions
+        )
+
+def _simulateChunk(args):
+    (model, scenario, paths, seed) = args
+    return model.simulate(scenario, paths, seed)
+
+def runSimulation(model, scenario=Scenario(), paths=10000, seed=None, processes=None, pathsPerWorker=DEFAULT_PATHS_PER_WORKER):
+    """Splits the paths over a process pool, each chunk gets an independent random stream"""
+    chunks = [min(pathsPerWorker, paths - start) for start in range(0, paths, pathsPerWorker)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = [(model, scenario, n, s) for (n, s) in zip(chunks, seeds)]
+    if len(args) == 1:
+        results = [_simulateChunk(args[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_simulateChunk, args))
+    return SimulationResult(*[np.concatenate(field) for field in zip(*results)])
+
+def summarize(result, percentiles=LOSS_PERCENTILES):
+    """Aggregate distribution of each per path field, including the 95% and 99% expected
+    shortfall (mean of the worst tail) of the losses"""
+    summary = {}
+    for (name, values) in result._asdict().items():
+        values = np.asarray(values, dtype=float)
+        stats = {
+            "mean": float(np.mean(values)),
+            "std": float(np.std(values)),
+        }
+        for p in percentiles:
+            stats["p{}".format(p)] = float(np.percentile(values, p))
+        if name.endswith("Loss"):
+            for level in [95, 99]:
+                tail = values[values >= np.percentile(values, level)]
+                stats["es{}".format(level)] = float(np.mean(tail))
+        summary[name] = stats
+    return summary
+
+def main(paths=10000, days=365):
+    env = create_environment(lazy=True)
+    poolState = PoolState.fromEnvironment(env)
+    model = ShortfallModel.fromPoolState(poolState, poolState.noteSpotPrice())
+    result = runSimulation(model, Scenario(days=int(days)), int(paths))
+    for (name, stats) in summarize(result).items():
+        print(name, " ".join("{}={:.4f}".format(k, v) for (k, v) in stats.items()))
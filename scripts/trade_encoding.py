@@ -0,0 +1,106 @@
+from functools import lru_cache
+from brownie import web3
+from scripts.common import DEX_ID, TRADE_TYPE
+
+# Bit masks for TradingModule.setTokenPermissions, bit n is set for DEX_ID / TRADE_TYPE n
+DEX_FLAGS = dict((name, 1 << id) for (name, id) in DEX_ID.items() if name != "UNUSED")
+TRADE_TYPE_FLAGS = dict((name, 1 << id) for (name, id) in TRADE_TYPE.items())
+
+TRADE_ABI_TYPE = "(uint8,address,address,uint256,uint256,uint256,bytes)"
+EXECUTE_TRADE_SELECTOR = web3.keccak(text="executeTrade({},uint8)".format(TRADE_ABI_TYPE))[:4]
+
+MAX_UINT256 = 2**256 - 1
+MAX_UINT24 = 2**24 - 1
+# Head of a single dynamic argument, the tuple starts right after its offset word
+_SINGLE_ARG_OFFSET = (32).to_bytes(32, "big")
+# executeTrade(trade, dexId): the trade is after the two head words
+_EXECUTE_TRADE_OFFSET = (64).to_bytes(32, "big")
+# The exchangeData offset inside the Trade tuple, after its seven head words
+_EXCHANGE_DATA_OFFSET = (7 * 32).to_bytes(32, "big")
+
+def dex_flags(*names, flags=0):
+    """Same result as common.set_dex_flags for flags=0. Existing flags are OR-ed as they are,
+    set_dex_flags reverses their bit order."""
+    for name in names:
+        flags |= DEX_FLAGS[name]
+    return flags
+
+def trade_type_flags(*names, flags=0):
+    """Same result as common.set_trade_type_flags for flags=0"""
+    for name in names:
+        flags |= TRADE_TYPE_FLAGS[name]
+    return flags
+
+def _uint(value, maximum=MAX_UINT256):
+    value = int(value)
+    if value < 0 or value > maximum:
+        raise Exception("Value {} out of range".format(value))
+    return value.to_bytes(32, "big")
+
+@lru_cache(maxsize=4096)
+def _address(address):
+    # 20 bytes, candidate trades reuse a small set of tokens so the parse is cached
+    raw = bytes.fromhex(address[2:] if address.startswith("0x") else address)
+    if len(raw) != 20:
+        raise Exception("Invalid address {}".format(address))
+    return raw
+
+def _bytes(data):
+    # Length word followed by the data right padded to a whole number of words
+    data = bytes(data)
+    # eth_abi 2.x (and so encode_input) writes a zero word for empty bytes, kept for identical output
+    padding = -len(data) % 32 if len(data) > 0 else 32
+    return len(data).to_bytes(32, "big") + data + bytes(padding)
+
+def encode_univ3_single_data(fee):
+    """Same bytes as common.get_univ3_single_data"""
+    return _uint(fee, MAX_UINT24)
+
+def encode_univ3_path(path):
+    """Packed Uniswap V3 path [token, fee, token, ...], the inner bytes of get_univ3_batch_data"""
+    if len(path) % 2 == 0:
+        raise Exception("Path must start and end with a token")
+    parts = []
+    for (idx, item) in enumerate(path):
+        if idx % 2 == 0:
+            parts.append(_address(item))
+        else:
+            parts.append(_uint(item, MAX_UINT24)[-3:])
+    return b"".join(parts)
+
+def encode_univ3_batch_data(path):
+    """Same bytes as common.get_univ3_batch_data, a (bytes) tuple is dynamic so the path is
+    behind both the argument and the tuple offset"""
+    return _SINGLE_ARG_OFFSET + _SINGLE_ARG_OFFSET + _bytes(encode_univ3_path(path))
+
+def _tradeTuple(trade):
+    (tradeType, sellToken, buyToken, amount, limit, deadline, exchangeData) = trade
+    return b"".join([
+        _uint(tradeType, 255),
+        bytes(12), _address(sellToken),
+        bytes(12), _address(buyToken),
+        _uint(amount),
+        _uint(limit),
+        _uint(deadline),
+        _EXCHANGE_DATA_OFFSET,
+        _bytes(exchangeData),
+    ])
+
+def encode_trade(trade):
+    """ABI encoding of a Trade struct as a single argument, eth_abi.encode_abi([TRADE_ABI_TYPE], [trade])"""
+    return _SINGLE_ARG_OFFSET + _tradeTuple(trade)
+
+def encode_execute_trade(trade, dexId):
+    """TreasuryManager.executeTrade calldata, same as executeTrade.encode_input(trade, dexId)"""
+    return EXECUTE_TRADE_SELECTOR + _EXECUTE_TRADE_OFFSET + _uint(dexId, 255) + _tradeTuple(trade)
+
+def encode_trades(trades):
+    return [encode_trade(trade) for trade in trades]
+
+def encode_execute_trades(trades, dexId):
+    """Calldata for many candidate trades on the same DEX, the dexId word is encoded once"""
+    head = EXECUTE_TRADE_SELECTOR + _EXECUTE_TRADE_OFFSET + _uint(dexId, 255)
+    return [head + _tradeTuple(trade) for trade in trades]
+
+def encode_univ3_batch_datas(paths):
+    return [encode_univ3_batch_data(path) for path in paths]
@@ -1,9 +1,10 @@
 import eth_abi
 import time
-import json
 from brownie import ETH_ADDRESS, ZERO_ADDRESS, EIP1271Wallet
 from brownie.network.state import Chain
-from brownie import network, accounts, interface, web3, Contract
+from brownie import network, accounts, interface, web3
+from scripts.order_signing import getDomainHash, hashOrder
+from scripts.registry import LazyContract
 
 chain = Chain()
 
@@ -25,8 +26,9 @@ EnvironmentConfig = {
 }
 
 class Order:
+    packedEncoder = eth_abi.codec.ABIEncoder(eth_abi.registry.registry_packed)
+
     def __init__(self, assetProxy, makerAddr, makerToken, makerAmt, takerToken, takerAmt) -> None:
-        self.packedEncoder = eth_abi.codec.ABIEncoder(eth_abi.registry.registry_packed)
         self.makerAddress = makerAddr
         self.takerAddress = ZERO_ADDRESS
         self.feeRecipientAddress = ZERO_ADDRESS
@@ -45,9 +47,13 @@ class Order:
     def encodeAssetData(self, assetProxy, token):
         return assetProxy.ERC20Token.encode_input(token)
 
+    def __setattr__(self, name, value):
+        # Any change to the order invalidates the cached params
+        self.__dict__[name] = value
+        self.__dict__["_params"] = None
+
     def hash(self, exchange):
-        info = exchange.contract.getOrderInfo(self.getParams())
-        return info[1]
+        return hashOrder(self.getParams(), getDomainHash(exchange.contract))
 
     def sign(self, exchange, account):
         return self.rawSign(exchange, account) + "07" # 07 = EIP1271
@@ -56,28 +62,28 @@ class Order:
         return account.sign_defunct_message_raw(self.hash(exchange)).signature.hex()
 
     def getParams(self):
-        return [
-            self.makerAddress,
-            self.takerAddress,
-            self.feeRecipientAddress,
-            self.senderAddress,
-            int(self.makerAssetAmount),
-            int(self.takerAssetAmount),
-            self.makerFee,
-            self.takerFee,
-            self.expirationTimeSeconds,
-            self.salt,
-            self.makerAssetData,
-            self.takerAssetData,
-            self.makerFeeAssetData,
-            self.takerFeeAssetData
-        ]
+        if self._params is None:
+            self.__dict__["_params"] = [
+                self.makerAddress,
+                self.takerAddress,
+                self.feeRecipientAddress,
+                self.senderAddress,
+                int(self.makerAssetAmount),
+                int(self.takerAssetAmount),
+                self.makerFee,
+                self.takerFee,
+                int(self.expirationTimeSeconds),
+                int(self.salt),
+                self.makerAssetData,
+                self.takerAssetData,
+                self.makerFeeAssetData,
+                self.takerFeeAssetData
+            ]
+        return self._params
 
 class ExchangeV3:
     def __init__(self, config):
-        with open("./abi/0x/ExchangeV3.json", "r") as f:
-            abi = json.load(f)
-        self.contract = Contract.from_abi("ExchangeV3", config["0x"]["exchangeV3"], abi)
+        self.contract = LazyContract("ExchangeV3", config["0x"]["exchangeV3"], "./abi/0x/ExchangeV3.json")
 
 class Environment:
     def __init__(self, config):
@@ -87,9 +93,7 @@ class Environment:
         self.tokens["DAI"] = self.loadTokenProxy(self.config, "DAI")
         self.deployer = accounts.at("0x2a956Fe94ff89D8992107c8eD4805c30ff1106ef", force=True)   
     def loadTokenProxy(self, config, token):
-        with open("./abi/ERC20.json", "r") as f:
-            abi = json.load(f)
-        return Contract.from_abi(token, config["tokens"][token], abi)  
+        return LazyContract(token, config["tokens"][token], "./abi/ERC20.json")
 
 def create_environment():
     return Environment(EnvironmentConfig["mainnet"])
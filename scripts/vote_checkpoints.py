@@ -0,0 +1,168 @@
+import numpy as np
+from bisect import bisect_right
+from collections import namedtuple
+from brownie import web3, sNOTE
+from brownie.network.state import Chain
+from hexbytes import HexBytes
+from scripts.environment import EnvironmentConfig, create_environment
+from scripts.multicall import BatchReader
+from scripts.oracle_replay import PAIR_PRICE, BPT_PRICE
+from scripts.pool_math import getVotingPower
+from scripts.registry import getContract
+from scripts.voting_power import DEFAULT_BLOCK_CHUNK, _topicToAddress
+
+chain = Chain()
+
+DELEGATE_CHANGED_TOPIC = web3.keccak(text="DelegateChanged(address,address,address)").hex()
+DELEGATE_VOTES_CHANGED_TOPIC = web3.keccak(text="DelegateVotesChanged(address,uint256,uint256)").hex()
+# Checkpoint keys pack the delegate index above the block number, ERC20Votes stores
+# fromBlock as a uint32
+BLOCK_BITS = 32
+
+# Inputs of sNOTE.getVotingPower at the block the views are called at, getPastVotes
+# converts past votes with the current values
+VotingPowerInputs = namedtuple("VotingPowerInputs", ["bptPrice", "notePrice", "bptHeld", "totalSupply"])
+
+def readVotingPowerInputs(env, snote, block=None):
+    block = chain.height if block is None else block
+    window = snote.votingOracleWindowInSeconds(block_identifier=block)
+    oracle = getContract("BalancerPriceOracle", env.balancerPool.address, "./abi/balancer/priceOracle.json")
+    ((bptPrice, notePrice), bptInGauge, bptInPool, totalSupply) = BatchReader(env, block).call([
+        (oracle, "getTimeWeightedAverage", [[(BPT_PRICE, window, 0), (PAIR_PRICE, window, 0)]]),
+        (env.liquidityGauge, "balanceOf", [snote.address]),
+        (env.balancerPool, "balanceOf", [snote.address]),
+        (snote, "totalSupply", []),
+    ])
+    return VotingPowerInputs(bptPrice, notePrice, bptInGauge + bptInPool, totalSupply)
+
+class VoteCheckpointIndex:
+    """Rebuilds the ERC20Votes checkpoints of every sNOTE delegate from DelegateVotesChanged
+    events, each event carries the delegate's votes after the change. Changes in the same
+    block overwrite that block's checkpoint like _writeCheckpoint. DelegateChanged events
+    keep the current delegate of every delegator. fromBlock must be at or before the first
+    delegation, call update again with a later block to apply only the new events.
+
+    Single queries bisect the delegate's own checkpoint list. Bulk queries use one compact
+    copy of all checkpoints, sorted by (delegate index, fromBlock) and packed into int64 keys,
+    so any number of (account, block) pairs are answered by a single searchsorted. The compact
+    copy is rebuilt on the first bulk query after an update.
+
+    Votes are the raw ERC20Votes amounts in sNOTE, votingPower converts them the way
+    sNOTE.getPastVotes does.
+    """
+
+    def __init__(self, fromBlock=0) -> None:
+        # delegate => ([fromBlock], [votes])
+        self._checkpoints = {}
+        self.delegates = {}
+        self.lastBlock = fromBlock - 1
+        self._compact = None
+
+    def update(self, address, toBlock=None, blockChunk=DEFAULT_BLOCK_CHUNK):
+        """Applies the delegation events after lastBlock up to toBlock, returns the number of
+        events applied"""
+        toBlock = chain.height if toBlock is None else toBlock
+        applied = 0
+        start = self.lastBlock + 1
+        while start <= toBlock:
+            end = min(start + blockChunk - 1, toBlock)
+            logs = web3.eth.get_logs({
+                "address": address,
+                "fromBlock": start,
+                "toBlock": end,
+                # A list in the first position matches any of the event topics
+                "topics": [[DELEGATE_CHANGED_TOPIC, DELEGATE_VOTES_CHANGED_TOPIC]]
+            })
+            for log in sorted(logs, key=lambda log: (log["blockNumber"], log["logIndex"])):
+                self.apply(log)
+                applied += 1
+            self.lastBlock = end
+            start = end + 1
+        return applied
+
+    def apply(self, log):
+        topics = log["topics"]
+        if HexBytes(topics[0]).hex() == DELEGATE_CHANGED_TOPIC:
+            self.delegates[_topicToAddress(topics[1])] = _topicToAddress(topics[3])
+            return
+
+        # DelegateVotesChanged data is (previousBalance, newBalance)
+        newBalance = int.from_bytes(HexBytes(log["data"])[32:64], "big")
+        (blocks, votes) = self._checkpoints.setdefault(_topicToAddress(topics[1]), ([], []))
+        if len(blocks) > 0 and blocks[-1] == log["blockNumber"]:
+            votes[-1] = newBalance
+        else:
+            blocks.append(log["blockNumber"])
+            votes.append(newBalance)
+        self._compact = None
+
+    def accounts(self):
+        """Every account that has had a checkpoint"""
+        return list(self._checkpoints.keys())
+
+    def checkpoints(self, account):
+        """(fromBlock, votes) pairs, the same as sNOTE.checkpoints(account, i) for each i"""
+        (blocks, votes) = self._checkpoints.get(web3.toChecksumAddress(account), ([], []))
+        return list(zip(blocks, votes))
+
+    def _checkBlock(self, block):
+        if block > self.lastBlock:
+            raise Exception("Block {} is after the last indexed block {}".format(block, self.lastBlock))
+
+    def pastVotes(self, account, block):
+        """ERC20Votes.getPastVotes, the votes of the last checkpoint at or before block"""
+        self._checkBlock(block)
+        (blocks, votes) = self._checkpoints.get(web3.toChecksumAddress(account), ([], []))
+        i = bisect_right(blocks, block)
+        return 0 if i == 0 else votes[i - 1]
+
+    def _compacted(self):
+        if self._compact is None:
+            accounts = self.accounts()
+            counts = np.array([len(self._checkpoints[a][0]) for a in accounts], dtype=np.int64)
+            blocks = np.array([b for a in accounts for b in self._checkpoints[a][0]], dtype=np.int64)
+            keys = (np.repeat(np.arange(len(accounts), dtype=np.int64), counts) << BLOCK_BITS) | blocks
+            votes = np.array([v for a in accounts for v in self._checkpoints[a][1]], dtype=object)
+            self._compact = (dict((a, i) for (i, a) in enumerate(accounts)), keys, votes)
+        return self._compact
+
+    def pastVotesMany(self, accounts, blocks):
+        """getPastVotes for every (account, block) pair, a scalar block applies to all accounts.
+        Returns an object array of exact votes."""
+        (indexes, keys, votes) = self._compacted()
+        blocks = np.broadcast_to(np.asarray(blocks, dtype=np.int64), (len(accounts),))
+        if len(blocks) > 0:
+            self._checkBlock(int(blocks.max()))
+        if len(keys) == 0:
+            return np.zeros(len(blocks), dtype=object)
+        delegate = np.array([indexes.get(web3.toChecksumAddress(a), -1) for a in accounts], dtype=np.int64)
+
+        # The last checkpoint at or before each block, it belongs to the account only if the
+        # delegate bits of its key match
+        position = np.searchsorted(keys, (delegate << BLOCK_BITS) | blocks, side="right") - 1
+        safePosition = np.maximum(position, 0)
+        found = (delegate >= 0) & (position >= 0) & ((keys[safePosition] >> BLOCK_BITS) == delegate)
+        return np.where(found, votes[safePosition], 0)
+
+    def pastVotesAll(self, block):
+        """Votes of every account with a checkpoint at block, returns (accounts, votes)"""
+        accounts = self.accounts()
+        return (accounts, self.pastVotesMany(accounts, block))
+
+    @staticmethod
+    def votingPower(votes, inputs):
+        """sNOTE.getVotingPower applied to raw votes, inputs are read at the block the
+        getPastVotes view would be called at"""
+        return getVotingPower(votes, inputs.bptPrice, inputs.notePrice, inputs.bptHeld, inputs.totalSupply)
+
+def main(block=None, fromBlock=0):
+    env = create_environment(lazy=True)
+    snote = getContract("sNOTE", EnvironmentConfig["sNOTE"], sNOTE.abi)
+    index = VoteCheckpointIndex(int(fromBlock))
+    index.update(snote.address)
+    block = index.lastBlock if block is None else int(block)
+    (accounts, votes) = index.pastVotesAll(block)
+    votingPower = index.votingPower(votes, readVotingPowerInputs(env, snote))
+    for (account, power) in sorted(zip(accounts, votingPower), key=lambda r: r[1], reverse=True):
+        if power > 0:
+            print("{} {}".format(account, power))
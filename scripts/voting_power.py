@@ -0,0 +1,149 @@
+import csv
+import json
+from brownie import web3, sNOTE
+from brownie.network.state import Chain
+from hexbytes import HexBytes
+from scripts.environment import EnvironmentConfig
+from scripts.oracle_replay import PAIR_PRICE, BPT_PRICE
+from scripts.pool_math import getVotingPower
+from scripts.registry import getContract
+
+chain = Chain()
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+TRANSFER_TOPIC = web3.keccak(text="Transfer(address,address,uint256)").hex()
+DEFAULT_BLOCK_CHUNK = 10000
+DEFAULT_WRITE_CHUNK = 10000
+
+def _topicToAddress(topic):
+    return web3.toChecksumAddress("0x" + bytes(topic)[-20:].hex())
+
+def getDeploymentBlock(address, fromBlock=0, toBlock=None):
+    """First block at which address has code, found by bisecting eth_getCode between fromBlock
+    and toBlock (the chain head by default). Blocks before a fork need an archive node."""
+    (lo, hi) = (fromBlock, chain.height if toBlock is None else toBlock)
+    if len(web3.eth.get_code(address, block_identifier=hi)) == 0:
+        raise Exception("{} has no code at block {}".format(address, hi))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if len(web3.eth.get_code(address, block_identifier=mid)) > 0:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+def defaultFromBlock(address, toBlock=None):
+    """First block a ledger of this sNOTE has to read, from the config for the mainnet sNOTE
+    and found on chain for any other deployment"""
+    if web3.toChecksumAddress(str(address)) == web3.toChecksumAddress(EnvironmentConfig["sNOTE"]):
+        return EnvironmentConfig["sNOTEStartBlock"]
+    return getDeploymentBlock(address, EnvironmentConfig["sNOTEStartBlock"], toBlock)
+
+class BalanceLedger:
+    """sNOTE balances folded from Transfer events, mints and burns are transfers from and to
+    the zero address. Call update again with a later block to apply only the new events."""
+
+    def __init__(self, fromBlock=0) -> None:
+        self.balances = {}
+        self.lastBlock = fromBlock - 1
+
+    def apply(self, sender, receiver, amount):
+        if sender != ZERO_ADDRESS:
+            self.balances[sender] = self.balances.get(sender, 0) - amount
+        if receiver != ZERO_ADDRESS:
+            self.balances[receiver] = self.balances.get(receiver, 0) + amount
+
+    def update(self, address, toBlock, blockChunk=DEFAULT_BLOCK_CHUNK):
+        start = self.lastBlock + 1
+        while start <= toBlock:
+            end = min(start + blockChunk - 1, toBlock)
+            logs = web3.eth.get_logs({
+                "address": address,
+                "fromBlock": start,
+                "toBlock": end,
+                "topics": [TRANSFER_TOPIC]
+            })
+            for log in logs:
+                self.apply(
+                    _topicToAddress(log["topics"][1]),
+                    _topicToAddress(log["topics"][2]),
+                    int.from_bytes(HexBytes(log["data"]), "big")
+                )
+            self.lastBlock = end
+            start = end + 1
+
+    def holders(self):
+        return [account for (account, balance) in self.balances.items() if balance > 0]
+
+class VotingPowerExporter:
+    """Computes votingPowerWithoutDelegation for every sNOTE holder at a block. The oracle
+    prices, BPT held and total supply are read once, per holder voting power is computed
+    locally from the balance ledger. Without a ledger or fromBlock the ledger starts at
+    defaultFromBlock."""
+
+    def __init__(self, snote, block, ledger=None, fromBlock=None) -> None:
+        self.sNOTE = snote
+        self.block = block
+        if ledger is None:
+            if fromBlock is None:
+                fromBlock = defaultFromBlock(snote.address, block)
+            ledger = BalanceLedger(fromBlock)
+        self.ledger = ledger
+        if self.ledger.lastBlock < block:
+            self.ledger.update(snote.address, block)
+        if self.ledger.lastBlock != block:
+            raise Exception("Ledger is ahead of block {}".format(block))
+
+        pool = snote.BALANCER_POOL_TOKEN(block_identifier=block)
+        oracle = getContract("BalancerPriceOracle", pool, "./abi/balancer/priceOracle.json")
+        gauge = getContract("LiquidityGauge", snote.LIQUIDITY_GAUGE(block_identifier=block), "./abi/balancer/LiquidityGauge.json")
+        poolToken = getContract("BalancerPool", pool, "./abi/balancer/pool.json")
+
+        window = snote.votingOracleWindowInSeconds(block_identifier=block)
+        (self.bptPrice, self.notePrice) = oracle.getTimeWeightedAverage(
+            [(BPT_PRICE, window, 0), (PAIR_PRICE, window, 0)],
+            block_identifier=block
+        )
+        self.bptHeld = (
+            gauge.balanceOf(snote.address, block_identifier=block) +
+            poolToken.balanceOf(snote.address, block_identifier=block)
+        )
+        self.totalSupply = snote.totalSupply(block_identifier=block)
+
+        if sum(self.ledger.balances.values()) != self.totalSupply:
+            raise Exception("Ledger balances do not match total supply at block {}".format(block))
+
+    def rows(self, chunkSize=DEFAULT_WRITE_CHUNK):
+        """Yields (account, balance, votingPower) computed in vectorized chunks"""
+        holders = self.ledger.holders()
+        for start in range(0, len(holders), chunkSize):
+            accounts = holders[start:start + chunkSize]
+            balances = [self.ledger.balances[a] for a in accounts]
+            votingPowers = getVotingPower(balances, self.bptPrice, self.notePrice, self.bptHeld, self.totalSupply)
+            for row in zip(accounts, balances, votingPowers):
+                yield row
+
+    def writeCSV(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["account", "balance", "votingPower"])
+            for (account, balance, votingPower) in self.rows():
+                writer.writerow([account, balance, votingPower])
+
+    def writeJSONL(self, path):
+        with open(path, "w") as f:
+            for (account, balance, votingPower) in self.rows():
+                f.write(json.dumps({
+                    "account": account,
+                    "balance": str(balance),
+                    "votingPower": str(votingPower)
+                }) + "\n")
+
+def main(block=None, path="voting_power.csv", fromBlock=None):
+    block = chain.height if block is None else int(block)
+    snote = getContract("sNOTE", EnvironmentConfig["sNOTE"], sNOTE.abi)
+    exporter = VotingPowerExporter(snote, block, fromBlock=None if fromBlock is None else int(fromBlock))
+    if path.endswith(".jsonl"):
+        exporter.writeJSONL(path)
+    else:
+        exporter.writeCSV(path)
@@ -0,0 +1,55 @@
+import os
+import pytest
+from brownie._config import CONFIG
+from scripts.environment import EnvironmentSnapshot, TestAccounts
+from scripts.rpc_cache import startInBackground
+
+# Tests can run on N workers with `brownie test -n N`. Brownie gives each xdist worker its
+# own forked node on the network port plus the worker index and sends whole modules to one
+# worker. Each worker builds the environments once in its own session and results are
+# aggregated by the master process as in a serial run.
+
+def pytest_configure(config):
+    # The xdist master does not run tests or launch a node
+    isMaster = config.getoption("numprocesses", None) and not hasattr(config, "workerinput")
+    if os.environ.get("RPC_CACHE_PATH") and not isMaster:
+        # Serves the fork's upstream state from a local cache (see scripts/rpc_cache.py), every
+        # worker runs its own cache server and points its node at it. The cache binds a free
+        # port, fixed ports would collide with the node ports brownie gives the workers.
+        server = startInBackground(port=0)
+        network = config.workerinput["network"] if hasattr(config, "workerinput") else CONFIG.argv["network"]
+        network = network or CONFIG.settings["networks"]["default"]
+        CONFIG.networks[network]["cmd_settings"]["fork"] = "http://127.0.0.1:{}".format(server.server_address[1])
+
+# Builds each environment variant when a test first asks for it, the per test fixtures in
+# each module snapshot and revert on top of this state. Fresh variant tests are kept in
+# test_fresh_snote.py, which runs first, so each variant is built once.
+@pytest.fixture(scope="session")
+def environments():
+    return EnvironmentSnapshot()
+
+# Returns a function that gives three whales NOTE and mints sNOTE from NOTE and ETH for each
+# of them, amounts are per holder. transferAmounts defaults to the minted NOTE.
+@pytest.fixture
+def mint_holders():
+    def mint(env, noteAmounts=(10e8, 10e8, 10e8), ethAmounts=(0, 0, 0), transferAmounts=None):
+        testAccounts = TestAccounts()
+        holders = [testAccounts.ETHWhale, testAccounts.DAIWhale, testAccounts.USDCWhale]
+        transferAmounts = noteAmounts if transferAmounts is None else transferAmounts
+        for (holder, noteAmount, ethAmount, transferAmount) in zip(holders, noteAmounts, ethAmounts, transferAmounts):
+            env.note.transfer(holder, transferAmount, {"from": env.deployer})
+            env.note.approve(env.sNOTE.address, 2**256-1, {"from": holder})
+            env.sNOTE.mintFromETH(noteAmount, 0, {"from": holder, "value": ethAmount})
+        return holders
+    return mint
+
+# Replaces brownie's module_isolation, which resets the chain and would rebuild the live
+# environment variant in every module. Tests are isolated by the snapshot and revert in each
+# module. Still needed for xdist, brownie only runs tests on workers when they use this fixture.
+@pytest.fixture(scope="module")
+def module_isolation():
+    yield
+
+@pytest.fixture(autouse=True)
+def _xdist_isolation(module_isolation):
+    pass
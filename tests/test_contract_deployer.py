@@ -0,0 +1,27 @@
+import pytest
+from types import SimpleNamespace
+from scripts.deployers.contract_deployer import getDependencyGraph, getDeploymentPlan, planLibraries
+
+def placeholder(name):
+    return "__{}{}".format(name, "_" * (38 - len(name)))
+
+def container(name, *libs):
+    return SimpleNamespace(_name=name, bytecode="6080" + "".join(placeholder(l) + "00" for l in libs))
+
+def test_dependency_graph_and_plan():
+    contracts = {
+        "LibA": container("LibA"),
+        "LibB": container("LibB", "LibA"),
+        "LibC": container("LibC"),
+        "LibD": container("LibD", "LibB", "LibC"),
+    }
+    root = container("Main", "LibD", "LibA")
+    graph = getDependencyGraph(contracts, root)
+    assert graph == {"Main": ["LibA", "LibD"], "LibD": ["LibB", "LibC"], "LibB": ["LibA"], "LibA": [], "LibC": []}
+    # Libraries shared by several dependents are only planned once
+    assert planLibraries(graph, "Main") == [["LibA", "LibC"], ["LibB"], ["LibD"]]
+    assert getDeploymentPlan(contracts, root) == (["LibA", "LibD"], [["LibA", "LibC"], ["LibB"], ["LibD"]])
+
+def test_circular_dependencies():
+    with pytest.raises(Exception):
+        planLibraries({"Main": ["LibA"], "LibA": ["LibB"], "LibB": ["LibA"]}, "Main")
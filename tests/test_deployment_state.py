@@ -0,0 +1,64 @@
+import json
+import os
+import stat
+import pytest
+from scripts.deployers.deployment_state import DeploymentState
+
+@pytest.fixture
+def configDir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open("v2.goerli.json", "w") as f:
+        json.dump({"note": "0x01", "staking": {}}, f)
+    return tmp_path
+
+def readConfig():
+    with open("v2.goerli.json", "r") as f:
+        return json.load(f)
+
+def test_save_writes_only_on_change(configDir):
+    state = DeploymentState("goerli")
+    mtime = os.stat("v2.goerli.json").st_mtime_ns
+    state.save()
+    assert os.stat("v2.goerli.json").st_mtime_ns == mtime
+
+    state.staking["sNoteProxy"] = "0x02"
+    state.save()
+    assert readConfig()["staking"]["sNoteProxy"] == "0x02"
+    # No temporary files are left behind
+    assert os.listdir(configDir) == ["v2.goerli.json"]
+
+def test_save_keeps_file_mode(configDir):
+    os.chmod("v2.goerli.json", 0o644)
+    state = DeploymentState("goerli")
+    state.staking["sNoteProxy"] = "0x02"
+    state.save()
+    assert stat.S_IMODE(os.stat("v2.goerli.json").st_mode) == 0o644
+
+def test_batch_defers_writes(configDir):
+    state = DeploymentState("goerli")
+    with state.batch():
+        state.staking["sNoteEmptyImpl"] = "0x02"
+        state.save()
+        state.staking["sNoteProxy"] = "0x03"
+        state.save()
+        assert readConfig()["staking"] == {}
+    assert readConfig()["staking"] == {"sNoteEmptyImpl": "0x02", "sNoteProxy": "0x03"}
+
+def test_batch_flushes_on_failure(configDir):
+    state = DeploymentState("goerli")
+    with pytest.raises(Exception):
+        with state.batch():
+            state.staking["sNoteProxy"] = "0x02"
+            state.save()
+            raise Exception("deployment failed")
+    assert readConfig()["staking"]["sNoteProxy"] == "0x02"
+
+def test_fork_does_not_persist(configDir):
+    with open("v2.mainnet.json", "w") as f:
+        json.dump({"staking": {}}, f)
+    state = DeploymentState("hardhat-fork")
+    assert state.network == "mainnet"
+    state.staking["sNoteProxy"] = "0x02"
+    state.save()
+    with open("v2.mainnet.json", "r") as f:
+        assert json.load(f)["staking"] == {}
@@ -0,0 +1,155 @@
+import pytest
+import eth_abi
+from brownie.convert.datatypes import Wei
+from brownie.network.state import Chain
+from scripts.environment import TestAccounts, EnvironmentConfig, ETH_ADDRESS
+from scripts.pool_math import getVotingPower
+from scripts.voting_power import VotingPowerExporter, defaultFromBlock
+from scripts.vote_checkpoints import VoteCheckpointIndex, readVotingPowerInputs
+
+# Tests on a fresh deployment of sNOTE. Only one environment variant is live at a time, so
+# they are kept in this module, which runs before the mainnet variant modules, and each
+# variant is built once per session.
+
+chain = Chain()
+@pytest.fixture(autouse=True)
+def run_around_tests():
+    chain.snapshot()
+    yield
+    chain.revert()
+
+def test_pool_share_ratio(environments):
+    env = environments.get(useFresh=True)
+    testAccounts = TestAccounts()
+    env.note.transfer(testAccounts.ETHWhale, 150e8, {"from": env.deployer})
+    env.note.transfer(testAccounts.DAIWhale, 100e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.DAIWhale})
+
+    # [EXACT_TOKENS_IN_FOR_BPT_OUT, [ETH, NOTE], minBPTOut]
+    env.note.approve(env.balancerVault.address, 2**256-1, {"from": testAccounts.ETHWhale})
+    userData = eth_abi.encode_abi(
+        ['uint256', 'uint256[]', 'uint256'],
+        [1, [0, Wei(1e8)], 0]
+    )
+
+    env.balancerVault.joinPool(
+        env.poolId,
+        testAccounts.ETHWhale,
+        testAccounts.ETHWhale,
+        (
+            [ETH_ADDRESS, env.note.address],
+            [0, 50e8],
+            userData,
+            False
+        ),
+        { "from": testAccounts.ETHWhale }
+    )
+
+    assert env.sNOTE.totalSupply() == 0
+    initialBPTBalance = env.liquidityGauge.balanceOf(env.sNOTE.address)
+
+    txn1 = env.sNOTE.mintFromETH(100e8, 0, {"from": testAccounts.ETHWhale})
+    bptFrom1 = txn1.events['Transfer'][1]['value']
+    bptAdded = env.balancerPool.balanceOf(testAccounts.ETHWhale) / 2
+
+    env.balancerPool.transfer(env.sNOTE.address, bptAdded, {"from": testAccounts.ETHWhale})
+
+    # stakeAll must be called after donating BPT to sNOTE
+    env.sNOTE.stakeAll({"from": env.deployer})
+
+    txn2 = env.sNOTE.mintFromETH(100e8, 0, {"from": testAccounts.DAIWhale})
+    bptFrom2 = txn2.events['Transfer'][1]['value']
+
+    # Test that the pool share of the second minter does not accrue balances of those from the first
+    poolTokenShare1 = env.sNOTE.poolTokenShareOf(testAccounts.ETHWhale)
+    poolTokenShare2 = env.sNOTE.poolTokenShareOf(testAccounts.DAIWhale)
+
+    assert pytest.approx(poolTokenShare1, abs=1) == bptFrom1 + bptAdded + initialBPTBalance
+    assert pytest.approx(poolTokenShare2, abs=1) == bptFrom2
+
+    bptAdded2 = env.balancerPool.balanceOf(testAccounts.ETHWhale)
+
+    # Test that additional tokens are split between the two holders proportionally
+    env.balancerPool.transfer(env.sNOTE.address, bptAdded2, {"from": testAccounts.ETHWhale})
+
+    # stakeAll must be called after donating BPT to sNOTE
+    env.sNOTE.stakeAll({"from": env.deployer})
+
+    sNOTEBalance1 = env.sNOTE.balanceOf(testAccounts.ETHWhale)
+    sNOTEBalance2 = env.sNOTE.balanceOf(testAccounts.DAIWhale)
+    totalSupply = env.sNOTE.totalSupply()
+    poolTokenShare3 = env.sNOTE.poolTokenShareOf(testAccounts.ETHWhale)
+    poolTokenShare4 = env.sNOTE.poolTokenShareOf(testAccounts.DAIWhale)
+    assert pytest.approx(poolTokenShare3, abs=1000) == bptFrom1 + bptAdded + initialBPTBalance + (bptAdded2 * sNOTEBalance1 / totalSupply)
+    assert pytest.approx(poolTokenShare4, abs=1000) == bptFrom2 + (bptAdded2 * sNOTEBalance2 / totalSupply)
+
+def test_voting_power_exporter(environments, mint_holders, tmp_path):
+    env = environments.get(useFresh=True)
+    testAccounts = TestAccounts()
+    # The fresh sNOTE was deployed by the build and has no supply yet, the ledger starts after
+    # the block the build ran at
+    assert env.sNOTE.totalSupply() == 0
+    fromBlock = chain.height + 1
+
+    holders = mint_holders(env)
+    env.sNOTE.transfer(testAccounts.WBTCWhale, env.sNOTE.balanceOf(holders[0]) / 3, {"from": holders[0]})
+    chain.sleep(env.sNOTE.votingOracleWindowInSeconds() + 1)
+    chain.mine()
+
+    block = chain.height
+    exporter = VotingPowerExporter(env.sNOTE, block, fromBlock=fromBlock)
+    rows = list(exporter.rows(chunkSize=2))
+    assert len(rows) == 4
+    for (account, balance, votingPower) in rows:
+        assert balance == env.sNOTE.balanceOf(account, block_identifier=block)
+        assert votingPower == env.sNOTE.votingPowerWithoutDelegation(account, block_identifier=block)
+    # The mainnet sNOTE ledger starts at the configured block, no node requests are needed
+    assert defaultFromBlock(EnvironmentConfig["sNOTE"], block) == EnvironmentConfig["sNOTEStartBlock"]
+    # No voting power while the oracle has no NOTE price
+    balances = [balance for (_, balance, _) in rows]
+    assert list(getVotingPower(balances, exporter.bptPrice, 0, exporter.bptHeld, exporter.totalSupply)) == [0] * 4
+
+    exporter.writeCSV(tmp_path / "voting_power.csv")
+    exporter.writeJSONL(tmp_path / "voting_power.jsonl")
+    assert len((tmp_path / "voting_power.csv").read_text().splitlines()) == 5
+    assert len((tmp_path / "voting_power.jsonl").read_text().splitlines()) == 4
+
+def test_vote_checkpoint_index_matches_past_votes(environments, mint_holders):
+    env = environments.get(useFresh=True)
+    index = VoteCheckpointIndex(chain.height + 1)
+    fromBlock = chain.height + 1
+
+    # Leaves NOTE for a second mint
+    holders = mint_holders(env, [5e8, 5e8, 5e8], transferAmounts=[10e8, 10e8, 10e8])
+    env.sNOTE.delegate(holders[0], {"from": holders[0]})
+    env.sNOTE.delegate(holders[0], {"from": holders[1]})
+    assert index.update(env.sNOTE.address) == 4
+
+    env.sNOTE.transfer(holders[1], env.sNOTE.balanceOf(holders[2]) / 2, {"from": holders[2]})
+    env.sNOTE.delegate(holders[2], {"from": holders[2]})
+    env.sNOTE.mintFromETH(5e8, 0, {"from": holders[1]})
+    chain.sleep(env.sNOTE.votingOracleWindowInSeconds() + 1)
+    chain.mine()
+    assert index.update(env.sNOTE.address, blockChunk=2) == 4
+    assert index.delegates == {holders[0]: holders[0], holders[1]: holders[0], holders[2]: holders[2]}
+
+    for account in holders:
+        expected = [env.sNOTE.checkpoints(account, i) for i in range(env.sNOTE.numCheckpoints(account))]
+        assert index.checkpoints(account) == expected
+
+    head = chain.height
+    blocks = list(range(fromBlock, head))
+    pairs = [(account, block) for account in holders for block in blocks]
+    votes = index.pastVotesMany([a for (a, _) in pairs], [b for (_, b) in pairs])
+    assert list(votes) == [index.pastVotes(a, b) for (a, b) in pairs]
+    votingPower = index.votingPower(votes, readVotingPowerInputs(env, env.sNOTE, head))
+    for ((account, block), power) in zip(pairs, votingPower):
+        assert power == env.sNOTE.getPastVotes(account, block, block_identifier=head)
+
+    (accounts, votes) = index.pastVotesAll(head - 1)
+    assert sorted(accounts) == sorted([holders[0], holders[2]])
+    # Every holder delegates, the delegates hold all the votes
+    assert sum(votes) == env.sNOTE.totalSupply()
+    with pytest.raises(Exception):
+        index.pastVotes(holders[0], index.lastBlock + 1)
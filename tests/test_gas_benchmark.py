@@ -0,0 +1,17 @@
+import pytest
+from scripts.gas_benchmark import runBenchmarks, loadBaseline, findRegressions
+
+# runBenchmarks snapshots the chain and reverts to it after every case, this module has no
+# snapshot fixture of its own
+
+def test_gas_regressions(environments):
+    baseline = loadBaseline()
+    if baseline is None:
+        pytest.skip("No gas baseline, record one with `brownie run gas_benchmark` and commit tests/gas_baseline.json")
+
+    results = runBenchmarks(environments.get())
+    regressions = findRegressions(results, baseline)
+    assert regressions == [], "\n".join(
+        "{}[{}] used {} gas, baseline {}".format(name, size, gasUsed, expected)
+        for (name, size, expected, gasUsed) in regressions
+    )
@@ -0,0 +1,69 @@
+import json
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scripts.rpc_cache import RPCCache, serve
+
+class _Upstream(BaseHTTPRequestHandler):
+    received = []
+
+    def do_POST(self):
+        batch = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.received.extend(batch)
+        payload = json.dumps([
+            {"jsonrpc": "2.0", "id": r["id"], "result": "{}:{}".format(r["method"], ",".join(r["params"]))}
+            for r in batch
+        ]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+def _start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return "http://127.0.0.1:{}".format(server.server_address[1])
+
+def _post(url, body):
+    return requests.post(url, json=body).json()
+
+def test_record_then_replay_offline(tmp_path):
+    upstream = ThreadingHTTPServer(("127.0.0.1", 0), _Upstream)
+    upstreamURL = _start(upstream)
+    path = str(tmp_path / "cache.db")
+    storage = {"jsonrpc": "2.0", "id": 7, "method": "eth_getStorageAt", "params": ["0xabc", "0x0", "0xf3e710"]}
+    latest = {"jsonrpc": "2.0", "id": 8, "method": "eth_getBalance", "params": ["0xabc", "latest"]}
+
+    recorder = serve(RPCCache(path, upstreamURL, record=True), 0)
+    url = _start(recorder)
+    assert _post(url, storage)["result"] == "eth_getStorageAt:0xabc,0x0,0xf3e710"
+    assert len(_post(url, [storage, latest])) == 2
+    # The pinned storage read is served from the cache the second time, "latest" is not cached
+    assert [r["method"] for r in _Upstream.received] == ["eth_getStorageAt", "eth_getBalance"]
+    recorder.shutdown()
+    recorder.cache.close()
+
+    replayer = serve(RPCCache(path, upstream=None, record=False), 0)
+    url = _start(replayer)
+    upstream.shutdown()
+    response = _post(url, dict(storage, id=42))
+    assert response == {"jsonrpc": "2.0", "id": 42, "result": "eth_getStorageAt:0xabc,0x0,0xf3e710"}
+    assert "error" in _post(url, latest)
+    assert replayer.cache.hits == 1 and replayer.cache.misses == 1
+    replayer.shutdown()
+    replayer.cache.close()
+
+def test_moving_block_tags_in_filters_are_not_cached():
+    def getLogs(filter):
+        return {"jsonrpc": "2.0", "id": 1, "method": "eth_getLogs", "params": [filter]}
+
+    assert RPCCache.isCacheable(getLogs({"address": "0xabc", "fromBlock": "0x1", "toBlock": "0xf3e710"}))
+    assert RPCCache.isCacheable(getLogs({"address": "0xabc", "blockHash": "0x01"}))
+    assert not RPCCache.isCacheable(getLogs({"address": "0xabc", "fromBlock": "0x1", "toBlock": "latest"}))
+    assert not RPCCache.isCacheable(getLogs({"address": "0xabc", "fromBlock": "finalized", "toBlock": "0xf3e710"}))
+    # A missing end of the range is "latest"
+    assert not RPCCache.isCacheable(getLogs({"address": "0xabc", "fromBlock": "0x1"}))
+    call = {"jsonrpc": "2.0", "id": 1, "method": "eth_call", "params": [{"to": "0xabc"}, {"blockNumber": "latest"}]}
+    assert not RPCCache.isCacheable(call)
@@ -1,10 +1,22 @@
+import asyncio
 import pytest
 import brownie
 import eth_abi
 from brownie import accounts, sNOTE, interface
 from brownie.convert.datatypes import Wei
 from brownie.network.state import Chain
-from scripts.environment import TestAccounts, Environment, create_environment, ETH_ADDRESS
+from scripts.environment import TestAccounts, Environment, ETH_ADDRESS, LazyComponents, create_environment
+from scripts.pool_math import PoolState
+from scripts.multicall import BatchReader
+from scripts.async_reader import AsyncReader
+from scripts.profiling import Profiler, span
+from scripts.oracle_replay import OracleReplay, PAIR_PRICE, BPT_PRICE
+from scripts.registry import getContract
+from scripts.event_indexer import EventIndexer
+from scripts.cooldown_scheduler import CooldownScheduler
+from scripts.bal_rewards import BALRewardTracker, LedgerEntry
+from scripts.share_price import SharePriceSeries
+from scripts.shortfall_simulator import ShortfallModel, Scenario, runSimulation, SHORTFALL_WITHDRAW_COOLDOWN_DAYS
 
 chain = Chain()
 @pytest.fixture(autouse=True)
@@ -13,14 +25,30 @@ def run_around_tests():
     yield
     chain.revert()
 
-def test_name_and_symbol():
-    env = create_environment()
+def test_name_and_symbol(environments):
+    env = environments.get()
     assert env.sNOTE.name() == "Staked NOTE"
     assert env.sNOTE.symbol() == "sNOTE"
 
 # Governance methods
-def test_upgrade_snote():
-    env = create_environment()
+def test_lazy_environment_builds_on_first_access(environments):
+    built = environments.get()
+    env = create_environment(lazy=True)
+    assert [c for c in LazyComponents if c in vars(env)] == []
+
+    # Only the accessed component and its dependencies are built
+    assert env.sNOTE.address == built.sNOTE.address
+    assert "sNOTE" in vars(env)
+    assert "treasuryManager" not in vars(env)
+    assert "tradingModule" not in vars(env)
+    assert env.sNOTE.votingOracleWindowInSeconds() == 3600
+
+    assert env.treasuryManager.address == built.treasuryManager.address
+    assert "treasuryManager" in vars(env)
+    assert "tradingModule" not in vars(env)
+
+def test_upgrade_snote(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
 
     sNOTEImpl = sNOTE.deploy(
@@ -39,8 +67,8 @@ def test_upgrade_snote():
 
     env.sNOTE.upgradeTo(sNOTEImpl.address, {"from": env.deployer})
     
-def test_set_cooldown_time():
-    env = create_environment()
+def test_set_cooldown_time(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
 
     with brownie.reverts("Ownable: caller is not the owner"):
@@ -49,8 +77,8 @@ def test_set_cooldown_time():
     env.sNOTE.setCoolDownTime(200, {"from": env.deployer})
     assert env.sNOTE.coolDownTimeInSeconds() == 200
 
-def test_extract_tokens_for_shortfall():
-    env = create_environment()
+def test_extract_tokens_for_shortfall(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
 
     with brownie.reverts("Ownable: caller is not the owner"):
@@ -86,8 +114,8 @@ def test_extract_tokens_for_shortfall():
     env.sNOTE.extractTokensForCollateralShortfall(1e8, {"from": env.deployer})
 
 
-def test_extract_tokens_for_shortfall_cap():
-    env = create_environment()
+def test_extract_tokens_for_shortfall_cap(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
 
     bptBefore = env.liquidityGauge.balanceOf(env.sNOTE.address)
@@ -95,8 +123,8 @@ def test_extract_tokens_for_shortfall_cap():
     bptAfter = env.liquidityGauge.balanceOf(env.sNOTE.address)
     assert pytest.approx(bptAfter / bptBefore, rel=1e-9) == 0.5
 
-def test_set_swap_fee_percentage():
-    env = create_environment()
+def test_set_swap_fee_percentage(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
 
     with brownie.reverts("Ownable: caller is not the owner"):
@@ -106,8 +134,8 @@ def test_set_swap_fee_percentage():
     assert env.balancerPool.getSwapFeePercentage() == 0.03e18
 
 # User methods
-def test_mint_from_bpt():
-    env = create_environment()
+def test_mint_from_bpt(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 100e8, {"from": env.deployer})
     env.note.approve(env.balancerVault.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -150,74 +178,8 @@ def test_mint_from_bpt():
     assert env.balancerPool.balanceOf(testAccounts.ETHWhale) == 0
     assert pytest.approx(env.sNOTE.getPoolTokenShare(env.sNOTE.balanceOf(testAccounts.ETHWhale)), abs=100) == bptBalance
 
-def test_pool_share_ratio():
-    env = create_environment(useFresh = True)
-    testAccounts = TestAccounts()
-    env.note.transfer(testAccounts.ETHWhale, 150e8, {"from": env.deployer})
-    env.note.transfer(testAccounts.DAIWhale, 100e8, {"from": env.deployer})
-    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
-    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.DAIWhale})
-
-    # [EXACT_TOKENS_IN_FOR_BPT_OUT, [ETH, NOTE], minBPTOut]
-    env.note.approve(env.balancerVault.address, 2**256-1, {"from": testAccounts.ETHWhale})
-    userData = eth_abi.encode_abi(
-        ['uint256', 'uint256[]', 'uint256'],
-        [1, [0, Wei(1e8)], 0]
-    )
-
-    env.balancerVault.joinPool(
-        env.poolId,
-        testAccounts.ETHWhale,
-        testAccounts.ETHWhale,
-        (
-            [ETH_ADDRESS, env.note.address],
-            [0, 50e8],
-            userData,
-            False
-        ),
-        { "from": testAccounts.ETHWhale }
-    )
-
-    assert env.sNOTE.totalSupply() == 0
-    initialBPTBalance = env.liquidityGauge.balanceOf(env.sNOTE.address)
-
-    txn1 = env.sNOTE.mintFromETH(100e8, 0, {"from": testAccounts.ETHWhale})
-    bptFrom1 = txn1.events['Transfer'][1]['value']
-    bptAdded = env.balancerPool.balanceOf(testAccounts.ETHWhale) / 2
-
-    env.balancerPool.transfer(env.sNOTE.address, bptAdded, {"from": testAccounts.ETHWhale})
-
-    # stakeAll must be called after donating BPT to sNOTE
-    env.sNOTE.stakeAll({"from": env.deployer})
-
-    txn2 = env.sNOTE.mintFromETH(100e8, 0, {"from": testAccounts.DAIWhale})
-    bptFrom2 = txn2.events['Transfer'][1]['value']
-
-    # Test that the pool share of the second minter does not accrue balances of those from the first
-    poolTokenShare1 = env.sNOTE.poolTokenShareOf(testAccounts.ETHWhale)
-    poolTokenShare2 = env.sNOTE.poolTokenShareOf(testAccounts.DAIWhale)
-
-    assert pytest.approx(poolTokenShare1, abs=1) == bptFrom1 + bptAdded + initialBPTBalance
-    assert pytest.approx(poolTokenShare2, abs=1) == bptFrom2
-
-    bptAdded2 = env.balancerPool.balanceOf(testAccounts.ETHWhale)
-
-    # Test that additional tokens are split between the two holders proportionally
-    env.balancerPool.transfer(env.sNOTE.address, bptAdded2, {"from": testAccounts.ETHWhale})
-
-    # stakeAll must be called after donating BPT to sNOTE
-    env.sNOTE.stakeAll({"from": env.deployer})
-
-    sNOTEBalance1 = env.sNOTE.balanceOf(testAccounts.ETHWhale)
-    sNOTEBalance2 = env.sNOTE.balanceOf(testAccounts.DAIWhale)
-    totalSupply = env.sNOTE.totalSupply()
-    poolTokenShare3 = env.sNOTE.poolTokenShareOf(testAccounts.ETHWhale)
-    poolTokenShare4 = env.sNOTE.poolTokenShareOf(testAccounts.DAIWhale)
-    assert pytest.approx(poolTokenShare3, abs=1000) == bptFrom1 + bptAdded + initialBPTBalance + (bptAdded2 * sNOTEBalance1 / totalSupply)
-    assert pytest.approx(poolTokenShare4, abs=1000) == bptFrom2 + (bptAdded2 * sNOTEBalance2 / totalSupply)
-
-def test_mint_from_note_and_eth():
-    env = create_environment()
+def test_mint_from_note_and_eth(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 100e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -228,8 +190,8 @@ def test_mint_from_note_and_eth():
     assert (gaugeAfter - gaugeBefore) == txn.events['SNoteMinted'][0]['bptChangeAmount']
     assert env.sNOTE.balanceOf(testAccounts.ETHWhale) > 0
 
-def test_mint_from_note():
-    env = create_environment()
+def test_mint_from_note(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 100e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -240,8 +202,8 @@ def test_mint_from_note():
     assert (gaugeAfter - gaugeBefore) == txn.events['SNoteMinted'][0]['bptChangeAmount']
     assert env.sNOTE.balanceOf(testAccounts.ETHWhale) > 0
 
-def test_mint_from_eth():
-    env = create_environment()
+def test_mint_from_eth(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 100e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -252,8 +214,8 @@ def test_mint_from_eth():
     assert (gaugeAfter - gaugeBefore) == txn.events['SNoteMinted'][0]['bptChangeAmount']
     assert env.sNOTE.balanceOf(testAccounts.ETHWhale) > 0
 
-def test_mint_from_weth():
-    env = create_environment()
+def test_mint_from_weth(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.weth.approve(env.sNOTE.address, 2**255 - 1, {"from": testAccounts.WETHWhale})
 
@@ -263,8 +225,8 @@ def test_mint_from_weth():
     assert (gaugeAfter - gaugeBefore) == txn.events['SNoteMinted'][0]['bptChangeAmount']
     assert env.sNOTE.balanceOf(testAccounts.WETHWhale) > 0
 
-def test_mint_from_weth_and_note():
-    env = create_environment()
+def test_mint_from_weth_and_note(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.WETHWhale, 100e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256 - 1, {"from": testAccounts.WETHWhale})
@@ -280,8 +242,8 @@ def test_mint_from_weth_and_note():
     poolTokenShare = env.sNOTE.getPoolTokenShare(env.sNOTE.balanceOf(testAccounts.WETHWhale))
     assert pytest.approx(txn.events["SNoteMinted"]["bptChangeAmount"], abs=10) == poolTokenShare
 
-def test_no_mint_during_cooldown():
-    env = create_environment()
+def test_no_mint_during_cooldown(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -292,8 +254,8 @@ def test_no_mint_during_cooldown():
         env.sNOTE.mintFromETH.call(1e8, 0,{"from": testAccounts.ETHWhale})
         env.sNOTE.mintFromWETH.call(1e8, 0, 0, {"from": testAccounts.ETHWhale})
 
-def test_redeem():
-    env = create_environment()
+def test_redeem(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -346,8 +308,8 @@ def test_redeem():
     with brownie.reverts("Not in Redemption Window"):
         env.sNOTE.redeem.call(env.sNOTE.balanceOf(testAccounts.ETHWhale), 0, 0, True, {"from": testAccounts.ETHWhale})
 
-def test_transfer():
-    env = create_environment()
+def test_transfer(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -359,8 +321,8 @@ def test_transfer():
     env.sNOTE.transfer(env.deployer, 1e8, {"from": testAccounts.ETHWhale})
     assert env.sNOTE.balanceOf(env.deployer) == 1e8
 
-def test_no_transfer_during_cooldown():
-    env = create_environment()
+def test_no_transfer_during_cooldown(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -379,8 +341,8 @@ def test_no_transfer_during_cooldown():
     env.sNOTE.transfer(env.deployer, 1e8, {"from": testAccounts.ETHWhale})
     assert env.sNOTE.balanceOf(env.deployer) == 1e8
 
-def test_transfer_with_delegates():
-    env = create_environment()
+def test_transfer_with_delegates(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -405,8 +367,8 @@ def test_transfer_with_delegates():
     assert env.sNOTE.getVotes(testAccounts.ETHWhale) == 0
     assert env.sNOTE.getVotes(env.deployer) == votesStarting
 
-def test_cannot_transfer_inside_redeem_window():
-    env = create_environment()
+def test_cannot_transfer_inside_redeem_window(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
     env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
@@ -439,8 +401,8 @@ def test_cannot_transfer_inside_redeem_window():
     # Can transfer once you leave the redemption window
     env.sNOTE.transfer(env.deployer, env.sNOTE.balanceOf(testAccounts.ETHWhale), {"from": testAccounts.ETHWhale})
 
-def test_get_voting_power_single_staker_price_increasing():
-    env = create_environment()
+def test_get_voting_power_single_staker_price_increasing(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.weth.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
     env.note.approve(env.sNOTEProxy.address, 2 ** 255, {"from": testAccounts.WETHWhale})
@@ -497,8 +459,8 @@ def test_get_voting_power_single_staker_price_increasing():
     assert pytest.approx(votingPower, rel=1e-4) == 479505172
     assert pytest.approx(votingPower / totalVotingPower, rel=1e-4) == supplyShare
 
-def test_get_voting_power_single_staker_price_decreasing_fast():
-    env = create_environment()
+def test_get_voting_power_single_staker_price_decreasing_fast(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.weth.transfer(testAccounts.NOTEWhale.address, 100e18, {"from": testAccounts.WETHWhale})
     env.note.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.NOTEWhale})
@@ -531,8 +493,8 @@ def test_get_voting_power_single_staker_price_decreasing_fast():
     assert pytest.approx(votingPower / totalVotingPower, abs=1e-8) == supplyShare
 
 
-def test_get_voting_power_single_staker_price_decreasing_slow():
-    env = create_environment()
+def test_get_voting_power_single_staker_price_decreasing_slow(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     env.weth.transfer(testAccounts.NOTEWhale.address, 100e18, {"from": testAccounts.WETHWhale})
     env.note.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.NOTEWhale})
@@ -579,8 +541,8 @@ def test_get_voting_power_single_staker_price_decreasing_slow():
     assert pytest.approx(votingPower, rel=1e-4) == 799220505
     assert pytest.approx(votingPower / totalVotingPower, rel=1e-4) == supplyShare
 
-def testClaimBAL():
-    env = create_environment()
+def testClaimBAL(environments):
+    env = environments.get()
     testAccounts = TestAccounts()
     balBefore = env.bal.balanceOf(env.treasuryManager)
     chain.sleep(10 * 24 * 3600)
@@ -596,4 +558,305 @@ def testClaimBAL():
     balClaimed = env.bal.balanceOf(env.treasuryManager) - balBefore
     assert pytest.approx(balClaimed, rel=1e-4) == 153211217317450103292
     assert txn.events["ClaimedBAL"]["balAmount"] == balClaimed
-    
\ No newline at end of file
+
+def test_pool_math_matches_views(environments, mint_holders):
+    env = environments.get()
+    holders = mint_holders(env, [10e8, 20e8, 30e8], [1e17, 2e17, 3e17])
+
+    state = PoolState.fromEnvironment(env)
+    balances = [env.sNOTE.balanceOf(holder) for holder in holders] + [0, 1, env.sNOTE.totalSupply()]
+    (wethClaims, noteClaims) = state.tokenClaim(balances)
+    poolTokenShares = state.poolTokenShare(balances)
+    (bptWethClaims, bptNoteClaims) = state.tokenClaimForBPT(balances)
+
+    for (i, amount) in enumerate(balances):
+        assert poolTokenShares[i] == env.sNOTE.getPoolTokenShare(amount)
+        assert (wethClaims[i], noteClaims[i]) == env.sNOTE.getTokenClaim(amount)
+        assert (bptWethClaims[i], bptNoteClaims[i]) == env.sNOTE.getTokenClaimForBPT(amount)
+
+    for (i, holder) in enumerate(holders):
+        assert poolTokenShares[i] == env.sNOTE.poolTokenShareOf(holder)
+        assert (wethClaims[i], noteClaims[i]) == env.sNOTE.tokenClaimOf(holder)
+
+    assert state.noteSpotPrice() == env.treasuryManager._getNOTESpotPrice()
+
+def test_batch_reader_matches_views(environments, mint_holders):
+    env = environments.get()
+    holders = mint_holders(env)
+    chain.sleep(env.sNOTE.votingOracleWindowInSeconds() + 1)
+    chain.mine()
+
+    accounts = holders + [env.deployer, env.treasuryManager.address]
+    # Small chunks to exercise aggregation across several eth_calls
+    reader = BatchReader(env, chunkSize=2)
+    assert reader.block == chain.height
+
+    tokenClaims = reader.tokenClaimOf(accounts)
+    poolTokenShares = reader.poolTokenShareOf(accounts)
+    votingPowers = reader.votingPowerWithoutDelegation(accounts)
+    for (i, account) in enumerate(accounts):
+        assert tokenClaims[i] == env.sNOTE.tokenClaimOf(account)
+        assert poolTokenShares[i] == env.sNOTE.poolTokenShareOf(account)
+        assert votingPowers[i] == env.sNOTE.votingPowerWithoutDelegation(account)
+
+    # Results are pinned to the reader's block
+    env.sNOTE.transfer(env.deployer, env.sNOTE.balanceOf(holders[0]), {"from": holders[0]})
+    assert reader.balanceOf(holders[:1]) == [env.sNOTE.balanceOf(holders[0], block_identifier=reader.block)]
+
+def test_oracle_replay_matches_pool_oracle(environments):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    env.note.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
+    env.buyNOTE(1e8, testAccounts.WETHWhale)
+    chain.sleep(1800)
+    chain.mine()
+    env.sellNOTE(5e7, testAccounts.WETHWhale)
+    chain.sleep(600)
+    chain.mine()
+
+    replay = OracleReplay.fromEnvironment(env)
+    block = chain.height
+    now = chain[block].timestamp
+    oracle = getContract("BalancerPriceOracle", env.balancerPool.address, "./abi/balancer/priceOracle.json")
+    queries = [(variable, secs, ago) for variable in [PAIR_PRICE, BPT_PRICE] for secs in [600, 3600] for ago in [0, 900]]
+    expected = oracle.getTimeWeightedAverage(queries, block_identifier=block)
+
+    for (i, (variable, secs, ago)) in enumerate(queries):
+        assert replay.timeWeightedAverage(variable, secs, now, ago) == expected[i]
+        assert replay.timeWeightedAverages(variable, secs, [now], ago)[0] == expected[i]
+
+def test_event_indexer_resumes_from_checkpoint(environments, tmp_path):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    fromBlock = chain.height + 1
+    indexer = EventIndexer.forContracts(
+        str(tmp_path / "events.db"),
+        snote=env.sNOTE.address,
+        treasuryManager=env.treasuryManager.address,
+        fromBlock=fromBlock,
+        blockChunk=2
+    )
+
+    env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
+    mintTxn = env.sNOTE.mintFromETH(1e8, 0, {"from": testAccounts.ETHWhale})
+    env.sNOTE.startCoolDown({"from": testAccounts.ETHWhale})
+    assert indexer.run() == 2
+
+    chain.mine(timestamp=(chain.time() + env.sNOTE.coolDownTimeInSeconds() + 5))
+    env.sNOTE.redeem(env.sNOTE.balanceOf(testAccounts.ETHWhale) / 2, 0, 0, True, {"from": testAccounts.ETHWhale})
+    # Only the redeem is new, earlier blocks are behind the checkpoint
+    assert indexer.run() == 1
+    assert indexer.run() == 0
+
+    events = indexer.events(contract=env.sNOTE.address)
+    assert [e["event"] for e in events] == ["SNoteMinted", "CoolDownStarted", "SNoteRedeemed"]
+    minted = indexer.events(event="SNoteMinted")[0]
+    assert minted["transactionHash"] == mintTxn.txid
+    assert minted["args"]["account"] == testAccounts.ETHWhale
+    assert minted["args"]["bptChangeAmount"] == mintTxn.events["SNoteMinted"]["bptChangeAmount"]
+    indexer.close()
+
+def test_shortfall_simulator_respects_cap_and_cooldown(environments):
+    env = environments.get()
+    poolState = PoolState.fromEnvironment(env)
+    model = ShortfallModel.fromPoolState(poolState, poolState.noteSpotPrice())
+    # The model starts from the current pool price
+    (weth, note) = model.balancesAtPrice(model.invariant, model.notePrice)
+    assert pytest.approx(weth, rel=1e-9) == model.wethBalance
+    assert pytest.approx(note, rel=1e-9) == model.noteBalance
+    # Claims go through pool_math.getTokenClaim, the float state only rounds the raw amounts
+    (wethClaim, noteClaim) = poolState.tokenClaim([poolState.totalSupply])
+    assert pytest.approx(model.startClaim(), rel=1e-9) == (wethClaim[0], noteClaim[0])
+
+    scenario = Scenario(days=60, shortfallRate=50.0, shortfallMedian=1e6)
+    result = runSimulation(model, scenario, paths=1000, seed=1, pathsPerWorker=500)
+    assert len(result.totalLoss) == 1000
+    # One extraction per cooldown period, each one at most half of the remaining BPT
+    assert result.extractions.max() <= scenario.days // (SHORTFALL_WITHDRAW_COOLDOWN_DAYS + 1) + 1
+    assert (result.shortfallLoss <= 1 - 0.5 ** result.extractions + 1e-9).all()
+    assert (result.shortfallLoss >= -1e-9).all()
+
+    # Same seed, same paths
+    again = runSimulation(model, scenario, paths=1000, seed=1, pathsPerWorker=500)
+    assert (again.totalLoss == result.totalLoss).all()
+
+def test_cooldown_scheduler_matches_contract(environments, tmp_path):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    indexer = EventIndexer.forContracts(
+        str(tmp_path / "events.db"),
+        snote=env.sNOTE.address,
+        treasuryManager=env.treasuryManager.address,
+        fromBlock=chain.height + 1
+    )
+    scheduler = CooldownScheduler(env.sNOTE.coolDownTimeInSeconds())
+
+    env.sNOTE.setCoolDownTime(300, {"from": env.deployer})
+    env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
+    env.sNOTE.mintFromETH(1e8, 0, {"from": testAccounts.ETHWhale})
+    env.sNOTE.startCoolDown({"from": testAccounts.ETHWhale})
+    env.sNOTE.startCoolDown({"from": testAccounts.WETHWhale})
+    assert scheduler.update(indexer, env.sNOTE.address) == 3
+    assert scheduler.coolDownTimeInSeconds == 300
+
+    for account in [testAccounts.ETHWhale, testAccounts.WETHWhale]:
+        window = scheduler.window(account)
+        assert window.begin == env.sNOTE.accountRedeemWindowBegin(account)
+        assert window.end == window.begin + env.sNOTE.REDEEM_WINDOW_SECONDS()
+    begin = scheduler.window(testAccounts.ETHWhale).begin
+    assert len(scheduler.windowsOpening(chain.time(), chain.time() + 300)) == 2
+    assert not scheduler.canRedeem(testAccounts.ETHWhale, chain.time())
+
+    env.sNOTE.stopCoolDown({"from": testAccounts.WETHWhale})
+    assert scheduler.update(indexer, env.sNOTE.address) == 1
+    assert scheduler.window(testAccounts.WETHWhale) is None
+    assert [w.account for w in scheduler.windowsOpening(begin - 300, begin + 300)] == [testAccounts.ETHWhale]
+    assert [(t.kind, t.account) for t in scheduler.due(begin)] == [("open", testAccounts.ETHWhale)]
+
+    chain.mine(timestamp=begin + 5)
+    assert scheduler.canRedeem(testAccounts.ETHWhale, chain.time())
+    env.sNOTE.redeem(env.sNOTE.balanceOf(testAccounts.ETHWhale) / 2, 0, 0, True, {"from": testAccounts.ETHWhale})
+    indexer.close()
+
+def test_async_reader_matches_views(environments, mint_holders):
+    env = environments.get()
+    holders = mint_holders(env)
+    env.sNOTE.startCoolDown({"from": holders[0]})
+    block = chain.height
+
+    async def read():
+        # An in flight limit below the number of calls so requests queue
+        async with AsyncReader(env, maxInFlight=2) as reader:
+            assert reader.block == block
+            balances = await reader.balanceOf(holders)
+            windows = await reader.accountRedeemWindowBegin(holders)
+            supply = await reader.totalSupply()
+            poolTokens = await reader.getPoolTokens()
+            failed = await reader.callMany([(env.sNOTE, "getPoolTokenShare", [2**256 - 1])], allowFailure=True)
+            return (balances, windows, supply, poolTokens, failed)
+
+    (balances, windows, supply, poolTokens, failed) = asyncio.run(read())
+    assert balances == [env.sNOTE.balanceOf(h) for h in holders]
+    assert windows == [env.sNOTE.accountRedeemWindowBegin(h) for h in holders]
+    assert supply == env.sNOTE.totalSupply()
+    assert poolTokens == env.balancerVault.getPoolTokens(env.poolId)
+    assert failed == [None]
+
+    # Results are pinned to the reader's block
+    env.sNOTE.mintFromETH(1e8, 0, {"from": holders[1]})
+    async def readPinned():
+        async with AsyncReader(env, block=block) as reader:
+            return await reader.balanceOf(holders[1:2])
+    assert asyncio.run(readPinned()) == [balances[1]]
+
+def test_profiler_records_calls_and_transactions(environments, tmp_path):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    with Profiler() as profiler:
+        with span("mint"):
+            env.note.transfer(testAccounts.ETHWhale, 1e8, {"from": env.deployer})
+            env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
+            txn = env.sNOTE.mintFromETH(1e8, 0, {"from": testAccounts.ETHWhale, "value": 1e18})
+        env.sNOTE.balanceOf(testAccounts.ETHWhale)
+
+    stats = dict((r["name"], r) for r in profiler.summary())
+    assert stats["sNOTE.mintFromETH"]["count"] == 1
+    assert stats["sNOTE.mintFromETH"]["gasUsed"] == txn.gas_used
+    assert stats["sNOTE.balanceOf"]["kind"] == "call"
+    assert stats["mint"]["rpcCalls"] > 0
+    assert profiler.rpcCalls >= stats["mint"]["rpcCalls"] + stats["sNOTE.balanceOf"]["rpcCalls"]
+
+    path = str(tmp_path / "profile.folded")
+    profiler.writeFolded(path)
+    with open(path) as f:
+        stacks = [line.rsplit(" ", 1)[0] for line in f.read().splitlines()]
+    assert "mint;sNOTE.mintFromETH" in stacks
+    assert "sNOTE.balanceOf" in stacks
+
+    # Nothing is recorded once the profiler is disabled
+    env.sNOTE.balanceOf(testAccounts.ETHWhale)
+    assert profiler.stats["sNOTE.balanceOf"].count == 1
+
+def test_bal_reward_tracker_ledger(environments, tmp_path):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    # Mints the BAL accrued before the tracked window, nothing is claimable at its start
+    start = env.treasuryManager.claimBAL({"from": env.treasuryManager.manager()}).timestamp
+    indexer = EventIndexer.forContracts(
+        str(tmp_path / "events.db"),
+        snote=env.sNOTE.address,
+        treasuryManager=env.treasuryManager.address,
+        liquidityGauge=env.liquidityGauge.address,
+        fromBlock=chain.height + 1
+    )
+    tracker = BALRewardTracker(env.sNOTE.address, env.treasuryManager.address, env.liquidityGauge.address, env.bal.address)
+    chain.sleep(10 * 24 * 3600)
+    chain.mine()
+    env.gaugeController.vote_for_gauge_weights("0xcD4722B7c24C29e0413BDCd9e51404B4539D14aE", 0, {"from": testAccounts.veBALWhale})
+    chain.sleep(10 * 24 * 3600)
+    chain.mine()
+    env.gaugeController.vote_for_gauge_weights(env.liquidityGauge.address, 10000, {"from": testAccounts.veBALWhale})
+    chain.sleep(10 * 24 * 3600)
+    chain.mine()
+    txn = env.treasuryManager.claimBAL({"from": env.treasuryManager.manager()})
+    claimed = txn.events["ClaimedBAL"]["balAmount"]
+    assert tracker.update(indexer, env) == 1
+    assert tracker.ledger(start, chain.time()) == [LedgerEntry(txn.timestamp, txn.block_number, "claimed", claimed)]
+    # Accrual is measured from the sample before the indexer's first block
+    assert tracker.accruals[0].blockNumber == indexer.fromBlock - 1
+    assert tracker.summary(start, chain.time()) == (claimed, claimed, 0)
+    # Claiming mints everything accrued so far
+    assert tracker.accruals[-1].claimable == 0
+    assert tracker.accruals[-1].accrued == env.balancerMinter.minted(env.sNOTE.address, env.liquidityGauge.address)
+
+    chain.sleep(86400)
+    chain.mine()
+    assert tracker.update(indexer, env) == 0
+    (before, after) = tracker.accruals[-2:]
+    assert after.claimable > 0
+    assert tracker.summary(before.timestamp, after.timestamp).accrued == after.claimable
+    projected = tracker.project(before.timestamp, after.timestamp)
+    assert pytest.approx(projected.total, rel=5e-2) == after.claimable
+
+    tracker.save(str(tmp_path / "bal_rewards.json"))
+    loaded = BALRewardTracker.load(str(tmp_path / "bal_rewards.json"))
+    assert loaded.ledger(start, chain.time()) == tracker.ledger(start, chain.time())
+    assert loaded.summary(start, chain.time()) == tracker.summary(start, chain.time())
+    assert loaded.project(after.timestamp, after.timestamp + 30 * 86400) == tracker.project(after.timestamp, after.timestamp + 30 * 86400)
+    assert loaded.lastEvent == tracker.lastEvent
+    indexer.close()
+
+def test_share_price_series_matches_views(environments):
+    env = environments.get()
+    testAccounts = TestAccounts()
+    series = SharePriceSeries.fromEnvironment(env)
+    start = chain.height
+
+    env.note.transfer(testAccounts.ETHWhale, 10e8, {"from": env.deployer})
+    env.note.approve(env.sNOTE.address, 2**256-1, {"from": testAccounts.ETHWhale})
+    env.sNOTE.mintFromETH(10e8, 0, {"from": testAccounts.ETHWhale})
+    # Swaps move the pool balances without touching sNOTE
+    env.weth.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
+    env.buyNOTE(1e18, testAccounts.WETHWhale)
+    assert series.update() > 0
+
+    env.sNOTE.startCoolDown({"from": testAccounts.ETHWhale})
+    chain.mine(timestamp=(chain.time() + env.sNOTE.coolDownTimeInSeconds() + 5))
+    env.sNOTE.redeem(env.sNOTE.balanceOf(testAccounts.ETHWhale) / 2, 0, 0, True, {"from": testAccounts.ETHWhale})
+    env.sNOTE.extractTokensForCollateralShortfall(env.liquidityGauge.balanceOf(env.sNOTE.address) * 0.3, {"from": env.deployer})
+    chain.mine()
+    assert series.update() > 0
+    assert series.update() == 0
+
+    points = series.series()
+    exact = series.changePoints()
+    assert len(points.block) == chain.height - start + 1
+    for (block, index) in zip(points.block, points.changeIndex):
+        assert exact.bptPerShare[index] == env.sNOTE.getPoolTokenShare(1e18, block_identifier=int(block))
+        assert (exact.wethPerShare[index], exact.notePerShare[index]) == env.sNOTE.getTokenClaim(1e18, block_identifier=int(block))
+    assert points.bptPerShare[-1] == exact.bptPerShare[-1] / 1e18
+    # The shortfall extraction lowers the BPT behind every sNOTE
+    assert points.bptPerShare[-1] < points.bptPerShare[0]
+
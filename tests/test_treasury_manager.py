@@ -3,9 +3,22 @@ import pytest
 import brownie
 import eth_abi
 import json
-from brownie import Contract, ZERO_ADDRESS, Wei
+from brownie import Contract, ZERO_ADDRESS, Wei, accounts
 from brownie.network.state import Chain
-from scripts.environment import create_environment, TestAccounts
+from scripts.environment import TestAccounts, Order, EnvironmentConfig
+from scripts.order_signing import hashAndSignOrders
+from scripts.invest_planner import InvestPlanner
+from scripts.harvest_planner import HarvestPlanner, HarvestCandidate, HARVEST_RESERVES, HARVEST_INTEREST
+from scripts.chainlink_replay import ChainlinkAdapterReplay
+from scripts.trade_encoding import (
+    TRADE_ABI_TYPE,
+    dex_flags,
+    trade_type_flags,
+    encode_univ3_single_data,
+    encode_univ3_batch_data,
+    encode_trade,
+    encode_execute_trades
+)
 from scripts.common import (
     DEX_ID, 
     TRADE_TYPE, 
@@ -22,9 +35,9 @@ def run_around_tests():
     yield
     chain.revert()
 
-def test_set_price_oracle_non_owner():
+def test_set_price_oracle_non_owner(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     with brownie.reverts():
         env.treasuryManager.setPriceOracle.call(
             env.dai.address, 
@@ -32,21 +45,21 @@ def test_set_price_oracle_non_owner():
             {"from": testAccounts.WETHWhale}
         )
 
-def test_set_slippage_limit_non_owner():
+def test_set_slippage_limit_non_owner(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     with brownie.reverts():
         env.treasuryManager.setSlippageLimit.call(env.dai.address, 0.9e8, {"from": testAccounts.WETHWhale})
 
-def test_set_note_purchase_limit_non_owner():
+def test_set_note_purchase_limit_non_owner(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     with brownie.reverts():
         env.treasuryManager.setNOTEPurchaseLimit.call(0.2e8, {"from": testAccounts.WETHWhale})
 
-def test_invest_eth():
+def test_invest_eth(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     env.treasuryManager.setManager(testAccounts.testManager, { "from": env.deployer })
     env.weth.transfer(env.treasuryManager.address, 1e18, {"from": testAccounts.WETHWhale})
     env.weth.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
@@ -62,9 +75,9 @@ def test_invest_eth():
     bptAfter = env.liquidityGauge.balanceOf(env.sNOTE.address)
     assert pytest.approx(bptAfter, rel=1e-2) == 2794037790183842568520045
 
-def test_dex_trading():
+def test_dex_trading(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     env.treasuryManager.setManager(testAccounts.testManager, { "from": env.deployer})
     env.tradingModule.setTokenPermissions(
         env.treasuryManager.address, 
@@ -102,9 +115,9 @@ def get_metastable_amounts(poolContext, amount):
     secondaryAmount = amount - primaryAmount
     return (Wei(primaryAmount), Wei(secondaryAmount))
 
-def test_reinvestment_events():
+def test_reinvestment_events(environments):
     testAccounts = TestAccounts()
-    env = create_environment()
+    env = environments.get()
     env.treasuryManager.setManager(testAccounts.testManager, { "from": env.deployer})
     with open("abi/vaults/balancer/MetaStable2TokenAuraVault.json", "r") as f:
         vaultABI = json.load(f);
@@ -161,4 +174,129 @@ def test_reinvestment_events():
     assert event["primaryAmount"] == ret[1]
     assert event["secondaryAmount"] == ret[2]
     assert event["poolClaimAmount"] == ret[3]
-    assert event["strategyTokenAmount"] == ret[4]
\ No newline at end of file
+    assert event["strategyTokenAmount"] == ret[4]
+
+def test_local_order_hash_and_batch_sign(environments):
+    env = environments.get()
+    signer = accounts.add()
+    now = chain.time()
+    orders = [
+        Order(env.assetProxy, signer.address, env.dai.address, (i + 1) * 1e18, env.weth.address, 1e15, now + i)
+        for i in range(5)
+    ]
+    for order in orders:
+        assert order.hash(env.exchangeV3) == order.onChainHash(env.exchangeV3)
+
+    # Small chunks spread the batch over the process pool
+    signed = hashAndSignOrders(orders, env.exchangeV3, signer, processes=2, chunkSize=2)
+    assert [orderHash for (orderHash, _) in signed] == [order.hash(env.exchangeV3) for order in orders]
+    assert [signature for (_, signature) in signed] == [order.sign(env.exchangeV3, signer) for order in orders]
+
+def test_invest_planner_matches_invest(environments):
+    testAccounts = TestAccounts()
+    env = environments.get()
+    env.treasuryManager.setManager(testAccounts.testManager, { "from": env.deployer })
+    env.treasuryManager.setNOTEPurchaseLimit(0.01e8, { "from": env.deployer })
+    env.weth.transfer(env.treasuryManager.address, 10e18, {"from": testAccounts.WETHWhale})
+    env.weth.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
+    env.note.approve(env.balancerVault.address, 2 ** 255, {"from": testAccounts.WETHWhale})
+    # Initialize price oracle
+    env.buyNOTE(1e8, testAccounts.WETHWhale)
+    env.sellNOTE(1e8, testAccounts.WETHWhale)
+    chain.sleep(3600)
+    chain.mine()
+
+    planner = InvestPlanner.fromEnvironment(env)
+    plan = planner.plan(
+        env.weth.balanceOf(env.treasuryManager.address),
+        env.note.balanceOf(env.treasuryManager.address)
+    )
+    assert plan.spotPrice <= plan.maxPrice
+    # Unused burn trade, noteBurnPercent is zero
+    trade = [TRADE_TYPE["EXACT_IN_SINGLE"], env.weth.address, env.note.address, 0, 0, chain.time() + 20000, bytes()]
+
+    # One more wei of WETH over the planned amount fails the price check
+    if plan.wethAmount < env.weth.balanceOf(env.treasuryManager.address):
+        with brownie.reverts("price impact is too high"):
+            env.treasuryManager.investWETHAndNOTE.call(
+                plan.wethAmount + 1, plan.noteAmount, 0, trade, {"from": testAccounts.testManager}
+            )
+
+    bptBefore = env.balancerPool.balanceOf(env.sNOTE.address) + env.liquidityGauge.balanceOf(env.sNOTE.address)
+    env.treasuryManager.investWETHAndNOTE(
+        plan.wethAmount, plan.noteAmount, plan.minBPT, trade, {"from": testAccounts.testManager}
+    )
+    bptAfter = env.balancerPool.balanceOf(env.sNOTE.address) + env.liquidityGauge.balanceOf(env.sNOTE.address)
+    assert bptAfter - bptBefore == plan.bptOut
+    assert env.treasuryManager._getNOTESpotPrice() == plan.spotPrice
+
+# Addresses from the config so the encoding checks do not need the forked environment
+ENCODING_PATH = [EnvironmentConfig["BAL"], 3000, EnvironmentConfig["WETH"], 500, EnvironmentConfig["wstETH"]]
+ENCODING_TRADES = [
+    [TRADE_TYPE["EXACT_IN_SINGLE"], EnvironmentConfig["COMP"], EnvironmentConfig["WETH"], 10e18, 0, 2**31, get_univ3_single_data(3000)],
+    [TRADE_TYPE["EXACT_IN_BATCH"], EnvironmentConfig["BAL"], EnvironmentConfig["wstETH"], 2**255, 1, 2**32, get_univ3_batch_data(ENCODING_PATH)],
+    [TRADE_TYPE["EXACT_OUT_SINGLE"], EnvironmentConfig["COMP"], EnvironmentConfig["WETH"], 1, 2**256 - 1, 0, b""],
+]
+
+def test_trade_encoding_matches_helpers():
+    assert dex_flags("UNISWAP_V2", "UNISWAP_V3") == set_dex_flags(0, UNISWAP_V2=True, UNISWAP_V3=True)
+    assert dex_flags("ZERO_EX", "CURVE", "NOTIONAL_VAULT") == set_dex_flags(0, ZERO_EX=True, CURVE=True, NOTIONAL_VAULT=True)
+    assert trade_type_flags("EXACT_IN_SINGLE", "EXACT_OUT_BATCH") == set_trade_type_flags(0, EXACT_IN_SINGLE=True, EXACT_OUT_BATCH=True)
+
+    assert encode_univ3_single_data(3000) == get_univ3_single_data(3000)
+    assert encode_univ3_batch_data(ENCODING_PATH) == get_univ3_batch_data(ENCODING_PATH)
+    assert encode_univ3_batch_data(ENCODING_PATH[:3]) == get_univ3_batch_data(ENCODING_PATH[:3])
+
+    for trade in ENCODING_TRADES:
+        assert encode_trade(trade) == eth_abi.encode_abi([TRADE_ABI_TYPE], [trade])
+
+def test_execute_trade_encoding_matches_abi(environments):
+    env = environments.get()
+    calldata = encode_execute_trades(ENCODING_TRADES, DEX_ID["UNISWAP_V3"])
+    for (trade, data) in zip(ENCODING_TRADES, calldata):
+        assert "0x" + data.hex() == env.treasuryManager.executeTrade.encode_input(trade, DEX_ID["UNISWAP_V3"])
+
+def test_chainlink_adapter_replay_matches_oracle(environments, tmp_path):
+    env = environments.get()
+    replay = ChainlinkAdapterReplay.fromEnvironment(env, chain.time() - 2 * 86400)
+    expected = env.COMPOracle.latestRoundData()
+    rounds = replay.priceAt(chain.time())
+    assert rounds.valid[0]
+    assert rounds.answer[0] == expected["answer"]
+    assert rounds.roundId[0] == expected["roundId"]
+    assert rounds.updatedAt[0] == expected["updatedAt"]
+
+    # Every point in the series is a change in one of the feeds
+    series = replay.series()
+    assert len(series.timestamp) <= len(replay.base) + len(replay.quote)
+    assert series.answer[-1] == expected["answer"]
+
+    path = str(tmp_path / "rounds.json")
+    replay.save(path)
+    assert (ChainlinkAdapterReplay.load(path).series().answer == series.answer).all()
+
+def test_harvest_planner_excess_reserves(environments):
+    env = environments.get()
+    planner = HarvestPlanner.fromEnvironment(env, gasPrice=1)
+    for c in planner.candidates:
+        excess = env.notional.getReserveBalance(c.currencyId) - env.notional.getReserveBuffer(c.currencyId)
+        assert c.assetCash == excess and c.assetCash > 0
+    worthwhile = [c.currencyId for c in planner.candidates if c.valueETH > c.gas]
+    assert sum([b.currencies for b in planner.plan()], []) == sorted(worthwhile)
+
+    candidates = [HarvestCandidate(i, 0, 0, value, 100) for (i, value) in [(1, 500), (2, 200), (3, 50), (4, 90)]]
+    # Currencies 3 and 4 do not cover their own gas, the rest are split when over the gas limit
+    planner = HarvestPlanner(candidates, gasPrice=1, baseGas=50, maxGasPerTx=250)
+    assert [(b.currencies, b.netETH) for b in planner.plan()] == [([1, 2], 450)]
+    planner = HarvestPlanner(candidates, gasPrice=1, baseGas=50, maxGasPerTx=150)
+    assert [(b.currencies, b.netETH) for b in planner.plan()] == [([1], 350), ([2], 50)]
+    planner = HarvestPlanner(candidates, gasPrice=2, baseGas=50, maxGasPerTx=150)
+    assert [(b.currencies, b.netETH) for b in planner.plan()] == [([1], 200)]
+
+    # Interest is harvested by its own method, a currency can be in a batch for each
+    planner = HarvestPlanner(candidates, gasPrice=1, baseGas=50, maxGasPerTx=250)
+    interest = [HarvestCandidate(1, 0, 0, 300, 100), HarvestCandidate(3, 0, 0, 20, 100)]
+    assert [(b.method, b.currencies, b.netETH) for b in planner.plan(interest)] == [
+        (HARVEST_RESERVES, [1, 2], 450),
+        (HARVEST_INTEREST, [1], 150),
+    ]